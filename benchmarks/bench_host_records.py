@@ -0,0 +1,112 @@
+"""
+Memory benchmark for the compact host records of helpers.py. Decodes the
+responses the infoblox integration holds in memory, built from a synthetic
+world (see synthetic_world.py), the way it did before and with the records,
+and reports the bytes per host and the decode time of each:
+
+  wapi       a WAPI multi-object response of ipv4address lookups, as
+             _GetHostBatch receives it: json dicts vs. Host_Record
+  inventory  an /inventory/search page with every field, as a cluster that
+             ignores dimensions returns it: the projected dicts vs. the
+             Inventory_Record of ParseInventoryPage
+
+Bytes are counted by walking everything a decoded response references, with
+every object counted once, so text shared between hosts (interned network
+views, subnets and attribute names and values) is only paid for once.
+
+Usage: python bench_host_records.py [hosts] [extattrs]
+"""
+
+# pylint: disable=invalid-name
+
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ecoScripts', 'infoblox', 'Image'))
+
+from helpers import Host_Record, Record, Tetration_Helper
+from synthetic_world import World
+
+HOSTS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+EXTATTRS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+
+def deep_size(obj):
+    ''' Bytes of obj and of everything it references, each object once. '''
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif isinstance(obj, Record):
+            stack.extend([getattr(obj, slot) for slot in obj.__slots__ if hasattr(obj, slot)])
+    return total
+
+
+def legacy_projection(content, dimensions):
+    ''' ParseInventoryPage before the records: projected dicts. '''
+    wanted = set(dimensions)
+    def project(pairs):
+        if any(key == 'results' for key, _ in pairs):
+            return dict(pairs)
+        return dict((key, value) for key, value in pairs if key in wanted)
+    return json.loads(content, object_pairs_hook=project)
+
+
+def measure(decode):
+    ''' Decode time and bytes of one decode, and its first hosts to compare. '''
+    # the other result is gone by now, so the collector of one decode does
+    # not walk the objects of the other
+    start = time.time()
+    result = decode()
+    seconds = time.time() - start
+    hosts = result['results'] if isinstance(result, dict) else result
+    return seconds, deep_size(result), hosts[:1000]
+
+
+def report(name, old, new, hosts):
+    (old_seconds, old_bytes, _), (new_seconds, new_bytes, _) = old, new
+    print
+    print name
+    print 'dicts:    %6.0f bytes/host, decoded in %.2f us/host' % (float(old_bytes) / hosts, old_seconds / hosts * 1e6)
+    print 'records:  %6.0f bytes/host, decoded in %.2f us/host' % (float(new_bytes) / hosts, new_seconds / hosts * 1e6)
+    print 'saved:    %.0f%% of the bytes' % (100.0 * (old_bytes - new_bytes) / old_bytes)
+
+
+def main():
+    world = World(HOSTS, extattrs=EXTATTRS)
+    print 'hosts: %d, extattrs: %d' % (HOSTS, EXTATTRS)
+
+    # one list of results per lookup, as the request object returns them
+    wapi = json.dumps([[world.host_record(i)] for i in xrange(HOSTS)])
+    old = measure(lambda: json.loads(wapi))
+    new = measure(lambda: Host_Record.Decode(wapi))
+    for [host], [record] in zip(old[2], new[2]):
+        assert record.ip_address == host['ip_address'] and list(record.names) == host['names']
+        assert record.network == host['network'] and record.network_view == host['network_view']
+        assert record.extattrs == dict((name, attr['value']) for name, attr in host['extattrs'].items())
+    report('wapi (%d bytes/host of json)' % (len(wapi) / HOSTS), old, new, HOSTS)
+
+    # ParseInventoryPage does not use the helper's state
+    tetration = Tetration_Helper.__new__(Tetration_Helper)
+    dimensions = tetration.InventoryDimensions()
+    inventory = json.dumps({'results': [world.inventory(i) for i in xrange(HOSTS)], 'offset': ''})
+    old = measure(lambda: legacy_projection(inventory, dimensions))
+    new = measure(lambda: tetration.ParseInventoryPage(inventory, dimensions))
+    for host, record in zip(old[2], new[2]):
+        assert all(record[field] == host[field] for field in dimensions)
+    report('inventory (%s)' % ', '.join(dimensions), old, new, HOSTS)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark for the inventory dimensions projection in Tetration_Helper.
+Builds synthetic /inventory/search pages the way the cluster returns them and
+reports the bytes per page and the peak RSS of parsing a page, for:
+
+  full       no dimensions: every field is sent and decoded (the old query)
+  projected  InventoryDimensions(): the cluster sends only ip and vrf_id
+  hook       every field is sent but ParseInventoryPage drops the extra
+             fields while decoding (a cluster that ignores dimensions)
+
+Each mode runs in its own process so peak RSS is not shared between them.
+
+Usage: python bench_inventory_projection.py [hosts per page] [pages]
+"""
+
+# pylint: disable=invalid-name
+
+import os
+import sys
+import json
+import time
+import random
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ecoScripts', 'infoblox', 'Image'))
+
+PAGE_SIZE = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+PAGES = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+MODES = ['full', 'projected', 'hook']
+
+
+def full_record(i):
+    ''' An inventory record with the fields a typical cluster returns. '''
+    record = {
+        'ip': '10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255),
+        'vrf_id': 1, 'vrf_name': 'Default', 'address_type': 'IPV4', 'netmask': '255.255.255.0',
+        'host_name': 'host-%06d.example.com' % i, 'host_uuid': '%032x' % random.getrandbits(128),
+        'os': 'CentOS', 'os_version': '7.4', 'platform': 'linux-amd64', 'agent_type': 'ENFORCER',
+        'last_software_update_at': 1538000000 + i, 'data_plane_disabled': False,
+        'interfaces': [{'name': 'eth0', 'ip': '10.0.0.1', 'mac': '00:50:56:00:00:01', 'vrf': 'Default'}],
+        'tags_scope_id': ['%024x' % random.getrandbits(96) for _ in range(4)],
+        'user_orchestrator_system/name': 'vcenter', 'user_orchestrator_system/cluster': 'cluster-1',
+    }
+    for n in range(20):
+        record['user_annotation_%d' % n] = 'value-%d-%d' % (n, i)
+    return record
+
+
+def build_page(page, dimensions):
+    results = []
+    for i in range(page * PAGE_SIZE, (page + 1) * PAGE_SIZE):
+        record = full_record(i)
+        if dimensions:
+            record = dict((k, v) for k, v in record.items() if k in dimensions)
+        results.append(record)
+    return json.dumps({'results': results, 'offset': 'page-%d' % (page + 1)})
+
+
+def run_mode(mode):
+    ''' Parses PAGES pages in this process and prints one JSON result line. '''
+    from helpers import Tetration_Helper
+    parse = Tetration_Helper.ParseInventoryPage.__func__
+    dimensions = Tetration_Helper.INVENTORY_DIMENSIONS
+    random.seed(42)
+    bodies = [build_page(p, dimensions if mode == 'projected' else None) for p in range(PAGES)]
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    # keep two pages alive, like the bounded queue in front of the enrich stage
+    held = []
+    for body in bodies:
+        page = parse(None, body, None if mode == 'full' else dimensions)
+        held = (held + [page['results']])[-2:]
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    print json.dumps({'mode': mode, 'bytes_per_page': sum(len(b) for b in bodies) // PAGES,
+                      'parse_ms_per_page': round(elapsed / PAGES * 1e3, 2), 'peak_rss_kb': peak})
+
+
+def main():
+    if len(sys.argv) > 3:
+        run_mode(sys.argv[3])
+        return
+    print 'hosts per page: %d, pages: %d' % (PAGE_SIZE, PAGES)
+    print '%-10s %15s %15s %15s' % ('mode', 'bytes/page', 'parse ms/page', 'peak RSS KB')
+    for mode in MODES:
+        out = subprocess.check_output([sys.executable, os.path.abspath(__file__), str(PAGE_SIZE), str(PAGES), mode])
+        result = json.loads(out.strip().splitlines()[-1])
+        print '%-10s %15d %15.2f %15d' % (mode, result['bytes_per_page'], result['parse_ms_per_page'], result['peak_rss_kb'])
+
+if __name__ == "__main__":
+    main()
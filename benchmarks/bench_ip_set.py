@@ -0,0 +1,81 @@
+"""
+Micro-benchmark for the scope IP handoff between get_scope_ips.py and
+collect_inventory.py. Compares loading ip.json into a Python set of strings
+with reading the packed IP set file written by ip_set.write_ip_set.
+
+Usage: python bench_ip_set.py [scope addresses] [lookups]
+"""
+
+# pylint: disable=invalid-name
+
+import os
+import sys
+import json
+import time
+import random
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ecoScripts', 'vcenter', 'Image'))
+
+from ip_set import IpSet, write_ip_set
+
+ADDRESSES = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+LOOKUPS = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+
+def max_rss_mb():
+    ''' Peak resident set size of this process in MB (Linux reports KB). '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main():
+    random.seed(42)
+    ips = ['10.%d.%d.%d' % (random.randint(0, 255), random.randint(0, 255), random.randint(1, 254))
+           for _ in range(ADDRESSES)]
+    lookups = random.sample(ips, LOOKUPS // 2) + \
+        ['172.16.%d.%d' % (random.randint(0, 255), random.randint(1, 254)) for _ in range(LOOKUPS // 2)]
+
+    workdir = tempfile.mkdtemp()
+    json_path = os.path.join(workdir, 'ip.json')
+    bin_path = os.path.join(workdir, 'ip.bin')
+    with open(json_path, 'w') as outfile:
+        json.dump(ips, outfile)
+    count = write_ip_set(ips, bin_path)
+    del ips
+
+    # measure the packed file first so the JSON set does not inflate its RSS
+    rss = max_rss_mb()
+    start = time.time()
+    packed = IpSet(bin_path)
+    packed_load = time.time() - start
+    start = time.time()
+    packed_found = [ip in packed for ip in lookups]
+    packed_lookup = (time.time() - start) / len(lookups)
+    packed_rss = max_rss_mb() - rss
+
+    rss = max_rss_mb()
+    start = time.time()
+    with open(json_path) as infile:
+        strings = set(json.load(infile))
+    json_load = time.time() - start
+    start = time.time()
+    json_found = [ip in strings for ip in lookups]
+    json_lookup = (time.time() - start) / len(lookups)
+    json_rss = max_rss_mb() - rss
+
+    assert packed_found == json_found
+    print 'addresses: %d (%d unique), lookups: %d' % (ADDRESSES, count, len(lookups))
+    print 'file size:    ip.json %.1f MB, ip.bin %.1f MB' % (
+        os.path.getsize(json_path) / 1048576.0, os.path.getsize(bin_path) / 1048576.0)
+    print 'load:         ip.json %.1f ms, ip.bin %.3f ms' % (json_load * 1e3, packed_load * 1e3)
+    print 'lookup:       ip.json %.2f us, ip.bin %.2f us' % (json_lookup * 1e6, packed_lookup * 1e6)
+    print 'peak RSS:     ip.json +%.1f MB, ip.bin +%.1f MB' % (json_rss, packed_rss)
+
+    packed.close()
+    os.remove(json_path)
+    os.remove(bin_path)
+    os.rmdir(workdir)
+
+if __name__ == "__main__":
+    main()
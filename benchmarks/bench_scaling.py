@@ -0,0 +1,202 @@
+"""
+Scaling benchmark for the per-host work of the integrations. Runs each stage
+over synthetic worlds of growing size (see synthetic_world.py) and reports the
+time per host and the peak resident memory, so the size at which a stage stops
+scaling linearly shows up as a growing "us_per_item" or a peak RSS that grows
+faster than the input.
+
+Stages:
+--annotate: the rows of an Annotation_Plan and the CSV writer, the row
+    building of annotate-hosts.py, over the Infoblox record of every host
+--filters: CreateInventoryFilters over every commented subnet, AddSubnets
+    over every subnet and HasSubnetFilterForIp for every host, as
+    create-inventory-filters.py does
+--csvdiff: diff_inventory.py (which replaced Get-CsvDiffs) over two
+    consecutive vCenter inventories with 5% churn
+
+Every stage and size runs in its own process, so the peak RSS of one does not
+hide that of the next. Input is generated in pages outside the timed section
+and never held in memory at once, except where the stage itself keeps it.
+
+Usage: python bench_scaling.py [--sizes 10000,100000,1000000] [--stage NAME ...] [--world-seed N]
+                               [--extattrs N] [--output FILE]
+"""
+
+# pylint: disable=invalid-name
+
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+from synthetic_world import World, SCOPE_ID, INVENTORY_HEADINGS, write_inventory_csvs
+
+IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ecoScripts')
+STAGES = ['annotate', 'filters', 'csvdiff']
+# hosts handed to the timed code at a time, the default QUERY_LIMIT
+PAGE_SIZE = 1000
+
+# ============================================================================
+# Stages
+# ----------------------------------------------------------------------------
+
+def annotation_columns(world, overload):
+    ''' The COLUMNS of annotate-hosts.py with every annotation enabled. '''
+    return [
+        {'annotationName': 'Infoblox Hostname', 'infobloxName': 'names'},
+        {'annotationName': 'Infoblox Zone', 'infobloxName': 'zone'},
+        {'annotationName': 'Infoblox View', 'infobloxName': 'network_view'},
+        {'annotationName': 'Infoblox Subnet', 'infobloxName': 'network'},
+        {'annotationName': 'Infoblox EA', 'infobloxName': 'extattrs', 'overload': overload,
+         'attrList': [{'value': name} for name in world.extattr_names]}
+    ]
+
+def pages(items, size=PAGE_SIZE):
+    page = []
+    for item in items:
+        page.append(item)
+        if len(page) == size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+def stage_annotate(world, workdir, args):
+    sys.path.insert(0, os.path.join(IMAGE, 'infoblox', 'Image'))
+    from helpers import Annotation_Plan, Host_Record
+
+    plan = Annotation_Plan(annotation_columns(world, args.overload))
+    seconds = 0.0
+    rows = 0
+    with open(os.path.join(workdir, 'annotations.csv'), 'wb') as csv_file:
+        # the writer of Upload_Batcher
+        writer = csv.DictWriter(csv_file, fieldnames=plan.fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        for page in pages(Host_Record.FromWapi(world.host_record(i)) for i in xrange(world.hosts) if world.in_ipam(i)):
+            started = time.time()
+            writer.writerows(plan.Rows(page))
+            seconds += time.time() - started
+            rows += len(page)
+    return rows, seconds, {'csv_bytes': os.path.getsize(os.path.join(workdir, 'annotations.csv'))}
+
+def stage_filters(world, workdir, args):
+    sys.path.insert(0, os.path.join(IMAGE, 'infoblox', 'Image'))
+    # both are always set in the container
+    os.environ.setdefault('FILTERS_APP_SCOPE_ID', json.dumps([{'value': SCOPE_ID}]))
+    os.environ.setdefault('SCOPE_RESTRICTED', 'off')
+    from helpers import Tetration_Helper
+
+    tetration = Tetration_Helper('https://127.0.0.1', 'benchmark', 'benchmark', None, {})
+    networks = [world.network_record(j) for j in xrange(world.subnets)]
+    commented = [n for n in networks if n.get('comment')]
+
+    started = time.time()
+    tetration.CreateInventoryFilters(commented)
+    create = time.time() - started
+
+    started = time.time()
+    tetration.AddSubnets([n['network'] for n in networks])
+    add = time.time() - started
+
+    lookup = 0.0
+    found = 0
+    for page in pages(world.ip(i) for i in xrange(world.hosts)):
+        started = time.time()
+        found += sum(1 for ip in page if tetration.HasSubnetFilterForIp(ip))
+        lookup += time.time() - started
+    return world.hosts, create + add + lookup, {
+        'filters': len(tetration.filters), 'subnets': len(networks), 'covered_hosts': found,
+        'create_seconds': round(create, 3), 'add_subnets_seconds': round(add, 3),
+        'lookup_seconds': round(lookup, 3)}
+
+def stage_csvdiff(world, workdir, args):
+    sys.path.insert(0, os.path.join(IMAGE, 'vcenter', 'Image'))
+    from diff_inventory import diff_inventory
+
+    previous = os.path.join(workdir, 'previous.csv')
+    current = os.path.join(workdir, 'current.csv')
+    old_rows, new_rows = write_inventory_csvs(world, previous, current, args.churn, INVENTORY_HEADINGS)
+    started = time.time()
+    counts = diff_inventory(previous, current, os.path.join(workdir, 'upload.csv'),
+                            os.path.join(workdir, 'delete.csv'), os.path.join(workdir, 'inventory.csv'))
+    seconds = time.time() - started
+    counts.update({'previous_rows': old_rows, 'current_rows': new_rows})
+    return old_rows + new_rows, seconds, counts
+
+# ============================================================================
+# Main
+# ----------------------------------------------------------------------------
+
+def run_child(args):
+    ''' Runs one stage at one size in this process and prints its result. '''
+    world = World(args.hosts, seed=args.world_seed, extattrs=args.extattrs)
+    workdir = tempfile.mkdtemp(prefix='bench_scaling_')
+    try:
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        items, seconds, details = globals()['stage_' + args.child](world, workdir, args)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print json.dumps({
+        'stage': args.child,
+        'hosts': world.hosts,
+        'items': items,
+        'seconds': round(seconds, 3),
+        'us_per_item': round(seconds * 1e6 / max(items, 1), 2),
+        'baseline_rss_kb': baseline,
+        'peak_rss_kb': peak,
+        'details': details
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how the per-host stages scale with the number of hosts.')
+    parser.add_argument('--sizes', default='10000,100000', help='comma separated numbers of hosts')
+    parser.add_argument('--stage', action='append', choices=STAGES, help='stage to run, may be repeated (default: all)')
+    parser.add_argument('--world-seed', type=int, default=0)
+    parser.add_argument('--extattrs', type=int, default=4, help='extensible attributes per host')
+    parser.add_argument('--overload', choices=['on', 'off'], default='on',
+                        help='one annotation for all extensible attributes, or one each')
+    parser.add_argument('--churn', type=float, default=0.05, help='share of VMs that differ between inventories')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--child', choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument('--hosts', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    results = []
+    for stage in args.stage or STAGES:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            output = subprocess.check_output([
+                sys.executable, os.path.abspath(__file__), '--child', stage, '--hosts', str(size),
+                '--world-seed', str(args.world_seed), '--extattrs', str(args.extattrs),
+                '--overload', args.overload, '--churn', str(args.churn)])
+            result = json.loads(output.strip().splitlines()[-1])
+            # cost per item relative to the smallest size of the same stage;
+            # anything well above 1 is where the stage stops scaling
+            first = [r for r in results if r['stage'] == stage]
+            result['growth'] = round(result['us_per_item'] / first[0]['us_per_item'], 2) if first and first[0]['us_per_item'] else 1.0
+            results.append(result)
+            sys.stderr.write('{stage} {hosts}: {seconds}s, {us_per_item}us per item, {peak_rss_kb} KB peak\n'.format(**result))
+
+    report = json.dumps({
+        'config': {'world_seed': args.world_seed, 'extattrs': args.extattrs, 'overload': args.overload,
+                   'churn': args.churn, 'python': sys.executable},
+        'results': results
+    }, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(report + '\n')
+    else:
+        print report
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Start-up benchmark for the eco_action.py dispatchers. Runs short actions,
+such as the FETCH_ITEMS calls the UI makes while a user fills in the
+configuration form, against the mock servers of mock_servers.py and reports
+the wall time of each, so the cost of starting interpreters, importing the
+client libraries and logging in can be told apart from the work itself.
+
+Modes:
+--subprocess: one python process per script, as before (IN_PROCESS_ACTIONS=off)
+--in-process: the scripts run inside the eco_action.py interpreter
+--worker: "python eco_action.py" hands the action to a warm worker started
+    once with "python eco_action.py --worker"
+--worker-socket: the request goes straight to the worker socket, without the
+    client interpreter, which is the floor a long-lived caller would see
+
+The first run of each action and mode is reported on its own ("first_ms"),
+since for the worker it includes the logins that later runs reuse.
+
+Usage: python bench_startup.py [--repeat N] [--mode NAME ...] [--action NAME ...] [--latency MS] [--output FILE]
+"""
+
+# pylint: disable=invalid-name
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+
+from mock_servers import start_servers, make_certificate
+from synthetic_world import World
+from run_load_benchmark import IMAGES, INFOBLOX_DEFAULTS, VCENTER_DEFAULTS, script_env
+
+MODES = ['subprocess', 'in-process', 'worker', 'worker-socket']
+
+# action -> (image, defaults, extra environment)
+ACTIONS = {
+    'vcenter-fetch-vrfs': ('vcenter', VCENTER_DEFAULTS, {'ACTION': 'FETCH_ITEMS', 'FETCH_TARGET': 'VRFS'}),
+    'vcenter-fetch-datacenters': ('vcenter', VCENTER_DEFAULTS, {'ACTION': 'FETCH_ITEMS', 'FETCH_TARGET': 'DATACENTERS'}),
+    'vcenter-test-connectivity': ('vcenter', VCENTER_DEFAULTS, {'ACTION': 'TEST_CONNECTIVITY'}),
+    'infoblox-fetch-ext-attrs': ('infoblox', INFOBLOX_DEFAULTS, {'ACTION': 'FETCH_ITEMS', 'FETCH_TARGET': 'EXT_ATTRS'}),
+    'infoblox-fetch-tenants': ('infoblox', INFOBLOX_DEFAULTS, {'ACTION': 'FETCH_ITEMS', 'FETCH_TARGET': 'TENANT_SCOPE_NAMES'}),
+    'infoblox-test-connectivity': ('infoblox', INFOBLOX_DEFAULTS, {'ACTION': 'TEST_CONNECTIVITY'})
+}
+
+# ============================================================================
+# Functions
+# ----------------------------------------------------------------------------
+
+def final_status(output):
+    ''' Status code of the last Pigeon that is not a progress message. '''
+    status = None
+    for line in output.splitlines():
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(message, dict) and message.get('status_code') not in (None, 100):
+            status = message['status_code']
+    return status
+
+def request_worker(path, env):
+    ''' Sends one request to the worker on path and returns its output. '''
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    client.sendall(json.dumps({'env': env}) + '\n')
+    chunks = []
+    while True:
+        data = client.recv(65536)
+        if not data:
+            break
+        chunks.append(data)
+    client.close()
+    return ''.join(chunks)
+
+def start_worker(python, cwd, env, path):
+    env = dict(env, ECO_WORKER_SOCKET=path)
+    worker = subprocess.Popen([python, 'eco_action.py', '--worker'], cwd=cwd, env=env,
+                              stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+    deadline = time.time() + 30
+    while not os.path.exists(path):
+        if worker.poll() is not None or time.time() > deadline:
+            raise RuntimeError('worker did not start')
+        time.sleep(0.01)
+    return worker
+
+def time_action(mode, python, cwd, env, socket_path):
+    ''' Runs the action once and returns (wall seconds, final status). '''
+    started = time.time()
+    if mode == 'worker-socket':
+        output = request_worker(socket_path, env)
+    else:
+        if mode == 'subprocess':
+            env = dict(env, IN_PROCESS_ACTIONS='off')
+        elif mode == 'worker':
+            env = dict(env, ECO_WORKER_SOCKET=socket_path)
+        output = subprocess.Popen([python, 'eco_action.py'], cwd=cwd, env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT).communicate()[0]
+    return time.time() - started, final_status(output)
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+# ============================================================================
+# Main
+# ----------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the start-up cost of eco_action.py actions.')
+    parser.add_argument('--repeat', type=int, default=10, help='runs of each action and mode')
+    parser.add_argument('--mode', action='append', choices=MODES, help='mode to run, may be repeated (default: all)')
+    parser.add_argument('--action', action='append', choices=sorted(ACTIONS),
+                        help='action to run, may be repeated (default: all)')
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every response')
+    parser.add_argument('--hosts', type=int, default=1000, help='hosts in the synthetic world')
+    parser.add_argument('--python', default=sys.executable, help='interpreter for the scripts')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_startup_')
+    for image, source in IMAGES.items():
+        shutil.copytree(source, os.path.join(workdir, image), ignore=shutil.ignore_patterns('*.pyc'))
+    certfile, keyfile = make_certificate(workdir)
+    servers = start_servers(World(args.hosts), args.latency / 1000.0, 0.0, certfile, keyfile)
+
+    results = []
+    workers = {}
+    try:
+        for mode in args.mode or MODES:
+            for action in args.action or sorted(ACTIONS):
+                image, defaults, extra = ACTIONS[action]
+                cwd = os.path.join(workdir, image)
+                env = script_env(servers, defaults, extra)
+                socket_path = os.path.join(workdir, image + '.sock')
+                if mode.startswith('worker') and image not in workers:
+                    workers[image] = start_worker(args.python, cwd, env, socket_path)
+
+                runs = [time_action(mode, args.python, cwd, env, socket_path) for _ in range(args.repeat)]
+                warm = [seconds * 1000 for (seconds, _) in runs[1:]] or [runs[0][0] * 1000]
+                result = {
+                    'mode': mode,
+                    'action': action,
+                    'first_ms': round(runs[0][0] * 1000, 1),
+                    'median_ms': round(percentile(warm, 0.5), 1),
+                    'p90_ms': round(percentile(warm, 0.9), 1),
+                    'min_ms': round(min(warm), 1),
+                    'statuses': sorted(set(status for (_, status) in runs))
+                }
+                results.append(result)
+                sys.stderr.write('{mode} {action}: first {first_ms} ms, median {median_ms} ms\n'.format(**result))
+    finally:
+        for worker in workers.values():
+            worker.terminate()
+            worker.wait()
+        for server in servers.values():
+            server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = json.dumps({
+        'config': {'repeat': args.repeat, 'latency_ms': args.latency, 'hosts': args.hosts, 'python': args.python},
+        'results': results
+    }, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(report + '\n')
+    else:
+        print report
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Micro-benchmark for Tetration_Helper.HasSubnetFilterForIp. Compares the
+radix trie behind AddSubnets against the linear scan over every known
+subnet that it replaced.
+
+Usage: python bench_subnet_index.py [known subnets] [lookups]
+"""
+
+# pylint: disable=invalid-name
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ecoScripts', 'infoblox', 'Image'))
+
+from netaddr import IPNetwork, IPAddress
+from helpers import Subnet_Index
+
+SUBNETS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+LOOKUPS = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+
+def linear_scan(subnets, ip):
+    ''' The original HasSubnetFilterForIp loop. '''
+    for subnet in subnets:
+        addr = IPAddress(ip)
+        if subnet.__contains__(addr) is True or addr.is_private() is not True:
+            return True
+    return False
+
+
+def indexed(index, ip):
+    addr = IPAddress(ip)
+    return addr in index or addr.is_private() is not True
+
+
+def main():
+    random.seed(42)
+    # /24s spread across 10.0.0.0/8 the way known_subnets.csv grows over time
+    subnets = [IPNetwork('10.%d.%d.0/24' % (random.randint(0, 255), random.randint(0, 255))) for _ in range(SUBNETS)]
+    ips = ['10.%d.%d.%d' % (random.randint(0, 255), random.randint(0, 255), random.randint(1, 254)) for _ in range(LOOKUPS)]
+
+    start = time.time()
+    index = Subnet_Index()
+    for subnet in subnets:
+        index.Add(subnet)
+    build = time.time() - start
+
+    # the linear scan is slow enough that a sample is plenty
+    sample = ips[:max(1, LOOKUPS // 20)]
+    start = time.time()
+    expected = [linear_scan(subnets, ip) for ip in sample]
+    linear = (time.time() - start) / len(sample)
+
+    start = time.time()
+    found = [indexed(index, ip) for ip in ips]
+    trie = (time.time() - start) / len(ips)
+
+    assert found[:len(sample)] == expected
+    print 'subnets: %d, lookups: %d' % (SUBNETS, LOOKUPS)
+    print 'trie build:   %.3f s' % build
+    print 'linear scan:  %.1f us/lookup' % (linear * 1e6)
+    print 'radix trie:   %.1f us/lookup' % (trie * 1e6)
+    print 'speedup:      %.0fx' % (linear / trie)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,787 @@
+"""
+Local stand-ins for the services the integrations talk to, so that their
+scripts can be load tested without production endpoints:
+
+- Tetration OpenAPI: /inventory/search (with filter evaluation and cursor
+  paging), /assets/cmdb/upload and download, /filters/inventories,
+  /app_scopes and /vrfs
+- Infoblox WAPI: ipv4address, network, networkview, extensibleattributedef
+  and db_objects, plus the multi-object /request call
+- vCenter: the vSphere SOAP subset that pyVmomi's SmartConnect, the
+  PropertyCollector and ContainerView use, and the tagging REST API
+
+All three serve one World of synthetic_world.py, so the scripts see the same
+IP addresses in Tetration, Infoblox and vCenter. Every server can add a fixed
+latency to each response, fail a share of the requests with a 503, answer the
+requests above a rate limit with a 429 and a Retry-After, and go down for a
+while (every request answered with a 503), and counts calls, errors and bytes
+per endpoint.
+
+Usage: python mock_servers.py [--hosts N] [--subnets N] [--world-seed N] [--latency MS] [--error-rate R]
+                              [--rate-limit N] [--outage START:SECONDS]
+"""
+
+# pylint: disable=invalid-name
+
+import os
+import re
+import ssl
+import sys
+import cgi
+import csv
+import json
+import time
+import random
+import argparse
+import datetime
+import itertools
+import threading
+import subprocess
+import xml.etree.ElementTree as ET
+from StringIO import StringIO
+from urlparse import urlparse, parse_qs
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from synthetic_world import ip_to_int, add_world_arguments, world_from_arguments
+
+# vSphere API version the mock vCenter claims to be
+VSPHERE_API_VERSION = '6.7'
+VSPHERE_PRIOR_VERSIONS = ['6.5', '6.0', '5.5', '5.1', '5.0']
+
+# ============================================================================
+# HTTP plumbing
+# ----------------------------------------------------------------------------
+
+def make_certificate(directory):
+    '''
+    Writes a throwaway self-signed certificate and key to directory with the
+    openssl command line tool and returns their paths. Every script talks
+    HTTPS with certificate checks turned off, so any certificate will do.
+    '''
+    certfile = os.path.join(directory, 'mock_cert.pem')
+    keyfile = os.path.join(directory, 'mock_key.pem')
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                               '-keyout', keyfile, '-out', certfile, '-days', '2',
+                               '-subj', '/CN=localhost'], stdout=devnull, stderr=devnull)
+    return certfile, keyfile
+
+class Response(object):
+    ''' What a route returns: status, body and optional extra headers. '''
+    def __init__(self, status=200, body='', content_type='application/json', headers=None):
+        self.status = status
+        self.body = body if isinstance(body, str) else json.dumps(body)
+        self.content_type = content_type
+        self.headers = headers or {}
+
+class MockHandler(BaseHTTPRequestHandler):
+    ''' Hands every request to the server it belongs to. '''
+    protocol_version = 'HTTP/1.1'
+    # every header is a write of its own; with Nagle's algorithm a reused
+    # connection waits for the delayed ACK of the client (~40 ms) per reply
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # the TLS handshake runs here, on the request thread, rather than in
+        # the accept loop of the server
+        if isinstance(self.request, ssl.SSLSocket):
+            self.request.do_handshake()
+        BaseHTTPRequestHandler.setup(self)
+
+    def log_message(self, *args):
+        pass
+
+    def handle_any(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        body = self.rfile.read(length) if length else ''
+        response = self.server.serve(self.command, self.path, self.headers, body)
+        self.send_response(response.status)
+        self.send_header('Content-Type', response.content_type)
+        self.send_header('Content-Length', str(len(response.body)))
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_any
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    '''
+    Threaded HTTPS server on an ephemeral port of 127.0.0.1. Subclasses
+    implement endpoint(), which names the endpoint a request is counted
+    under, and route(), which answers it.
+    '''
+    daemon_threads = True
+    name = 'mock'
+
+    def __init__(self, world, latency=0.0, error_rate=0.0, certfile=None, keyfile=None, seed=0,
+                 rate_limit=0.0, outage=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), MockHandler)
+        if certfile:
+            self.socket = ssl.wrap_socket(self.socket, certfile=certfile, keyfile=keyfile,
+                                          server_side=True, do_handshake_on_connect=False)
+        self.world = world
+        self.latency = latency
+        self.error_rate = error_rate
+        # requests per second answered before the rest get a 429
+        self.rate_limit = rate_limit
+        self.allowance = rate_limit
+        self.allowance_stamp = time.time()
+        # (start, seconds) after reset_stats during which everything fails
+        self.outage = outage
+        self.started = time.time()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def address(self):
+        return '127.0.0.1:{}'.format(self.port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # clients hanging up mid-request are normal under load
+        pass
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {}
+            self.started = time.time()
+
+    def throttled(self, now):
+        # a token bucket of one second's worth of requests; call with the lock
+        if not self.rate_limit:
+            return False
+        self.allowance = min(self.rate_limit, self.allowance + (now - self.allowance_stamp) * self.rate_limit)
+        self.allowance_stamp = now
+        if self.allowance < 1:
+            return True
+        self.allowance -= 1
+        return False
+
+    def snapshot(self):
+        ''' Returns {endpoint: {calls, errors, bytes_in, bytes_out, seconds}}. '''
+        with self.lock:
+            return json.loads(json.dumps(self.stats))
+
+    def serve(self, method, path, headers, body):
+        endpoint = self.endpoint(method, path, body)
+        started = time.time()
+        with self.lock:
+            failed = self.random.random() < self.error_rate
+            down = self.outage and 0 <= started - self.started - self.outage[0] < self.outage[1]
+            throttled = not failed and not down and self.throttled(started)
+        if down:
+            response = Response(503, {'error': 'injected outage'})
+        elif throttled:
+            response = Response(429, {'error': 'rate limit exceeded'}, headers={'Retry-After': '1'})
+        elif failed:
+            response = Response(503, {'error': 'injected failure'})
+        else:
+            try:
+                response = self.route(method, path, headers, body)
+            except Exception as error:
+                response = Response(500, {'error': str(error)})
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, {'calls': 0, 'errors': 0, 'bytes_in': 0,
+                                                     'bytes_out': 0, 'seconds': 0.0})
+            stats['calls'] += 1
+            stats['errors'] += 1 if response.status >= 400 else 0
+            stats['bytes_in'] += len(body)
+            stats['bytes_out'] += len(response.body)
+            stats['seconds'] += time.time() - started
+        return response
+
+    def endpoint(self, method, path, body):
+        return method + ' ' + urlparse(path).path
+
+    def route(self, method, path, headers, body):
+        raise NotImplementedError
+
+# ============================================================================
+# Tetration
+# ----------------------------------------------------------------------------
+
+def compile_filter(search):
+    '''
+    Turns a Tetration inventory filter into a predicate over (server, host
+    index), where the server answers ip_int and field for the host. Supports the and, or, not, eq, ne, subnet, contains and in
+    filters the integrations send.
+    '''
+    kind = search.get('type')
+    if kind in ('and', 'or'):
+        tests = [compile_filter(f) for f in search.get('filters') or []]
+        if kind == 'and':
+            return lambda server, i: all(test(server, i) for test in tests)
+        return lambda server, i: any(test(server, i) for test in tests)
+    if kind == 'not':
+        test = compile_filter(search['filter'])
+        return lambda server, i: not test(server, i)
+    field, value = search.get('field'), search.get('value')
+    if kind == 'subnet':
+        network, prefix = value.split('/')
+        mask = (0xFFFFFFFF << (32 - int(prefix))) & 0xFFFFFFFF
+        start = ip_to_int(network) & mask
+        return lambda server, i: server.ip_int(i) & mask == start
+    if kind == 'eq':
+        return lambda server, i: server.field(i, field) == value
+    if kind == 'ne':
+        return lambda server, i: server.field(i, field) != value
+    if kind == 'contains':
+        return lambda server, i: value in str(server.field(i, field))
+    if kind == 'in':
+        return lambda server, i: server.field(i, field) in value
+    raise ValueError('unsupported filter type {}'.format(kind))
+
+class TetrationServer(MockServer):
+    ''' Tetration OpenAPI under /openapi/v1. '''
+    name = 'tetration'
+    PREFIX = '/openapi/v1'
+
+    def __init__(self, *args, **kwargs):
+        MockServer.__init__(self, *args, **kwargs)
+        self.filters = []
+        # IP address -> (VRF name, {annotation column: value})
+        self.annotations = {}
+
+    def reset_annotations(self):
+        ''' Forgets every upload, so that the next run does the same amount of work. '''
+        with self.lock:
+            self.annotations.clear()
+
+    def ip_int(self, i):
+        return self.world.ip_int(i)
+
+    def field(self, i, name):
+        if name.startswith('user_'):
+            _, values = self.annotations.get(self.world.ip(i), (None, {}))
+            return values.get(name[5:], '')
+        return self.world.field(i, name)
+
+    def inventory(self, i):
+        record = self.world.inventory(i)
+        _, values = self.annotations.get(record['ip'], (None, {}))
+        for column, value in values.items():
+            record['user_' + column] = value
+        return record
+
+    def annotate(self, rows, oper, vrf):
+        ''' Records an upload of {ip: {column: value}} with the oper "add" or "delete". '''
+        with self.lock:
+            for ip, values in rows.items():
+                if oper == 'delete':
+                    self.annotations.pop(ip, None)
+                else:
+                    self.annotations.setdefault(ip, (values.pop('VRF', None) or vrf, {}))[1].update(values)
+
+    def endpoint(self, method, path, body):
+        path = urlparse(path).path
+        # the CMDB paths end in the scope name
+        for prefix in ['/assets/cmdb/upload', '/assets/cmdb/download']:
+            if path.startswith(self.PREFIX + prefix):
+                path = self.PREFIX + prefix
+        return method + ' ' + path
+
+    def route(self, method, path, headers, body):
+        path = urlparse(path).path[len(self.PREFIX):]
+        if path == '/inventory/search' and method == 'POST':
+            return self.search(json.loads(body))
+        if path.startswith('/assets/cmdb/upload') and method == 'POST':
+            return self.upload(path[len('/assets/cmdb/upload/'):], headers, body)
+        if path.startswith('/assets/cmdb/download') and method == 'GET':
+            return self.download(path[len('/assets/cmdb/download/'):])
+        if path == '/filters/inventories' and method == 'POST':
+            query = json.loads(body)
+            query['id'] = '{:024x}'.format(len(self.filters) + 1)
+            with self.lock:
+                self.filters.append(query)
+            return Response(200, query)
+        if path == '/filters/inventories' and method == 'GET':
+            return Response(200, self.filters)
+        if path == '/app_scopes' and method == 'GET':
+            return Response(200, self.world.scopes())
+        if path == '/vrfs' and method == 'GET':
+            return Response(200, self.world.vrfs())
+        if path == '/inventory/search/dimensions' and method == 'GET':
+            return Response(200, sorted(self.world.inventory(0).keys()))
+        return Response(404, {'error': 'not found'})
+
+    def search(self, query):
+        test = compile_filter(query['filter']) if query.get('filter') else (lambda server, i: True)
+        limit = int(query.get('limit') or 1000)
+        start = int(query.get('offset') or 0)
+        dimensions = query.get('dimensions')
+        # the root scope of a VRF only holds the hosts of that VRF
+        vrf_ids = dict((vrf['name'], vrf['id']) for vrf in self.world.vrfs())
+        vrf_id = vrf_ids.get(query.get('scopeName')) if self.world.vrf_count > 1 else None
+        results = []
+        offset = None
+        for i in xrange(start, self.world.hosts):
+            if vrf_id is not None and self.world.vrf(i % self.world.subnets)[0] != vrf_id:
+                continue
+            if not test(self, i):
+                continue
+            if len(results) == limit:
+                # the cursor points at the first host of the next page
+                offset = str(i)
+                break
+            record = self.inventory(i)
+            if dimensions:
+                record = dict((name, record[name]) for name in dimensions if name in record)
+            results.append(record)
+        response = {'results': results}
+        if offset is not None:
+            response['offset'] = offset
+        return Response(200, response)
+
+    def upload(self, scope, headers, body):
+        form = cgi.FieldStorage(fp=StringIO(body), headers=headers,
+                                environ={'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': headers.getheader('content-type')})
+        oper = form.getfirst('X-Tetration-Oper', 'add')
+        upload = [form[key] for key in form.keys() if form[key].filename]
+        if not upload:
+            return Response(400, {'error': 'no file'})
+        lines = upload[0].value.splitlines()
+        rows = dict((row.pop('IP'), row) for row in csv.DictReader(lines) if row.get('IP'))
+        self.annotate(rows, oper, scope or 'Default')
+        return Response(200, {'status': 'ok', 'rows': len(rows)})
+
+    def download(self, scope):
+        ''' The annotations of the VRF of scope (Default without one) as a CSV. '''
+        vrf = scope or 'Default'
+        with self.lock:
+            rows = [(ip, values) for (ip, (row_vrf, values)) in self.annotations.items() if row_vrf == vrf]
+        columns = sorted(set(column for (_, values) in rows for column in values))
+        out = StringIO()
+        writer = csv.writer(out)
+        writer.writerow(['IP', 'VRF'] + columns)
+        for ip, values in sorted(rows):
+            writer.writerow([ip, vrf] + [values.get(column, '') for column in columns])
+        return Response(200, out.getvalue(), content_type='text/csv')
+
+# ============================================================================
+# Infoblox
+# ----------------------------------------------------------------------------
+
+class InfobloxServer(MockServer):
+    ''' Infoblox WAPI under /wapi/v<version>. '''
+    name = 'infoblox'
+    WAPI = re.compile(r'^/wapi/v[\d.]+/(?P<object>[^?]*)')
+
+    def __init__(self, *args, **kwargs):
+        MockServer.__init__(self, *args, **kwargs)
+        self.sequence_id = 1
+
+    def endpoint(self, method, path, body):
+        match = self.WAPI.match(path)
+        return method + ' ' + (match.group('object') if match else urlparse(path).path)
+
+    def route(self, method, path, headers, body):
+        match = self.WAPI.match(path)
+        if not match:
+            return Response(404, {'Error': 'not found'})
+        obj = match.group('object')
+        if obj == 'request' and method == 'POST':
+            return Response(200, [self.get(r['object'], dict(r.get('data') or {}, **(r.get('args') or {})))
+                                  for r in json.loads(body)])
+        if method != 'GET':
+            return Response(400, {'Error': 'unsupported method'})
+        query = dict((k, v[-1]) for (k, v) in parse_qs(urlparse(path).query).items())
+        results = self.get(obj, query)
+        if results is None:
+            return Response(400, {'Error': 'AdmConProtoError: Unknown object type ({})'.format(obj)})
+        if query.get('_paging') == '1' and query.get('_return_as_object') == '1':
+            page_size = int(query.get('_max_results') or 1000)
+            start = int(query.get('_page_id') or 0)
+            page = {'result': results[start:start + page_size]}
+            if start + page_size < len(results):
+                page['next_page_id'] = str(start + page_size)
+            return Response(200, page)
+        return Response(200, results)
+
+    def get(self, obj, query):
+        world = self.world
+        if obj == 'ipv4address':
+            if 'ip_address' in query:
+                i = world.index(query['ip_address'])
+                return [world.host_record(i)] if i is not None and world.in_ipam(i) else []
+            if 'network' in query:
+                j = world.subnet_index(ip_to_int(query['network'].split('/')[0]))
+                return [world.host_record(i) for i in world.subnet_hosts(j) if world.in_ipam(i)] if j is not None else []
+            return []
+        if obj == 'network':
+            if 'contains_address' in query:
+                i = world.index(query['contains_address'])
+                return [world.network_record(i % world.subnets)] if i is not None else []
+            if 'network' in query:
+                j = world.subnet_index(ip_to_int(query['network'].split('/')[0]))
+                return [world.network_record(j)] if j is not None else []
+            return []
+        if obj == 'networkview':
+            return [{'_ref': 'networkview/{}:{}'.format(n, world.network_view(n)), 'name': world.network_view(n)}
+                    for n in range(world.network_views)]
+        if obj == 'extensibleattributedef':
+            return [{'_ref': 'extensibleattributedef/{}:{}'.format(n, name), 'name': name}
+                    for (n, name) in enumerate(world.extattr_names)]
+        if obj == 'db_objects':
+            # the world never changes, so the feed only reports where it is
+            if 'start_sequence_id' in query:
+                return []
+            return [{'last_sequence_id': '0:{}'.format(self.sequence_id), 'object_type': 'record:host',
+                     'object': {'_ref': 'record:host/0:host-0'}}]
+        return None
+
+# ============================================================================
+# vCenter
+# ----------------------------------------------------------------------------
+
+SOAP_ENVELOPE = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<soapenv:Envelope xmlns:soapenc="http://schemas.xmlsoap.org/soap/encoding/" '
+                 'xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" '
+                 'xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+                 'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n'
+                 '<soapenv:Body>{}</soapenv:Body>\n</soapenv:Envelope>')
+
+SERVICE_VERSIONS = ('<?xml version="1.0" encoding="UTF-8" ?>\n<namespaces version="1.0">\n'
+                    ' <namespace>\n  <name>urn:vim25</name>\n  <version>{}</version>\n'
+                    '  <priorVersions>{}</priorVersions>\n </namespace>\n</namespaces>\n')
+
+def local_name(element):
+    return element.tag.split('}')[-1]
+
+def children(element, name):
+    return [child for child in element if local_name(child) == name]
+
+def child_text(element, name, default=None):
+    found = children(element, name)
+    return found[0].text if found else default
+
+class VCenterServer(MockServer):
+    '''
+    vCenter with one Datacenter holding the VMs of the world. The SOAP side
+    answers RetrieveServiceContent, Login, Logout, RetrievePropertiesEx,
+    ContinueRetrievePropertiesEx, CreateContainerView and DestroyView, which
+    covers SmartConnect, property access on managed objects and the paged
+    ContainerView walk of collect_inventory.py. Responses are serialized
+    with pyVmomi itself, so the mock needs it installed like the scripts do.
+    '''
+    name = 'vcenter'
+    DATACENTER = 'Datacenter'
+
+    def __init__(self, *args, **kwargs):
+        MockServer.__init__(self, *args, **kwargs)
+        from pyVmomi import vim, vmodl, VmomiSupport, SoapAdapter
+        self.vim, self.vmodl = vim, vmodl
+        self.SoapAdapter = SoapAdapter
+        self.version = 'vim.version.version12'
+        self.Object = VmomiSupport.Object
+        self.nsmap = SoapAdapter.SOAP_NSMAP.copy()
+        self.nsmap[VmomiSupport.GetWsdlNamespace(self.version)] = ''
+        self.views = {}
+        self.results = {}
+        self.counter = 0
+        self.tag_ids = ['urn:vmomi:InventoryServiceTag:{:08x}:GLOBAL'.format(n) for n in range(len(self.world.tag_names))]
+        self.tagged = None
+
+    def endpoint(self, method, path, body):
+        path = urlparse(path).path
+        if path == '/sdk' and method == 'POST':
+            match = re.search(r'<soapenv:Body>\s*<(\w+)', body) or re.search(r'Body>\s*<(?:\w+:)?(\w+)', body)
+            return 'POST /sdk ' + (match.group(1) if match else '?')
+        if path.startswith('/rest/com/vmware/cis/tagging/tag/id:'):
+            path = '/rest/com/vmware/cis/tagging/tag/id:{id}'
+        return method + ' ' + path
+
+    def route(self, method, path, headers, body):
+        parsed = urlparse(path)
+        if parsed.path == '/sdk/vimServiceVersions.xml':
+            return Response(200, SERVICE_VERSIONS.format(VSPHERE_API_VERSION, ''.join(
+                '<version>{}</version>'.format(v) for v in VSPHERE_PRIOR_VERSIONS)), 'text/xml')
+        if parsed.path == '/sdk' and method == 'POST':
+            return self.soap(body)
+        if parsed.path.startswith('/rest/com/vmware/cis'):
+            return self.rest(method, parsed.path[len('/rest/com/vmware/cis'):], parsed.query, body)
+        return Response(404, {'error': 'not found'})
+
+    # --- tagging REST API ---------------------------------------------------
+
+    def rest(self, method, path, query, body):
+        if path == '/session':
+            return Response(200, {'value': 'mock-session'} if method == 'POST' else {})
+        if path == '/tagging/tag' and method == 'GET':
+            return Response(200, {'value': self.tag_ids})
+        if path.startswith('/tagging/tag/id:') and method == 'GET':
+            tag_id = path[len('/tagging/tag/id:'):]
+            if tag_id not in self.tag_ids:
+                return Response(404, {'type': 'com.vmware.vapi.std.errors.not_found'})
+            return Response(200, {'value': {'id': tag_id, 'name': self.world.tag_names[self.tag_ids.index(tag_id)],
+                                            'category_id': 'urn:vmomi:InventoryServiceCategory:0:GLOBAL'}})
+        if path == '/tagging/tag-association' and 'list-attached-objects-on-tags' in query:
+            tag_ids = json.loads(body).get('tag_ids') or []
+            tagged = self.tagged_vms()
+            return Response(200, {'value': [{'tag_id': tag_id, 'object_ids': [
+                {'type': 'VirtualMachine', 'id': 'vm-{}'.format(v)} for v in tagged[self.tag_ids.index(tag_id)]]}
+                for tag_id in tag_ids if tag_id in self.tag_ids]})
+        return Response(404, {'type': 'com.vmware.vapi.std.errors.not_found'})
+
+    def tagged_vms(self):
+        ''' VM indexes of every tag, built on first use. '''
+        with self.lock:
+            if self.tagged is None:
+                self.tagged = [[] for _ in self.tag_ids]
+                for v in xrange(self.world.vms):
+                    for tag in self.world.vm_tags(v):
+                        self.tagged[tag].append(v)
+            return self.tagged
+
+    # --- SOAP ---------------------------------------------------------------
+
+    def soap(self, body):
+        request = [element for element in ET.fromstring(body) if local_name(element) == 'Body'][0][0]
+        method = local_name(request)
+        handler = getattr(self, 'soap_' + method, None)
+        if handler is None:
+            return self.fault('Method {} is not implemented by the mock vCenter'.format(method))
+        try:
+            result, result_type, headers = handler(request)
+            returnval = ''
+            if result is not None:
+                info = self.Object(name='returnval', type=result_type, version=self.version, flags=0)
+                returnval = self.SoapAdapter.SerializeToUnicode(result, info, self.version, self.nsmap)
+        except Exception as error:
+            return self.fault('{}: {}'.format(method, error))
+        body = '<{0}Response xmlns="urn:vim25">{1}</{0}Response>'.format(method, returnval)
+        return Response(200, SOAP_ENVELOPE.format(body).encode('utf-8'), 'text/xml; charset=utf-8', headers)
+
+    def fault(self, message):
+        fault = '<soapenv:Fault><faultcode>ServerFaultCode</faultcode><faultstring>{}</faultstring></soapenv:Fault>'
+        return Response(500, SOAP_ENVELOPE.format(fault.format(cgi.escape(message))), 'text/xml; charset=utf-8')
+
+    def ref(self, element):
+        ''' Returns (type, moId) of a ManagedObjectReference element. '''
+        return element.get('type'), element.text
+
+    def mo(self, kind, mo_id):
+        return getattr(self.vim, kind)(mo_id) if kind != 'PropertyCollector' else self.vmodl.query.PropertyCollector(mo_id)
+
+    def soap_RetrieveServiceContent(self, request):
+        vim = self.vim
+        about = vim.AboutInfo(name='VMware vCenter Server', fullName='VMware vCenter Server 6.7.0 build-0 (mock)',
+                              vendor='VMware, Inc.', version='6.7.0', build='0', osType='linux-x64',
+                              apiType='VirtualCenter', apiVersion=VSPHERE_API_VERSION,
+                              productLineId='vpx', instanceUuid='00000000-0000-0000-0000-000000000000')
+        content = vim.ServiceInstanceContent(
+            rootFolder=vim.Folder('group-d1'), about=about,
+            propertyCollector=self.vmodl.query.PropertyCollector('propertyCollector'),
+            viewManager=vim.view.ViewManager('ViewManager'), sessionManager=vim.SessionManager('SessionManager'),
+            customFieldsManager=vim.CustomFieldsManager('CustomFieldsManager'))
+        return content, vim.ServiceInstanceContent, {}
+
+    def session(self):
+        vim = self.vim
+        started = datetime.datetime(2018, 1, 1)
+        return vim.UserSession(key='mock-session', userName='mock', fullName='mock', locale='en',
+                               messageLocale='en', extensionSession=False, loginTime=started,
+                               lastActiveTime=started, ipAddress='127.0.0.1', userAgent='pyvmomi', callCount=0)
+
+    def soap_Login(self, request):
+        return self.session(), self.vim.UserSession, {
+            'Set-Cookie': 'vmware_soap_session="mock-session"; Path=/; HttpOnly; Secure;'}
+
+    def soap_Logout(self, request):
+        return None, None, {}
+
+    def soap_CreateContainerView(self, request):
+        container = self.ref(children(request, 'container')[0])
+        types = [element.text for element in children(request, 'type')]
+        with self.lock:
+            self.counter += 1
+            view_id = 'session[mock]view-{}'.format(self.counter)
+            self.views[view_id] = (container, types)
+        return self.vim.view.ContainerView(view_id), self.vim.view.ContainerView, {}
+
+    def soap_DestroyView(self, request):
+        with self.lock:
+            self.views.pop(self.ref(children(request, '_this')[0])[1], None)
+        return None, None, {}
+
+    def members(self, view_id):
+        ''' (type, moId) of every object in a ContainerView. '''
+        (kind, mo_id), types = self.views[view_id]
+        if mo_id == 'group-v3' and 'VirtualMachine' in types:
+            return (('VirtualMachine', 'vm-{}'.format(i)) for i in xrange(self.world.vms))
+        if mo_id == 'group-h4' and 'HostSystem' in types:
+            return (('HostSystem', 'host-{}'.format(n)) for n in xrange(self.world.esx_hosts))
+        # every network of the world is a distributed port group, which a
+        # view of either type lists
+        if mo_id == 'group-n5' and ('Network' in types or 'DistributedVirtualPortgroup' in types):
+            return (('DistributedVirtualPortgroup', 'dvportgroup-{}'.format(n)) for n in xrange(self.world.subnets))
+        if mo_id == 'group-d1' and 'Datacenter' in types:
+            return iter([('Datacenter', 'datacenter-2')])
+        return iter([])
+
+    def soap_RetrievePropertiesEx(self, request):
+        objects = []
+        for spec in children(request, 'specSet'):
+            paths = {}
+            for prop_set in children(spec, 'propSet'):
+                paths[child_text(prop_set, 'type')] = [p.text for p in children(prop_set, 'pathSet')]
+            for obj_set in children(spec, 'objectSet'):
+                kind, mo_id = self.ref(children(obj_set, 'obj')[0])
+                if child_text(obj_set, 'skip') == 'true' and children(obj_set, 'selectSet'):
+                    objects.append(((k, m, paths[k]) for (k, m) in self.members(mo_id) if k in paths))
+                else:
+                    objects.append(iter([(kind, mo_id, paths.get(kind, []))]))
+        options = children(request, 'options')
+        page_size = int(child_text(options[0], 'maxObjects', 0) or 0) if options else 0
+        return self.page(itertools.chain(*objects), page_size)
+
+    def soap_ContinueRetrievePropertiesEx(self, request):
+        with self.lock:
+            pending, page_size = self.results.pop(child_text(request, 'token'), (iter([]), 0))
+        return self.page(pending, page_size)
+
+    def page(self, pending, page_size):
+        pc = self.vmodl.query.PropertyCollector
+        contents = []
+        for (kind, mo_id, paths) in pending:
+            props = [self.vmodl.DynamicProperty(name=path, val=self.property(kind, mo_id, path))
+                     for path in paths]
+            contents.append(pc.ObjectContent(obj=self.mo(kind, mo_id),
+                                             propSet=[p for p in props if p.val is not None]))
+            if page_size and len(contents) == page_size:
+                break
+        token = None
+        if page_size and len(contents) == page_size:
+            # peek so that the last page does not hand out a useless token
+            try:
+                first = next(pending)
+            except StopIteration:
+                first = None
+            if first is not None:
+                with self.lock:
+                    self.counter += 1
+                    token = str(self.counter)
+                    self.results[token] = (itertools.chain([first], pending), page_size)
+        if not contents:
+            return None, pc.RetrieveResult, {}
+        return pc.RetrieveResult(objects=contents, token=token), pc.RetrieveResult, {}
+
+    def property(self, kind, mo_id, path):
+        ''' The value of one property of one managed object, as a pyVmomi value. '''
+        vim = self.vim
+        if kind == 'ServiceInstance' and path == 'content':
+            return self.soap_RetrieveServiceContent(None)[0]
+        if kind == 'Folder' and mo_id == 'group-d1':
+            return {'name': 'Datacenters',
+                    'childEntity': vim.ManagedEntity.Array([vim.Datacenter('datacenter-2')])}.get(path)
+        if kind == 'Datacenter':
+            return {'name': self.DATACENTER, 'vmFolder': vim.Folder('group-v3'),
+                    'hostFolder': vim.Folder('group-h4'), 'networkFolder': vim.Folder('group-n5')}.get(path)
+        if kind == 'HostSystem' and path == 'name':
+            return 'esx-{}.example.com'.format(mo_id.split('-')[1])
+        if kind in ('Network', 'DistributedVirtualPortgroup') and path == 'name':
+            return 'VLAN-{}'.format(mo_id.split('-')[1])
+        if kind == 'CustomFieldsManager' and path == 'field':
+            return vim.CustomFieldsManager.FieldDef.Array([
+                vim.CustomFieldsManager.FieldDef(key=n + 100, name=name, type=str, managedObjectType=vim.VirtualMachine)
+                for (n, name) in enumerate(self.world.custom_field_names)])
+        if kind == 'SessionManager' and path == 'currentSession':
+            return self.session()
+        if kind == 'VirtualMachine':
+            return self.vm_property(int(mo_id.split('-')[1]), path)
+        return None
+
+    def vm_property(self, v, path):
+        vim = self.vim
+        world = self.world
+        if path == 'name':
+            return world.vm_name(v)
+        if path == 'guest.toolsStatus':
+            return 'toolsOk' if world.vm_tools_ok(v) else 'toolsNotRunning'
+        if path == 'guest.net':
+            # one NIC per port group; every NIC also reports a link-local
+            # IPv6 address, as real ones do
+            nics = []
+            for (n, j) in enumerate(world.vm_networks(v)):
+                ips = [world.ip(i) for i in world.vm_hosts(v) if i % world.subnets == j]
+                nics.append(vim.vm.GuestInfo.NicInfo(
+                    network='VLAN-{}'.format(j), connected=True, deviceConfigId=4000 + n,
+                    macAddress='00:50:56:{:02x}:{:02x}:{:02x}'.format(n, (v >> 8) & 255, v & 255),
+                    ipAddress=ips + ['fe80::250:56ff:fe{:02x}:{:x}'.format(n, v & 0xFFFF)]))
+            return vim.vm.GuestInfo.NicInfo.Array(nics)
+        if path == 'runtime.host':
+            return vim.HostSystem('host-{}'.format(world.vm_esx_host(v)))
+        if path == 'network':
+            return vim.Network.Array([vim.dvs.DistributedVirtualPortgroup('dvportgroup-{}'.format(j))
+                                      for j in world.vm_networks(v)])
+        if path == 'customValue':
+            return vim.CustomFieldsManager.Value.Array([
+                vim.CustomFieldsManager.StringValue(key=n + 100, value=value)
+                for (n, value) in world.vm_custom_values(v)])
+        return None
+
+# ============================================================================
+# Main
+# ----------------------------------------------------------------------------
+
+SERVERS = [TetrationServer, InfobloxServer, VCenterServer]
+
+def start_servers(world, latency=0.0, error_rate=0.0, certfile=None, keyfile=None, seed=0,
+                  rate_limit=0.0, outage=None):
+    ''' Starts one of each mock server and returns them by name. '''
+    return dict((cls.name, cls(world, latency, error_rate, certfile, keyfile, seed + n, rate_limit, outage).start())
+                for (n, cls) in enumerate(SERVERS))
+
+def add_traffic_arguments(parser):
+    ''' The --rate-limit and --outage options of the servers. '''
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help='requests per second each server answers before replying 429 (0: no limit)')
+    parser.add_argument('--outage', type=outage_argument, default=None, metavar='START:SECONDS',
+                        help='answer every request with a 503 for SECONDS, START seconds after the run starts')
+
+def outage_argument(value):
+    start, seconds = value.split(':')
+    return (float(start), float(seconds))
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the mock Tetration, Infoblox and vCenter servers.')
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 503')
+    add_traffic_arguments(parser)
+    add_world_arguments(parser)
+    args = parser.parse_args()
+
+    import tempfile
+    certfile, keyfile = make_certificate(tempfile.mkdtemp())
+    world = world_from_arguments(args)
+    servers = start_servers(world, args.latency / 1000.0, args.error_rate, certfile, keyfile,
+                            rate_limit=args.rate_limit, outage=args.outage)
+    print json.dumps(dict((name, 'https://' + server.address) for (name, server) in servers.items()), indent=4)
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers.values():
+            server.stop()
+
+if __name__ == '__main__':
+    main()
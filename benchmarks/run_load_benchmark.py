@@ -0,0 +1,260 @@
+"""
+Load benchmark for the integrations. Starts the mock Tetration, Infoblox and
+vCenter servers of mock_servers.py, runs the scripts against them end to end
+and prints one JSON document with, for every run, the wall time, exit code,
+peak resident memory of the script and every process it started, the Pigeon
+status codes it printed and the calls, errors and bytes per API endpoint.
+
+Scenarios:
+--annotate-hosts: infoblox annotate-hosts.py
+--annotate-tenants: infoblox annotate-hosts.py for every VRF of the world as
+    a tenant scope of one multi-tenant run (use with --vrfs)
+--create-inventory-filters: infoblox create-inventory-filters.py
+--vcenter: the vCenter RUN_INTEGRATION action (get_scope_ips.py,
+    collect_inventory.py, diff_inventory.py and upload_annotations.py)
+
+The scripts run from a copy of their Image directory, as they would in their
+container, and keep their state in /private and /public like they do there.
+Each run starts cold: the CLEAR_CACHE action of the integration is run first.
+Do not point this at a machine whose /private holds state you want to keep.
+
+Integration settings that are not endpoints or credentials (for example
+INVENTORY_WORKERS or PREFETCH_SUBNETS) are taken from the environment when
+set, so the same world can be measured with different settings. The
+"seconds" of each endpoint is the time the mock spent answering, latency
+included, which tells the cost of the stand-ins apart from that of the
+scripts.
+
+Tetration forgets every annotation before each run unless --keep-annotations
+is given. With it, the runs after the first start from what the first one
+uploaded while /private is still cleared, which shows how much a run uploads
+when nothing changed (compare CMDB_RECONCILE=on and off).
+
+The world is generated by synthetic_world.py; its options (--hosts,
+--world-seed, --vrfs, --extattrs and so on) are accepted here as well.
+
+The mock servers can be made to misbehave, to see the scripts ride it out:
+--error-rate fails a share of the requests with a 503, --rate-limit answers
+the requests above N per second with a 429, and --outage START:SECONDS takes
+every server down for a while, START seconds into each run.
+
+Usage: python run_load_benchmark.py [--hosts N] [--subnets N] [--world-seed N] [--latency MS]
+                                    [--error-rate R] [--rate-limit N] [--outage START:SECONDS]
+                                    [--scenario NAME ...] [--repeat N]
+                                    [--keep-annotations] [--output FILE]
+"""
+
+# pylint: disable=invalid-name
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from mock_servers import start_servers, make_certificate, add_traffic_arguments
+from synthetic_world import SCOPE_ID, add_world_arguments, world_from_arguments
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ecoScripts')
+IMAGES = {
+    'infoblox': os.path.join(ROOT, 'infoblox', 'Image'),
+    'vcenter': os.path.join(ROOT, 'vcenter', 'Image')
+}
+STATE_DIRS = ['/private', '/public']
+
+# root application scope of the Default VRF in the world
+SCOPE_NAME = 'Default'
+
+# requests lets these override verify=False, which every script relies on to
+# accept the self-signed certificate of the mocks
+DROPPED_ENV = ['REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE']
+
+# integration settings used unless the environment already has them
+INFOBLOX_DEFAULTS = {
+    'ENABLE_HOSTNAME': 'on', 'HOSTNAME_ANNOTATION_NAME': 'Infoblox Hostname',
+    'ENABLE_ZONE': 'on', 'ZONE_ANNOTATION_NAME': 'Infoblox Zone',
+    'ENABLE_NETWORK_VIEW': 'on', 'NETWORK_VIEW_ANNOTATION_NAME': 'Infoblox View',
+    'ENABLE_SUBNET': 'on', 'SUBNET_ANNOTATION_NAME': 'Infoblox Subnet',
+    'ENABLE_EA': 'on', 'EA_ANNOTATION_NAME': 'Infoblox EA',
+    'ANNOTATION_TENANT_SCOPE_NAME': json.dumps([{'value': SCOPE_NAME}]),
+    'FILTERS_APP_SCOPE_ID': json.dumps([{'value': SCOPE_ID}]),
+    'SCOPE_RESTRICTED': 'off'
+}
+VCENTER_DEFAULTS = {
+    'VCENTER_DATACENTER': 'Datacenter',
+    'APPSCOPE_NAME': SCOPE_NAME, 'MULTITENANT': 'off', 'TENANT_VRF': 'Default',
+    'ENABLE_VM_NAME': 'on', 'VM_NAME_ANNOTATION_NAME': 'VM Name',
+    'ENABLE_VM_LOCATION': 'on', 'VM_LOCATION_ANNOTATION_NAME': 'VM Location',
+    'ENABLE_VM_TAGS': 'on', 'VM_TAGS_ANNOTATION_NAME': 'VM Tags',
+    'ENABLE_CUSTOM_ATTRIBUTES': 'on', 'CUSTOM_ATTRIBUTES_ANNOTATION_NAME': 'VM Attributes',
+    'ENABLE_VM_NETWORK': 'on', 'VM_NETWORKS_ANNOTATION_NAME': 'VM Networks'
+}
+
+# scenario -> (image, defaults, command, command that clears its state)
+SCENARIOS = {
+    'annotate-hosts': ('infoblox', INFOBLOX_DEFAULTS, ['annotate-hosts.py'], ['clear-cache.py']),
+    'annotate-tenants': ('infoblox', INFOBLOX_DEFAULTS, ['annotate-hosts.py'], ['clear-cache.py']),
+    'create-inventory-filters': ('infoblox', INFOBLOX_DEFAULTS, ['create-inventory-filters.py'], ['clear-cache.py']),
+    'vcenter': ('vcenter', VCENTER_DEFAULTS, ['eco_action.py'], ['eco_action.py'])
+}
+
+# ============================================================================
+# Functions
+# ----------------------------------------------------------------------------
+
+def script_env(servers, defaults, extra=None):
+    ''' Environment for a script: mock endpoints, then the user's settings, then defaults. '''
+    env = dict((k, v) for (k, v) in os.environ.items() if k not in DROPPED_ENV)
+    for name, value in defaults.items():
+        env.setdefault(name, value)
+    # annotate every extensible attribute the world has
+    env.setdefault('EA_LIST', json.dumps([{'value': name} for name in servers['infoblox'].world.extattr_names]))
+    vcenter_host, vcenter_port = servers['vcenter'].address.split(':')
+    env.update({
+        'TETRATION_ENDPOINT': 'https://' + servers['tetration'].address,
+        'TETRATION_API_KEY': 'benchmark', 'TETRATION_API_SECRET': 'benchmark',
+        'INFOBLOX_HOST': servers['infoblox'].address,
+        'INFOBLOX_USER': 'benchmark', 'INFOBLOX_PWD': 'benchmark',
+        'VCENTER_HOST': vcenter_host, 'VCENTER_PORT': vcenter_port,
+        'VCENTER_USER': 'benchmark', 'VCENTER_PWD': 'benchmark'
+    })
+    env.update(extra or {})
+    return env
+
+def run(command, cwd, env, log_path):
+    '''
+    Runs command with its output in log_path and returns (exit code, wall
+    seconds, peak RSS in KB). wait4 reports the largest RSS of the process
+    and of every descendant it waited for, so the vCenter action is measured
+    across all four of its scripts.
+    '''
+    with open(log_path, 'w') as log:
+        started = time.time()
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.time() - started
+    # wait4 already reaped the child; keep Popen from trying again
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    return process.returncode, wall, usage.ru_maxrss
+
+def pigeons(log_path):
+    ''' Returns the Pigeon messages found in a script log, in order. '''
+    found = []
+    with open(log_path) as log:
+        for line in log:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(message, dict) and 'status_code' in message:
+                found.append(message)
+    return found
+
+def run_scenario(name, servers, workdir, python, repeat):
+    image, defaults, command, clear = SCENARIOS[name]
+    cwd = os.path.join(workdir, image)
+    log_path = os.path.join(workdir, '{}-{}.log'.format(name, repeat))
+
+    for server in servers.values():
+        server.reset_stats()
+    run([python] + clear, cwd, script_env(servers, defaults, {'ACTION': 'CLEAR_CACHE'}), log_path)
+    for server in servers.values():
+        server.reset_stats()
+
+    extra = {'ACTION': 'RUN_INTEGRATION'}
+    if name == 'annotate-tenants':
+        # the root scope of every VRF
+        extra['ANNOTATION_TENANT_SCOPE_NAME'] = json.dumps([{'value': vrf['name']} for vrf in servers['tetration'].world.vrfs()])
+    exit_code, wall, peak_rss = run([python] + command, cwd, script_env(servers, defaults, extra), log_path)
+    messages = pigeons(log_path)
+    statuses = {}
+    for message in messages:
+        statuses[str(message['status_code'])] = statuses.get(str(message['status_code']), 0) + 1
+
+    api = {}
+    totals = {'calls': 0, 'errors': 0, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0}
+    for server in servers.values():
+        stats = server.snapshot()
+        if stats:
+            api[server.name] = stats
+        for endpoint in stats.values():
+            for key in totals:
+                totals[key] += endpoint[key]
+
+    return {
+        'scenario': name,
+        'repeat': repeat,
+        'exit_code': exit_code,
+        'wall_seconds': round(wall, 3),
+        'peak_rss_kb': peak_rss,
+        # the last non-progress Pigeon tells whether the run finished
+        'final_status': ([m['status_code'] for m in messages if m['status_code'] != 100] or [None])[-1],
+        'pigeon_status_codes': statuses,
+        # what the request governors of the infoblox scripts did, if any
+        'traffic': ([m['data']['traffic'] for m in messages if isinstance(m.get('data'), dict) and 'traffic' in m['data']] or [None])[-1],
+        'api_totals': totals,
+        'api': api,
+        'log': log_path
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the integrations against local mock servers.')
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 503')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run, may be repeated (default: all)')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each scenario')
+    parser.add_argument('--keep-annotations', action='store_true',
+                        help='keep the annotations of earlier runs of a scenario in Tetration')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the injected errors')
+    parser.add_argument('--python', default=sys.executable, help='interpreter for the scripts')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    add_traffic_arguments(parser)
+    add_world_arguments(parser)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='load_benchmark_')
+    created = [path for path in STATE_DIRS if not os.path.exists(path)]
+    for path in created:
+        os.makedirs(path)
+    for image, source in IMAGES.items():
+        shutil.copytree(source, os.path.join(workdir, image), ignore=shutil.ignore_patterns('*.pyc'))
+
+    certfile, keyfile = make_certificate(workdir)
+    world = world_from_arguments(args)
+    servers = start_servers(world, args.latency / 1000.0, args.error_rate, certfile, keyfile, args.seed,
+                            rate_limit=args.rate_limit, outage=args.outage)
+    runs = []
+    try:
+        for name in args.scenario or ['annotate-hosts', 'create-inventory-filters', 'vcenter']:
+            for repeat in range(args.repeat):
+                if repeat == 0 or not args.keep_annotations:
+                    servers['tetration'].reset_annotations()
+                runs.append(run_scenario(name, servers, workdir, args.python, repeat))
+    finally:
+        for server in servers.values():
+            server.stop()
+        for path in created:
+            shutil.rmtree(path, ignore_errors=True)
+
+    report = json.dumps({
+        'config': {'hosts': world.hosts, 'subnets': world.subnets, 'vms': world.vms, 'world_seed': world.seed,
+                   'network_views': world.network_views, 'vrfs': world.vrf_count,
+                   'extattrs': len(world.extattr_names), 'tags': len(world.tag_names),
+                   'custom_fields': len(world.custom_field_names), 'max_vm_ips': world.max_vm_ips,
+                   'latency_ms': args.latency, 'error_rate': args.error_rate, 'seed': args.seed,
+                   'rate_limit': args.rate_limit, 'outage': args.outage,
+                   'python': args.python},
+        'runs': runs
+    }, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(report + '\n')
+    else:
+        print report
+
+if __name__ == '__main__':
+    main()
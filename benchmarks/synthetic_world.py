@@ -0,0 +1,443 @@
+"""
+Deterministic synthetic worlds for load and scaling tests. A world is N hosts
+spread over M /24 subnets with everything the integrations read about them:
+
+- Infoblox: ipv4address records with names, zones, network views and
+  extensible attributes, network records with or without a comment, and the
+  extensible attribute definitions
+- Tetration: the inventory record of every host, VRFs and application scopes
+- vCenter: VMs with one to several IP addresses, an ESX host, networks, tags
+  and custom attributes
+
+Nothing is generated up front. Every attribute of host i (or VM v, or subnet
+j) is drawn from a hash of the seed and the index, so the same seed always
+gives the same world, any single host can be looked up in constant time (the
+mock servers do that for every request) and write_dataset streams a world of
+millions of hosts to disk in constant memory.
+
+Usage: python synthetic_world.py OUTPUT_DIR [--hosts N] [--subnets N] [--world-seed N] [--churn R]
+"""
+
+# pylint: disable=invalid-name
+
+import os
+import csv
+import json
+import argparse
+
+# subnets are handed out round-robin over these ranges, so the default
+# INVENTORY_PARTITIONS of the scripts each get a share of the hosts and
+# 100.64.0.0/10 lands in the catch-all partition
+REGIONS = [(0x0A000000, 32768), (0x0A800000, 32768), (0xAC100000, 4096), (0x64400000, 16384)]
+MAX_SUBNETS = len(REGIONS) * min(size for (_, size) in REGIONS)
+# at most 254 hosts fit in each /24
+HOSTS_PER_SUBNET = 254
+
+ROLES = ['web', 'app', 'db', 'cache', 'mq', 'api', 'auth', 'batch', 'etl', 'proxy']
+ENVIRONMENTS = ['prod', 'staging', 'dev', 'lab']
+OPERATING_SYSTEMS = [('CentOS', '7.4', 'linux'), ('Ubuntu', '16.04', 'linux'),
+                     ('MSServer2012R2Standard', '6.3', 'windows'), ('RHEL', '7.5', 'linux')]
+EXTATTR_NAMES = ['Owner', 'Environment', 'Location', 'Cost Center', 'Application', 'Tier',
+                 'Support Group', 'Business Unit', 'Compliance', 'Backup Policy']
+CUSTOM_FIELD_NAMES = ['Owner', 'Application', 'Created By', 'Ticket', 'Expires']
+SCOPE_ID = '5a1b2c3d4e5f60718293a4b5'
+
+# salts that keep the draws for different attributes independent
+HOST, SUBNET, VM, EXTATTR, CUSTOM, TAG = range(6)
+MASK = (1 << 64) - 1
+
+# ============================================================================
+# Functions
+# ----------------------------------------------------------------------------
+
+def int_to_ip(value):
+    ''' Returns the integer as a dotted quad IPv4 address. '''
+    return '%d.%d.%d.%d' % (value >> 24, (value >> 16) & 255, (value >> 8) & 255, value & 255)
+
+def ip_to_int(ip):
+    ''' Returns the dotted quad IPv4 address as an integer. '''
+    parts = [int(part) for part in ip.split('.')]
+    return (parts[0] << 24) | (parts[1] << 16) | (parts[2] << 8) | parts[3]
+
+def mix(*values):
+    ''' 64-bit hash of a few integers (splitmix64 finalizer per value). '''
+    h = 0x9E3779B97F4A7C15
+    for value in values:
+        h = ((h ^ value) * 0xBF58476D1CE4E5B9) & MASK
+        h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & MASK
+        h ^= h >> 31
+    return h
+
+# ============================================================================
+# Classes
+# ----------------------------------------------------------------------------
+
+class World(object):
+    '''
+    Host i lives in /24 subnet i % subnets at address i // subnets + 1. VM v
+    owns host v as its first address and, when it has more than one, hosts
+    from the range after the last VM, so IP addresses are never shared and
+    the hosts no VM claims are bare metal.
+    '''
+    def __init__(self, hosts, subnets=None, seed=0, vms=None, network_views=1, vrfs=1,
+                 extattrs=4, tags=20, custom_fields=2, max_vm_ips=3, ipam_coverage=0.9,
+                 comment_coverage=0.85):
+        self.hosts = hosts
+        self.subnets = subnets or max(1, (hosts + 199) // 200)
+        if self.subnets * HOSTS_PER_SUBNET < hosts:
+            raise ValueError('{} subnets cannot hold {} hosts'.format(self.subnets, hosts))
+        if self.subnets > MAX_SUBNETS:
+            raise ValueError('at most {} subnets are supported'.format(MAX_SUBNETS))
+        self.seed = seed
+        self.max_vm_ips = max(1, max_vm_ips)
+        self.vms = min(hosts, hosts // self.max_vm_ips or 1) if vms is None else min(vms, hosts)
+        self.network_views = max(1, network_views)
+        self.vrf_count = max(1, vrfs)
+        self.extattr_names = (EXTATTR_NAMES + ['Attribute {}'.format(n) for n in range(len(EXTATTR_NAMES), extattrs)])[:extattrs]
+        self.custom_field_names = (CUSTOM_FIELD_NAMES + ['Field {}'.format(n) for n in range(len(CUSTOM_FIELD_NAMES), custom_fields)])[:custom_fields]
+        self.tag_names = ['tag-{}'.format(n) for n in range(tags)]
+        self.esx_hosts = max(1, self.vms // 20)
+        self.ipam_coverage = int(ipam_coverage * 1000)
+        self.comment_coverage = int(comment_coverage * 1000)
+
+    def draw(self, salt, index, extra=0):
+        return mix(self.seed, salt, index, extra)
+
+    # --- addresses ----------------------------------------------------------
+
+    def subnet_base(self, j):
+        base, _ = REGIONS[j % len(REGIONS)]
+        return base + ((j // len(REGIONS)) << 8)
+
+    def subnet(self, j):
+        return int_to_ip(self.subnet_base(j)) + '/24'
+
+    def ip_int(self, i):
+        return self.subnet_base(i % self.subnets) + i // self.subnets + 1
+
+    def ip(self, i):
+        return int_to_ip(self.ip_int(i))
+
+    def subnet_index(self, value):
+        ''' Returns the index of the subnet holding the integer address, or None. '''
+        base = value & ~255
+        for (r, (start, size)) in enumerate(REGIONS):
+            if start <= base < start + (size << 8):
+                j = ((base - start) >> 8) * len(REGIONS) + r
+                return j if j < self.subnets else None
+        return None
+
+    def index(self, ip):
+        ''' Returns the host index of the IP address, or None. '''
+        try:
+            value = ip_to_int(ip)
+        except (ValueError, IndexError):
+            return None
+        j = self.subnet_index(value)
+        offset = (value & 255) - 1
+        if j is None or offset < 0:
+            return None
+        i = offset * self.subnets + j
+        return i if i < self.hosts else None
+
+    def subnet_hosts(self, j):
+        ''' Host indexes in subnet j. '''
+        return xrange(j, self.hosts, self.subnets)
+
+    # --- subnets ------------------------------------------------------------
+
+    def network_view(self, j):
+        return 'default' if self.network_views == 1 else 'view-{}'.format(j % self.network_views)
+
+    def vrf(self, j):
+        ''' (id, name) of the VRF of subnet j; VRF 1 is Default. '''
+        vrf_id = 1 + j % self.vrf_count
+        return vrf_id, 'Default' if vrf_id == 1 else 'Tenant-{}'.format(vrf_id)
+
+    def site(self, j):
+        return 'site-{}'.format(self.draw(SUBNET, j, 1) % 50)
+
+    def zone(self, j):
+        return '{}.example.com'.format(self.site(j))
+
+    def subnet_comment(self, j):
+        if self.draw(SUBNET, j) % 1000 >= self.comment_coverage:
+            return None
+        return 'Site-{}'.format(self.site(j).split('-')[1])
+
+    def network_record(self, j):
+        ''' The Infoblox network record of subnet j. '''
+        record = {'_ref': 'network/{}:{}/{}'.format(j, self.subnet(j), self.network_view(j)),
+                  'network': self.subnet(j), 'network_view': self.network_view(j)}
+        comment = self.subnet_comment(j)
+        if comment:
+            record['comment'] = comment
+        return record
+
+    # --- hosts --------------------------------------------------------------
+
+    def hostname(self, i):
+        return '{}-{:07d}'.format(ROLES[self.draw(HOST, i, 1) % len(ROLES)], i)
+
+    def fqdn(self, i):
+        return '{}.{}'.format(self.hostname(i), self.zone(i % self.subnets))
+
+    def in_ipam(self, i):
+        return self.draw(HOST, i) % 1000 < self.ipam_coverage
+
+    def extattrs(self, i):
+        ''' Extensible attributes of host i; about one in ten is left unset. '''
+        found = {}
+        for (n, name) in enumerate(self.extattr_names):
+            value = self.draw(EXTATTR, i, n)
+            if value % 10 == 0:
+                continue
+            if name == 'Environment':
+                found[name] = {'value': ENVIRONMENTS[value % len(ENVIRONMENTS)]}
+            elif name == 'Location':
+                found[name] = {'value': self.site(i % self.subnets)}
+            else:
+                found[name] = {'value': '{}-{}'.format(name.split()[0].lower(), value % 97)}
+        return found
+
+    def host_record(self, i):
+        ''' The Infoblox ipv4address record of host i. '''
+        j = i % self.subnets
+        return {
+            '_ref': 'ipv4address/{}:{}/{}'.format(i, self.ip(i), self.network_view(j)),
+            'ip_address': self.ip(i),
+            'network': self.subnet(j),
+            'network_view': self.network_view(j),
+            'names': [self.fqdn(i)],
+            'status': 'USED',
+            'extattrs': self.extattrs(i)
+        }
+
+    def inventory(self, i):
+        ''' The Tetration inventory record of host i, with the fields a real one has. '''
+        ip = self.ip(i)
+        vrf_id, vrf_name = self.vrf(i % self.subnets)
+        os_name, os_version, platform = OPERATING_SYSTEMS[self.draw(HOST, i, 2) % len(OPERATING_SYSTEMS)]
+        return {
+            'ip': ip,
+            'vrf_id': vrf_id,
+            'vrf_name': vrf_name,
+            'address_type': 'IPV4',
+            'host_name': self.hostname(i),
+            'host_uuid': '{:016x}{:016x}'.format(self.seed & MASK, i),
+            'os': os_name,
+            'os_version': os_version,
+            'platform': platform,
+            'agent_type': 'ENFORCER',
+            'tags_scope_id': [SCOPE_ID],
+            'vrf_ids': [vrf_id],
+            'last_software_update_at': 1514764800 + self.draw(HOST, i, 3) % 31536000,
+            'interfaces': [{'ip': ip, 'name': 'eth0', 'netmask': '255.255.255.0',
+                            'mac': '00:50:56:{:02x}:{:02x}:{:02x}'.format((i >> 16) & 255, (i >> 8) & 255, i & 255)}]
+        }
+
+    def field(self, i, name):
+        ''' One field of the inventory record of host i, without building it all. '''
+        if name == 'ip':
+            return self.ip(i)
+        if name == 'vrf_id':
+            return self.vrf(i % self.subnets)[0]
+        return self.inventory(i).get(name)
+
+    def vrfs(self):
+        return [{'id': vrf_id, 'name': 'Default' if vrf_id == 1 else 'Tenant-{}'.format(vrf_id), 'tenant_id': vrf_id - 1}
+                for vrf_id in range(1, self.vrf_count + 1)]
+
+    def scopes(self):
+        ''' One root scope per VRF with a child scope per site. '''
+        scopes = []
+        for vrf in self.vrfs():
+            root_id = SCOPE_ID if vrf['id'] == 1 else '{:024x}'.format(vrf['id'])
+            scopes.append({'id': root_id, 'name': vrf['name'], 'short_name': vrf['name'], 'vrf_id': vrf['id'],
+                           'parent_app_scope_id': None, 'root_app_scope_id': root_id,
+                           'query': {'type': 'eq', 'field': 'vrf_id', 'value': vrf['id']}})
+            for site in range(50):
+                scopes.append({'id': '{:024x}'.format((vrf['id'] << 16) + site + 1),
+                               'name': '{}:Site-{}'.format(vrf['name'], site), 'short_name': 'Site-{}'.format(site),
+                               'vrf_id': vrf['id'], 'parent_app_scope_id': root_id, 'root_app_scope_id': root_id,
+                               'query': {'type': 'eq', 'field': 'user_Location', 'value': 'site-{}'.format(site)}})
+        return scopes
+
+    # --- VMs ----------------------------------------------------------------
+
+    def vm_hosts(self, v):
+        ''' Host indexes whose addresses VM v reports. '''
+        extra = self.draw(VM, v) % self.max_vm_ips
+        first = self.vms + v * (self.max_vm_ips - 1)
+        return [v] + [i for i in range(first, first + extra) if i < self.hosts]
+
+    def vm_name(self, v):
+        return 'vm-{}-{:07d}'.format(ROLES[self.draw(HOST, v, 1) % len(ROLES)], v)
+
+    def vm_tools_ok(self, v):
+        return self.draw(VM, v, 1) % 50 != 0
+
+    def vm_esx_host(self, v):
+        return self.draw(VM, v, 2) % self.esx_hosts
+
+    def vm_networks(self, v):
+        ''' Subnet indexes of the port groups VM v is connected to. '''
+        networks = []
+        for i in self.vm_hosts(v):
+            if i % self.subnets not in networks:
+                networks.append(i % self.subnets)
+        return networks
+
+    def vm_tags(self, v):
+        ''' Up to three distinct tag indexes. '''
+        if not self.tag_names:
+            return []
+        draw = self.draw(TAG, v)
+        tags = []
+        for n in range(draw % 4):
+            tag = (draw >> (8 * (n + 1))) % len(self.tag_names)
+            if tag not in tags:
+                tags.append(tag)
+        return tags
+
+    def vm_custom_values(self, v):
+        ''' (field index, value) pairs; unset fields are left out. '''
+        values = []
+        for (n, name) in enumerate(self.custom_field_names):
+            draw = self.draw(CUSTOM, v, n)
+            if draw % 4:
+                values.append((n, '{}-{}'.format(name.split()[0].lower(), draw % 211)))
+        return values
+
+    def vm(self, v):
+        ''' VM v as a plain dictionary, the way write_dataset saves it. '''
+        return {
+            'moid': 'vm-{}'.format(v),
+            'name': self.vm_name(v),
+            'ips': [self.ip(i) for i in self.vm_hosts(v)],
+            'tools_ok': self.vm_tools_ok(v),
+            'esx_host': 'host-{}'.format(self.vm_esx_host(v)),
+            'networks': ['network-{}'.format(j) for j in self.vm_networks(v)],
+            'tags': [self.tag_names[t] for t in self.vm_tags(v)],
+            'custom_values': dict((self.custom_field_names[n], value) for (n, value) in self.vm_custom_values(v))
+        }
+
+    def inventory_row(self, v, headings, generation=0):
+        '''
+        Row of the collect_inventory.py CSV for the first address of VM v.
+        generation changes the VM name, as a rename between two runs would.
+        '''
+        values = {
+            'IP': self.ip(v), 'VRF': self.vrf(v % self.subnets)[1],
+            'VM Name': self.vm_name(v) + ('-r{}'.format(generation) if generation else ''),
+            'VM Location': 'esx-{}.example.com'.format(self.vm_esx_host(v)),
+            'VM Tags': ';'.join(sorted(self.tag_names[t] for t in self.vm_tags(v))),
+            'VM Attributes': ';'.join('{}={}'.format(self.custom_field_names[n], value)
+                                      for (n, value) in self.vm_custom_values(v)),
+            'VM Networks': ';'.join('VLAN-{}'.format(j) for j in self.vm_networks(v))
+        }
+        return dict((heading, values.get(heading, '')) for heading in headings)
+
+# ============================================================================
+# Output
+# ----------------------------------------------------------------------------
+
+INVENTORY_HEADINGS = ['IP', 'VRF', 'VM Name', 'VM Location', 'VM Tags', 'VM Attributes', 'VM Networks']
+
+def write_lines(path, records):
+    ''' Writes one JSON document per line and returns the number written. '''
+    count = 0
+    with open(path, 'w') as outfile:
+        for record in records:
+            outfile.write(json.dumps(record, sort_keys=True) + '\n')
+            count += 1
+    return count
+
+def write_json(path, data):
+    with open(path, 'w') as outfile:
+        json.dump(data, outfile, indent=4, sort_keys=True)
+
+def write_inventory_csvs(world, old_path, new_path, churn=0.05, headings=INVENTORY_HEADINGS):
+    '''
+    Writes two vCenter inventories in the CSV format of collect_inventory.py
+    for the VMs of the world, the way diff_inventory.py finds them on two
+    consecutive runs: of the VMs touched by churn, a third are new, a third
+    were renamed and a third were deleted. Returns the number of rows in each.
+    '''
+    threshold = int(churn * 3000)
+    counts = [0, 0]
+    with open(old_path, 'wb') as old_file, open(new_path, 'wb') as new_file:
+        old = csv.DictWriter(old_file, fieldnames=headings, quoting=csv.QUOTE_ALL)
+        new = csv.DictWriter(new_file, fieldnames=headings, quoting=csv.QUOTE_ALL)
+        old.writeheader()
+        new.writeheader()
+        for v in xrange(world.vms):
+            draw = world.draw(VM, v, 3) % 3000
+            change = draw // 1000 if draw % 1000 < threshold // 3 else None
+            if change != 0:
+                old.writerow(world.inventory_row(v, headings))
+                counts[0] += 1
+            if change != 2:
+                new.writerow(world.inventory_row(v, headings, 1 if change == 1 else 0))
+                counts[1] += 1
+    return counts
+
+def write_dataset(world, directory, churn=0.05):
+    '''
+    Streams the whole world to directory and returns the number of records
+    written per file:
+    --tetration/inventory.jsonl, vrfs.json, scopes.json
+    --infoblox/network.jsonl, ipv4address.jsonl (hosts known to Infoblox),
+        extensibleattributedef.json
+    --vcenter/vms.jsonl, tags.json, custom_fields.json, and
+        inventory_previous.csv / inventory_current.csv for diff_inventory.py
+    '''
+    for name in ['tetration', 'infoblox', 'vcenter']:
+        if not os.path.isdir(os.path.join(directory, name)):
+            os.makedirs(os.path.join(directory, name))
+    path = lambda *parts: os.path.join(directory, *parts)
+    counts = {}
+    counts['tetration/inventory.jsonl'] = write_lines(path('tetration', 'inventory.jsonl'),
+                                                      (world.inventory(i) for i in xrange(world.hosts)))
+    write_json(path('tetration', 'vrfs.json'), world.vrfs())
+    write_json(path('tetration', 'scopes.json'), world.scopes())
+    counts['infoblox/network.jsonl'] = write_lines(path('infoblox', 'network.jsonl'),
+                                                   (world.network_record(j) for j in xrange(world.subnets)))
+    counts['infoblox/ipv4address.jsonl'] = write_lines(path('infoblox', 'ipv4address.jsonl'),
+                                                       (world.host_record(i) for i in xrange(world.hosts) if world.in_ipam(i)))
+    write_json(path('infoblox', 'extensibleattributedef.json'), [{'name': name} for name in world.extattr_names])
+    counts['vcenter/vms.jsonl'] = write_lines(path('vcenter', 'vms.jsonl'), (world.vm(v) for v in xrange(world.vms)))
+    write_json(path('vcenter', 'tags.json'), world.tag_names)
+    write_json(path('vcenter', 'custom_fields.json'), world.custom_field_names)
+    counts['vcenter/inventory_previous.csv'], counts['vcenter/inventory_current.csv'] = write_inventory_csvs(
+        world, path('vcenter', 'inventory_previous.csv'), path('vcenter', 'inventory_current.csv'), churn)
+    return counts
+
+def add_world_arguments(parser):
+    ''' Adds the options that shape a World to an argparse parser. '''
+    parser.add_argument('--hosts', type=int, default=10000, help='hosts in the world')
+    parser.add_argument('--subnets', type=int, default=None, help='/24 subnets the hosts are spread over')
+    parser.add_argument('--vms', type=int, default=None, help='VMs in vCenter (default: hosts / max VM IPs)')
+    parser.add_argument('--world-seed', type=int, default=0, help='seed of the world')
+    parser.add_argument('--network-views', type=int, default=1)
+    parser.add_argument('--vrfs', type=int, default=1)
+    parser.add_argument('--extattrs', type=int, default=4, help='extensible attributes per host')
+    parser.add_argument('--tags', type=int, default=20, help='vSphere tags')
+    parser.add_argument('--custom-fields', type=int, default=2, help='vCenter custom attributes')
+    parser.add_argument('--max-vm-ips', type=int, default=3, help='most IPv4 addresses a VM reports')
+
+def world_from_arguments(args):
+    return World(args.hosts, args.subnets, args.world_seed, args.vms, args.network_views, args.vrfs,
+                 args.extattrs, args.tags, args.custom_fields, args.max_vm_ips)
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic world to disk.')
+    parser.add_argument('output', help='directory for the dataset')
+    parser.add_argument('--churn', type=float, default=0.05, help='share of VMs that differ between the two inventory CSVs')
+    add_world_arguments(parser)
+    args = parser.parse_args()
+    world = world_from_arguments(args)
+    print json.dumps(write_dataset(world, args.output, args.churn), indent=4, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
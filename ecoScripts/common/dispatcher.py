@@ -0,0 +1,291 @@
+"""
+Runs the scripts of an action inside the interpreter of eco_action.py instead
+of starting a new python process for each, and optionally keeps that
+interpreter alive as a worker that takes ACTION requests over a local socket.
+
+Every script still runs as __main__ with a fresh namespace, exactly as if it
+was started with "python script.py", so it reads its environment variables
+and builds its state the same way. What it no longer pays for is the
+interpreter start-up and the import of tetpyclient, requests and the client
+of the integration (pyVmomi or infoblox_client), which are already in
+sys.modules after the first script. Handlers a script registers with atexit
+run when the script ends, like they would when its process exits.
+
+Clients that a script gets through shared() (the Tetration RestClient, the
+vCenter ServiceInstance or the infoblox connector) are reused by the next
+scripts of the same action, and by every later request when running as a
+worker, so chained steps log in once.
+
+This file is shared by the vcenter and infoblox images. Image/dispatcher.py of
+each is a link to it, and the Dockerfile copies it in from the "common" build
+context (docker build --build-context common=../../common .).
+
+Keyword environment variables:
+--IN_PROCESS_ACTIONS: "off" starts one python process per script as before
+--ECO_WORKER_SOCKET: path of the worker socket; when a worker listens there,
+    eco_action.py hands the action to it and relays its output
+
+Copyright (c) 2018 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Doron Chosnek"
+__copyright__ = "Copyright (c) 2018 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+# pylint: disable=invalid-name
+
+import os
+import sys
+import json
+import atexit
+import signal
+import socket
+import threading
+import traceback
+import subprocess
+
+DISPLAY_ON_TEXT = ['on', 'true', 'yes', '1']
+
+# a worker serves one request at a time: scripts read os.environ, which is
+# shared by the whole process
+_lock = threading.Lock()
+
+# key -> (client, close function) while clients are shared (see shared)
+_clients = {}
+_sharing = False
+
+# ============================================================================
+# Functions
+# ----------------------------------------------------------------------------
+
+def in_process():
+    ''' True unless IN_PROCESS_ACTIONS turns in-process dispatching off. '''
+    return os.getenv('IN_PROCESS_ACTIONS', 'on').lower() in DISPLAY_ON_TEXT
+
+def shared(key, factory, close=None, alive=None):
+    '''
+    Returns the client stored under key, or the one factory() returns. The
+    client is only kept while a dispatcher runs the scripts; a script started
+    on its own gets a new client every time. alive(client) tells whether a
+    kept client can still be used, for sessions the server may have ended.
+    close(client) is called when the dispatcher lets go of it.
+    '''
+    if not _sharing:
+        return factory()
+    if key in _clients:
+        client = _clients[key][0]
+        try:
+            if alive is None or alive(client):
+                return client
+        except Exception:
+            pass
+        _clients.pop(key)
+    client = factory()
+    _clients[key] = (client, close)
+    return client
+
+def is_shared(client):
+    ''' True if client is kept by the dispatcher and must not be closed. '''
+    return any(c is client for (c, _) in _clients.values())
+
+def close_shared():
+    ''' Closes and forgets every shared client. '''
+    for client, close in _clients.values():
+        if close is not None:
+            try:
+                close(client)
+            except Exception:
+                pass
+    _clients.clear()
+
+def run_script(path):
+    '''
+    Runs path as __main__ in this interpreter and returns its exit code the
+    way the process would have: 0, the code passed to SystemExit, or 1 after
+    an uncaught exception, whose traceback goes to stderr.
+    '''
+    # handlers registered by the script itself run when it ends, as they
+    # would at the exit of its process; those of the libraries it imports
+    # (urllib3 registers one) belong to the interpreter and are left alone
+    handlers = []
+    register = atexit.register
+    def register_for_script(func, *targs, **kargs):
+        if os.path.abspath(sys._getframe(1).f_code.co_filename) == os.path.abspath(path):
+            handlers.append((func, targs, kargs))
+            return func
+        return register(func, *targs, **kargs)
+
+    argv = sys.argv
+    sys.argv = [path]
+    atexit.register = register_for_script
+    code = 0
+    try:
+        with open(path) as script:
+            compiled = compile(script.read(), path, 'exec', 0, True)
+        # a plain dict rather than runpy, whose temporary module sets every
+        # global to None once it returns, before the handlers below run
+        exec compiled in {'__name__': '__main__', '__file__': path, '__builtins__': __builtins__}
+    except SystemExit as error:
+        if error.code is None:
+            code = 0
+        elif isinstance(error.code, int):
+            code = error.code
+        else:
+            sys.stderr.write(str(error.code) + '\n')
+            code = 1
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.argv = argv
+        atexit.register = register
+        for func, targs, kargs in reversed(handlers):
+            try:
+                func(*targs, **kargs)
+            except Exception:
+                traceback.print_exc()
+        sys.stdout.flush()
+    return code
+
+def call(command):
+    '''
+    Drop-in for subprocess.call: python scripts run in this interpreter
+    unless IN_PROCESS_ACTIONS is off, anything else in a new process.
+    '''
+    if command[0] == 'python' and len(command) == 2 and in_process():
+        return run_script(command[1])
+    sys.stdout.flush()
+    return subprocess.call(command)
+
+def dispatch(action):
+    '''
+    Runs action(), a function that calls the scripts of an action through
+    call(), with clients shared between those scripts. They are closed when
+    the action is done.
+    '''
+    global _sharing
+    _sharing = in_process()
+    try:
+        action()
+    finally:
+        close_shared()
+        _sharing = False
+
+class _SocketWriter(object):
+    ''' stdout of a request: every write goes straight to the client. '''
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.softspace = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        try:
+            self.connection.sendall(data)
+        except socket.error:
+            # the client went away; let the action finish regardless
+            pass
+
+    def flush(self):
+        pass
+
+def _serve_request(connection, action):
+    request = ''
+    while not request.endswith('\n'):
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        request += chunk
+    env = json.loads(request)['env']
+
+    saved_env = dict(os.environ)
+    stdout = sys.stdout
+    with _lock:
+        os.environ.clear()
+        os.environ.update(env)
+        sys.stdout = _SocketWriter(connection)
+        try:
+            action()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            sys.stdout = stdout
+            os.environ.clear()
+            os.environ.update(saved_env)
+
+def serve(path, action, preload=()):
+    '''
+    Worker mode: imports the modules in preload, then listens on the Unix
+    socket path and runs action() for every request, with the environment of
+    the request and its output sent back as it is printed. Clients stay
+    shared across requests. The socket is only accessible to the user
+    running the worker, since requests carry credentials.
+    '''
+    global _sharing
+    for module in preload:
+        __import__(module)
+    # exit through the finally below, which logs out of the shared clients
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(8)
+    _sharing = in_process()
+    try:
+        while True:
+            connection, _ = server.accept()
+            try:
+                _serve_request(connection, action)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                connection.close()
+    finally:
+        close_shared()
+        server.close()
+        os.remove(path)
+
+def forward(path):
+    '''
+    Hands the environment of this process to the worker listening on path
+    and copies its output to stdout. Returns False when no worker listens
+    there, so the caller can run the action itself.
+    '''
+    if not path or not os.path.exists(path):
+        return False
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except socket.error:
+        client.close()
+        return False
+    try:
+        client.sendall(json.dumps({'env': dict(os.environ)}) + '\n')
+        while True:
+            data = client.recv(65536)
+            if not data:
+                break
+            sys.stdout.write(data)
+            sys.stdout.flush()
+    finally:
+        client.close()
+    return True
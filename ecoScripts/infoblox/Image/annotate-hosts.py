@@ -7,13 +7,18 @@ import sys
 import os
 import netaddr
 import time
+import atexit
 import requests
+import re
+import hashlib
+from multiprocessing.pool import ThreadPool
 
 # ====================================================================================
 # GLOBALS
 # ------------------------------------------------------------------------------------
 # Read in environment variables
 QUERY_LIMIT = 200
+# annotation rows from every page are spooled here and cut into upload chunks
 ANNOTATION_CSV_FILENAME = '/private/user_annotations.csv'
 # Tetration
 TETRATION_ENDPOINT = os.environ['TETRATION_ENDPOINT']
@@ -22,7 +27,50 @@ TETRATION_API_SECRET = os.environ['TETRATION_API_SECRET']
 TETRATION_OPTS = {
     'limit': QUERY_LIMIT
 }
-TETRATION_TENANT_SCOPE_NAME = json.loads(os.environ['ANNOTATION_TENANT_SCOPE_NAME'])[0]["value"]
+# Multi-tenant runs: every selected tenant scope is annotated by this run,
+# up to TENANT_WORKERS of them at once over the same tetration and infoblox
+# clients, with their own checkpoint, sync state and spool files
+TETRATION_TENANT_SCOPE_NAMES = [scope["value"] for scope in json.loads(os.environ['ANNOTATION_TENANT_SCOPE_NAME'])]
+TETRATION_TENANT_SCOPE_NAME = TETRATION_TENANT_SCOPE_NAMES[0]
+TENANT_WORKERS = int(os.getenv('ANNOTATION_TENANT_WORKERS', default=4))
+PREFETCH_SUBNETS = os.getenv('PREFETCH_SUBNETS', default='off')
+# Inventory paging: the search is split into one partition per subnet plus one
+# for everything else, and up to INVENTORY_WORKERS partitions are paged at once
+INVENTORY_PARTITIONS = [subnet.strip() for subnet in os.getenv('INVENTORY_PARTITIONS', default='10.0.0.0/9,10.128.0.0/9,172.16.0.0/12,192.168.0.0/16').split(',') if subnet.strip()]
+INVENTORY_WORKERS = int(os.getenv('INVENTORY_WORKERS', default=4))
+
+# Incremental sync: re-annotate only the IPs whose infoblox records changed
+# since the db_objects sequence ID saved by the previous run, with a full
+# sweep at least every FULL_SWEEP_INTERVAL seconds
+INCREMENTAL_SYNC = os.getenv('INCREMENTAL_SYNC', default='off')
+FULL_SWEEP_INTERVAL = int(os.getenv('FULL_SWEEP_INTERVAL', default=86400))
+SYNC_STATE_FILENAME = '/private/infoblox_sync_state.json'
+
+# Reconciliation: full sweeps read every host and compare the rows they
+# build with the CMDB download of the scope, so only new and changed rows
+# are uploaded, stale annotations are updated and vanished hosts are deleted
+CMDB_RECONCILE = os.getenv('CMDB_RECONCILE', default='off')
+CMDB_CSV_FILENAME = '/private/cmdb_download.csv'
+DELETE_CSV_FILENAME = '/private/user_annotation_deletes.csv'
+
+# Progress of a full sweep (partition cursors, spool and unposted chunks),
+# saved after every committed page so a run that dies can be resumed
+CHECKPOINT_FILENAME = '/private/annotation_checkpoint.json'
+
+# Pipeline: worker threads per stage and the number of pages allowed to wait
+# in front of each stage before the stage feeding it has to wait
+PIPELINE_OPTS = {
+    'enrich_workers': int(os.getenv('PIPELINE_ENRICH_WORKERS', default=2)),
+    'build_workers': 1,
+    'upload_workers': int(os.getenv('PIPELINE_UPLOAD_WORKERS', default=1)),
+    'queue_size': int(os.getenv('PIPELINE_QUEUE_SIZE', default=2))
+}
+
+# Upload batching: a chunk is posted once it holds this many rows or bytes
+UPLOAD_OPTS = {
+    'max_rows': int(os.getenv('UPLOAD_BATCH_ROWS', default=10000)),
+    'max_bytes': int(os.getenv('UPLOAD_BATCH_BYTES', default=4 * 1024 * 1024))
+}
 
 # Infoblox
 INFOBLOX_OPTS = {
@@ -40,6 +88,16 @@ INFOBLOX_OPTS = {
     'log_api_calls_as_info': False,
     'paging': True
 }
+# network view that hosts and networks are looked up in, and that keys the
+# lookup cache; empty searches every view
+INFOBLOX_NETWORK_VIEW = os.getenv('INFOBLOX_NETWORK_VIEW', default='') or None
+
+# Prometheus metrics of the last run, for the node exporter textfile collector
+METRICS_FILENAME = '/public/infoblox_annotate_hosts.prom'
+
+# Infoblox lookup cache, configured by the INFOBLOX_CACHE_* variables (see
+# LookupCacheFromEnv)
+INFOBLOX_CACHE_FILENAME = '/private/infoblox_cache.db'
 
 # Annotation Options
 
@@ -75,10 +133,19 @@ COLUMNS = {
 
 # Pigeon Messenger
 PIGEON = Pigeon()
+# Timings and API call counters reported with the final Pigeon
+INSTRUMENTS = Instrumentation()
+# what the run of each tenant got done, for the metrics written when it exits
+RUNS = []
+# Retries, throttling and circuit breaking of the API calls (see GovernorsFromEnv)
+TETRATION_GOVERNOR, INFOBLOX_GOVERNOR = GovernorsFromEnv(PIGEON)
+GOVERNORS = [TETRATION_GOVERNOR, INFOBLOX_GOVERNOR]
+# Infoblox lookup cache
+INFOBLOX_CACHE = LookupCacheFromEnv(INFOBLOX_CACHE_FILENAME)
 # Connect to infoblox
-infoblox = Infoblox_Helper(opts=INFOBLOX_OPTS,pigeon=PIGEON)
+infoblox = Infoblox_Helper(opts=INFOBLOX_OPTS,pigeon=PIGEON,cache=INFOBLOX_CACHE,network_view=INFOBLOX_NETWORK_VIEW,instrumentation=INSTRUMENTS,governor=INFOBLOX_GOVERNOR)
 # Connect to tetration   
-tetration = Tetration_Helper(TETRATION_ENDPOINT, api_key=TETRATION_API_KEY, api_secret=TETRATION_API_SECRET,pigeon=PIGEON, options=TETRATION_OPTS, tenant_app_scope=TETRATION_TENANT_SCOPE_NAME)
+tetration = Tetration_Helper(TETRATION_ENDPOINT, api_key=TETRATION_API_KEY, api_secret=TETRATION_API_SECRET,pigeon=PIGEON, options=TETRATION_OPTS, tenant_app_scope=TETRATION_TENANT_SCOPE_NAME, instrumentation=INSTRUMENTS, governor=TETRATION_GOVERNOR)
 # Boolean helper
 BOOLEAN = Boolean_Helper()
 
@@ -86,13 +153,7 @@ BOOLEAN = Boolean_Helper()
 def PrettyPrint(target):
     print json.dumps(target,sort_keys=True,indent=4)
 
-def get_undocumented_inventory(columns):
-    PIGEON.note.update({
-        'status_code': 100,
-        'message' : 'Getting undocumented hosts from tetration',
-        'data' : {}
-    })
-    PIGEON.send()
+def undocumented_filters(columns):
     filters = []
     #for annotation in {k:v for k,v in COLUMNS.iteritems() if v["enabled"] == "on" }:
     for annotation in columns:
@@ -101,9 +162,367 @@ def get_undocumented_inventory(columns):
             "field": "user_" + annotation["annotationName"],
             "value": ""
         })
-    tetration.GetInventory(filters)
+    return filters
+
+def inventory_filters(columns):
+    if BOOLEAN.GetBoolean(CMDB_RECONCILE):
+        # annotated hosts are compared with tetration too, so stale
+        # annotations get updated
+        return [{"type": "subnet", "field": "ip", "value": "0.0.0.0/0"}]
+    return undocumented_filters(columns)
+
+def tenant_file(path, tenant):
+    # the files of one tenant of a multi-tenant run: the scope name, made
+    # safe for a file name, and a digest so two names never share a file
+    base, ext = os.path.splitext(path)
+    return base + '.' + re.sub(r'[^A-Za-z0-9]+', '_', tenant) + '-' + hashlib.md5(tenant.encode('utf-8')).hexdigest()[:8] + ext
+
+def tenant_run(tenant, multitenant):
+    # the state of the run of one tenant scope; the tenants of a multi-tenant
+    # run get their own Pigeon, files and helpers over the shared clients
+    files = {
+        'annotations': ANNOTATION_CSV_FILENAME,
+        'cmdb': CMDB_CSV_FILENAME,
+        'deletes': DELETE_CSV_FILENAME,
+        'checkpoint': CHECKPOINT_FILENAME,
+        'sync_state': SYNC_STATE_FILENAME
+    }
+    # lookup_failures: one entry per page whose infoblox lookup failed;
+    # incremental: the pages are the addresses infoblox reported as changed
+    run = {'tenant': tenant, 'success': False, 'batcher': None, 'cmdb': None, 'deletes': None, 'slots': None, 'lookup_failures': [], 'incremental': False}
+    if multitenant:
+        pigeon = Tenant_Pigeon(tenant)
+        run.update({
+            'pigeon': pigeon,
+            'tetration': tetration.ForTenant(tenant, pigeon),
+            'infoblox': infoblox.ForTenant(pigeon),
+            'files': dict([(name, tenant_file(path, tenant)) for name, path in files.items()])
+        })
+    else:
+        run.update({'pigeon': PIGEON, 'tetration': tetration, 'infoblox': infoblox, 'files': files})
+    return run
+
+def scheduled(run, name, func):
+    # func behind the fair share of the shared client it uses, if any
+    if not run['slots']:
+        return func
+    return lambda item: run['slots'][name].Run(run['tenant'], func, item)
+
+def sweep_key(run, columns, partitions):
+    # a checkpoint can only be resumed by a sweep with the same query and
+    # the same CSV layout
+    return json.dumps([run['tenant'], inventory_filters(columns), tetration.InventoryDimensions(), partitions, tetration.AnnotationFieldnames(columns), QUERY_LIMIT], sort_keys=True)
+
+def get_undocumented_inventory(run, columns, partitions, checkpoint=None):
+    run['pigeon'].note.update({
+        'status_code': 100,
+        'message' : 'Getting ' + ('all' if BOOLEAN.GetBoolean(CMDB_RECONCILE) else 'undocumented') + ' hosts from tetration',
+        'data' : {}
+    })
+    run['pigeon'].send()
+    return run['tetration'].GetInventoryPages(inventory_filters(columns), dimensions=tetration.InventoryDimensions(), partitions=partitions, workers=INVENTORY_WORKERS, checkpoint=checkpoint)
+
+def list_pages(run, columns, partitions, checkpoint=None):
+    run['pigeon'].note.update({
+        'status_code': 100,
+        'message' : 'Retrieving undocumented hosts from tetration inventory, ' + str(QUERY_LIMIT) + ' per page',
+        'data' : {}
+    })
+    run['pigeon'].send()
+    for pagedData in get_undocumented_inventory(run, columns, partitions, checkpoint):
+        yield pagedData
+
+def changed_pages(run, ips):
+    # the changed addresses that are in the inventory of the scope, searched
+    # QUERY_LIMIT at a time; infoblox reports changes for the whole grid
+    ips = sorted(ips)
+    if not ips:
+        return []
+    partitions = [{"type": "or", "filters": [{"type": "eq", "field": "ip", "value": ip} for ip in ips[i:i + QUERY_LIMIT]]} for i in range(0, len(ips), QUERY_LIMIT)]
+    return run['tetration'].GetInventoryPages([{"type": "subnet", "field": "ip", "value": "0.0.0.0/0"}], dimensions=tetration.InventoryDimensions(), partitions=partitions, workers=INVENTORY_WORKERS)
+
+def load_sync_state(run):
+    try:
+        with open(run['files']['sync_state']) as state_file:
+            return json.load(state_file)
+    except (IOError, ValueError):
+        return None
+
+def save_sync_state(run, state):
+    # write to a temporary file first so a crash never leaves half a file
+    with open(run['files']['sync_state'] + '.tmp', 'w') as state_file:
+        json.dump(state, state_file)
+    os.rename(run['files']['sync_state'] + '.tmp', run['files']['sync_state'])
+
+def enrich_page(run, pagedData):
+    run['pigeon'].note.update({
+        'status_code': 100,
+        'message' : 'Retrieving host information from infoblox',
+        'data' : {}
+    })
+    run['pigeon'].send()
+    if BOOLEAN.GetBoolean(PREFETCH_SUBNETS):
+        run['infoblox'].PrefetchNetworks(pagedData)
+    # the page travels along so it can be committed once its rows are spooled
+    return (pagedData, run['infoblox'].GetHost(pagedData))
+
+def load_cmdb(run, plan):
+    # returns the index of what tetration has, or None to upload every row
+    run['pigeon'].note.update({
+        'status_code': 100,
+        'message' : 'Downloading current annotations from tetration',
+        'data' : {}
+    })
+    run['pigeon'].send()
+    cmdb = None
+    cmdb_file = run['files']['cmdb']
+    with INSTRUMENTS.Timer('cmdb_download') as timer:
+        if run['tetration'].DownloadAnnotations(cmdb_file):
+            # inventory hosts carry the ID of their VRF, the download its name
+            vrfs = dict([(vrf['id'], vrf['name']) for vrf in run['tetration'].GetTenantNames()])
+            # rows without a VRF belong to the VRF of the scope, whose name
+            # need not be the name of the scope
+            cmdb = Cmdb_Index(plan.fieldnames, run['tetration'].GetScopeVrf(vrfs), vrfs)
+            timer.records = cmdb.Load(cmdb_file)
+    if os.path.exists(cmdb_file):
+        os.remove(cmdb_file)
+    run['pigeon'].note.update({
+        'status_code': 100,
+        'message' : 'Loaded ' + str(len(cmdb.index)) + ' annotated hosts from tetration' if cmdb else 'Unable to download annotations from tetration, uploading every row',
+        'data' : {}
+    })
+    run['pigeon'].send()
+    return cmdb
+
+def cleared_rows(page, rows, plan):
+    # changed addresses that infoblox no longer has a record (or a name)
+    # for: their deleted object's annotations are cleared with empty values
+    annotated = set([row['IP'] for row in rows])
+    return [dict([(name, '') for name in plan.fieldnames], IP=host['ip']) for host in page if host['ip'] not in annotated]
+
+def spool_rows(run, page, host_list, plan, batcher):
+    cmdb = run['cmdb']
+    if host_list is None:
+        # the infoblox lookup failed; tetration keeps what it has, and the
+        # change feed is not moved past these hosts
+        run['lookup_failures'].append(len(page))
+        if cmdb:
+            cmdb.Keep(page)
+    elif run['incremental']:
+        rows = list(plan.Rows(host_list))
+        return batcher.Add(rows + cleared_rows(page, rows, plan), page)
+    if not host_list:
+        if cmdb and host_list is not None:
+            cmdb.Changed(page, [])
+        # nothing to annotate, but the page still counts as done
+        return batcher.Add([], page)
+    run['pigeon'].note.update({
+        'status_code': 100,
+        'message' : 'Creating tetration annotations for hosts',
+        'data' : {}
+    })
+    run['pigeon'].send()
+    rows = plan.Rows(host_list)
+    if cmdb:
+        rows = cmdb.Changed(page, rows)
+    return batcher.Add(rows, page)
+
+def clear_vanished(run, cmdb):
+    # posts the rows the comparison found to clear, as an add of empty
+    # values; returns the rows that could not be posted
+    deletes = Upload_Batcher(run['tetration'], cmdb.fieldnames, run['files']['deletes'], max_rows=UPLOAD_OPTS['max_rows'], max_bytes=UPLOAD_OPTS['max_bytes'])
+    run['deletes'] = deletes
+    chunks = [deletes.Add([row]) for row in cmdb.deletes] + [deletes.Close()]
+    for chunk in [chunk for chunk in chunks if chunk]:
+        with INSTRUMENTS.Timer('delete', chunk['rows']):
+            deletes.Upload(chunk)
+    return deletes.RetryFailed()
+
+def write_metrics():
+    # runs at exit, so failed runs are recorded too; a multi-tenant run
+    # reports the sums over its tenants
+    stages = INSTRUMENTS.Summary()['stages']
+    batchers = [run['batcher'] for run in RUNS if run['batcher']]
+    values = {
+        'last_run_success': ('1 if the run finished without errors', 1 if RUNS and all([run['success'] for run in RUNS]) else 0),
+        'hosts_scanned': ('Hosts read from the Tetration inventory', stages['list']['records'] if 'list' in stages else 0),
+        'annotations_written': ('Annotation rows accepted by Tetration', sum([batcher.posted['rows'] for batcher in batchers])),
+        'bytes_uploaded': ('Annotation bytes accepted by Tetration', sum([batcher.posted['bytes'] for batcher in batchers]))
+    }
+    cmdbs = [run for run in RUNS if run['cmdb']]
+    if cmdbs:
+        values['annotations_unchanged'] = ('Annotation rows that Tetration already had', sum([run['cmdb'].counts['unchanged'] for run in cmdbs]))
+        values['annotations_deleted'] = ('Annotation rows cleared in Tetration', sum([run['deletes'].posted['rows'] for run in cmdbs if run['deletes']]))
+    if len(RUNS) > 1:
+        values['tenants_succeeded'] = ('Tenant scopes annotated without errors', len([run for run in RUNS if run['success']]))
+    values.update(infoblox.CacheMetrics())
+    values.update(TrafficMetrics(GOVERNORS))
+    WriteMetricsFile(METRICS_FILENAME, INSTRUMENTS.Metrics({'integration': 'infoblox', 'action': 'annotate_hosts'}, values))
+
+def annotate_tenant(run, columns, plan, partitions):
+    # annotates the hosts of one tenant scope and returns its results for
+    # the final Pigeon; exits, like the helpers do, when the run fails
+    pigeon = run['pigeon']
+    checkpoint = Sweep_Checkpoint(run['files']['checkpoint'])
+    resumed = checkpoint.Start(sweep_key(run, columns, partitions), len(partitions))
+    state = load_sync_state(run) if BOOLEAN.GetBoolean(INCREMENTAL_SYNC) else None
+    changes = None
+    if resumed:
+        # finish the sweep that an earlier run left behind before anything else
+        pigeon.note.update({
+            'status_code': 100,
+            'message' : 'Resuming the inventory sweep from the last committed page',
+            'data' : {}
+        })
+        pigeon.send()
+        state = checkpoint.data.get("sync_state")
+    elif state and time.time() - state["full_sweep"] < FULL_SWEEP_INTERVAL:
+        changes = run['infoblox'].GetChangedIps(state["sequence_id"])
+        if changes is None:
+            pigeon.note.update({
+                'status_code': 100,
+                'message' : 'Infoblox change feed unavailable from the saved sequence, running a full sweep',
+                'data' : {}
+            })
+            pigeon.send()
+    if changes is not None:
+        # incremental runs are short and start over if they fail
+        checkpoint.Finish()
+        checkpoint = None
+        pigeon.note.update({
+            'status_code': 100,
+            'message' : 'Found ' + str(len(changes[0])) + ' changed addresses in infoblox',
+            'data' : {}
+        })
+        pigeon.send()
+        run['incremental'] = True
+        source = changed_pages(run, changes[0])
+        state["sequence_id"] = changes[1]
+    else:
+        if not resumed:
+            # take the sequence before the sweep so changes made while it
+            # runs are picked up by the next incremental run
+            sequence_id = run['infoblox'].GetLatestSequenceId() if BOOLEAN.GetBoolean(INCREMENTAL_SYNC) else None
+            state = {"sequence_id": sequence_id, "full_sweep": time.time()} if sequence_id is not None else None
+            checkpoint.data["sync_state"] = state
+        if BOOLEAN.GetBoolean(CMDB_RECONCILE):
+            run['cmdb'] = load_cmdb(run, plan)
+        source = list_pages(run, columns, partitions, checkpoint)
+    # Tetration paging -> Infoblox enrichment -> CSV spooling -> upload; the
+    # next page downloads while the current one is still being worked on
+    batcher = Upload_Batcher(run['tetration'], plan.fieldnames, run['files']['annotations'], max_rows=UPLOAD_OPTS['max_rows'], max_bytes=UPLOAD_OPTS['max_bytes'], checkpoint=checkpoint)
+    run['batcher'] = batcher
+    if checkpoint:
+        # chunks the earlier run cut but never posted go first
+        for chunk in batcher.Resume():
+            with INSTRUMENTS.Timer('upload', chunk['rows']):
+                batcher.Upload(chunk)
+    pipeline = Pipeline(instrumentation=INSTRUMENTS)
+    pipeline.AddStage('enrich', scheduled(run, 'infoblox', lambda page: enrich_page(run, page)), workers=PIPELINE_OPTS['enrich_workers'], queue_size=PIPELINE_OPTS['queue_size'], size=len)
+    pipeline.AddStage('build_csv', lambda item: spool_rows(run, item[0], item[1], plan, batcher), workers=PIPELINE_OPTS['build_workers'], queue_size=PIPELINE_OPTS['queue_size'], size=lambda item: len(item[0]))
+    pipeline.AddStage('upload', scheduled(run, 'tetration', batcher.Upload), workers=PIPELINE_OPTS['upload_workers'], queue_size=PIPELINE_OPTS['queue_size'], size=lambda chunk: chunk['rows'])
+    stats = pipeline.Run(INSTRUMENTS.Iterate('list', source))
+    # whatever is left in the spool goes up at the end of the run
+    chunk = batcher.Close()
+    if chunk:
+        with INSTRUMENTS.Timer('upload', chunk['rows']):
+            batcher.Upload(chunk)
+    if batcher.RetryFailed():
+        # the checkpoint keeps the chunks for the next run to post
+        exit(1)
+    if checkpoint:
+        checkpoint.Finish()
+    # only move the sequence forward once everything it covers is uploaded
+    if run['lookup_failures']:
+        pigeon.note.update({
+            'status_code': 303,
+            'message' : 'Unable to look up ' + str(sum(run['lookup_failures'])) + ' hosts in infoblox, they are retried by the next run',
+            'data' : {}
+        })
+        pigeon.send()
+        if changes is None and os.path.exists(run['files']['sync_state']):
+            # the hosts of a full sweep are not in any change feed, so the
+            # next run sweeps again
+            os.remove(run['files']['sync_state'])
+    elif state:
+        save_sync_state(run, state)
+    cmdb = run['cmdb']
+    if cmdb:
+        # a resumed sweep did not see the pages of the earlier run, so only
+        # a sweep done in one go can tell which hosts have vanished
+        if not resumed:
+            cmdb.Leftover()
+        pigeon.note.update({
+            'status_code': 100,
+            'message' : 'Compared with tetration: ' + ', '.join([str(cmdb.counts[kind]) + ' ' + kind for kind in ['added', 'changed', 'unchanged', 'deleted']]),
+            'data' : {}
+        })
+        pigeon.send()
+        if cmdb.deletes and clear_vanished(run, cmdb):
+            exit(1)
+    pigeon.note.update({
+        'status_code': 100,
+        'message' : 'Pipeline busy time per stage: ' + ', '.join([stage + ' ' + str(stats[stage]['busy']) + 's' for stage in ['enrich', 'build_csv', 'upload']]),
+        'data' : {}
+    })
+    pigeon.send()
+    run['success'] = True
+    return {'pipeline': stats, 'rows': batcher.posted['rows'], 'cmdb': cmdb.counts} if cmdb else {'pipeline': stats, 'rows': batcher.posted['rows']}
+
+def run_tenant(run, columns, plan, partitions):
+    # a tenant that fails ends its own run, never those of the others
+    try:
+        result = annotate_tenant(run, columns, plan, partitions)
+    except SystemExit:
+        # the helper that gave up has already said why
+        result = None
+    except Exception as error:
+        run['pigeon'].note.update({
+            'status_code': 403,
+            'message' : 'Error annotating hosts: ' + str(error),
+            'data' : {}
+        })
+        run['pigeon'].send()
+        result = None
+    run['pigeon'].note.update({
+        'status_code': 100,
+        'message' : 'Completed host annotations' if run['success'] else 'Host annotations failed',
+        'data' : result or {}
+    })
+    run['pigeon'].send()
+    return dict(result or {}, status='completed' if run['success'] else 'failed')
+
+def annotate_tenants(runs, columns, plan, partitions):
+    # the tenants share the tetration and infoblox clients: the inventory
+    # readers of every running tenant get a connection of their own, and
+    # infoblox lookups and uploads are shared fairly through as many slots
+    # as one tenant would use
+    workers = max(1, min(TENANT_WORKERS, len(runs)))
+    slots = {
+        'infoblox': Fair_Share(PIPELINE_OPTS['enrich_workers']),
+        'tetration': Fair_Share(PIPELINE_OPTS['upload_workers'])
+    }
+    for run in runs:
+        run['slots'] = slots
+    tetration.ReservePool(workers * (INVENTORY_WORKERS + 1))
+    PIGEON.note.update({
+        'status_code': 100,
+        'message' : 'Annotating ' + str(len(runs)) + ' tenant scopes, ' + str(workers) + ' at a time',
+        'data' : {'tenants': [run['tenant'] for run in runs]}
+    })
+    PIGEON.send()
+    pool = ThreadPool(workers)
+    try:
+        results = pool.map(lambda run: run_tenant(run, columns, plan, partitions), runs)
+    finally:
+        pool.close()
+        pool.join()
+    for run, result in zip(runs, results):
+        result['infoblox_slots'] = slots['infoblox'].granted.get(run['tenant'], 0)
+    return dict([(run['tenant'], result) for run, result in zip(runs, results)])
 
 def main():
+    atexit.register(write_metrics)
     PIGEON.note.update({
         'status_code': 100,
         'message' : 'Starting tasks for infoblox host annotations',
@@ -111,44 +530,60 @@ def main():
     })
     PIGEON.send()
     columns = [COLUMNS[column] for column in COLUMNS if BOOLEAN.GetBoolean(COLUMNS[column]["enabled"]) ]
-    while True:
-        if len(columns) > 0:
-            PIGEON.note.update({
-                'status_code': 100,
-                'message' : 'Retrieving next ' + str(QUERY_LIMIT) + ' undocumented hosts from tetration inventory',
-                'data' : {}
-            })
-            PIGEON.send()
-            get_undocumented_inventory(columns)
-            PIGEON.note.update({
-                'status_code': 100,
-                'message' : 'Retrieving host information from infoblox',
-                'data' : {}
-            })
-            PIGEON.send()
-            host_list = infoblox.GetHost(tetration.inventory.pagedData)
-            PIGEON.note.update({
-                'status_code': 100,
-                'message' : 'Creating tetration annotations for hosts',
-                'data' : {}
-            })
-            PIGEON.send()
-            tetration.AnnotateHosts(host_list,columns,ANNOTATION_CSV_FILENAME)
-            if(tetration.inventory.hasNext is False):
-                break
-            time.sleep(2)
+    if len(columns) < 1:
+        PIGEON.note.update({
+            'status_code': 300,
+            'message' : 'No infoblox annotations enabled',
+            'data' : {}
+        })
+        PIGEON.send()
+        exit(0)
+    # the header and the extractor of every column, compiled once for the run
+    plan = Annotation_Plan(columns)
+    partitions = tetration.InventoryPartitions(INVENTORY_PARTITIONS)
+    multitenant = len(TETRATION_TENANT_SCOPE_NAMES) > 1
+    RUNS.extend([tenant_run(tenant, multitenant) for tenant in TETRATION_TENANT_SCOPE_NAMES])
+    try:
+        if multitenant:
+            tenants = annotate_tenants(RUNS, columns, plan, partitions)
         else:
+            result = annotate_tenant(RUNS[0], columns, plan, partitions)
+    except Tetration_Error as error:
+        PIGEON.note.update({
+            'status_code': 403,
+            'message' : str(error),
+            'data' : RunSummary(INSTRUMENTS, GOVERNORS)
+        })
+        PIGEON.send()
+        exit(1)
+    finally:
+        infoblox.SendCacheStats()
+        if INFOBLOX_CACHE:
+            INFOBLOX_CACHE.Close()
+    if multitenant:
+        failed = [run['tenant'] for run in RUNS if not run['success']]
+        if failed:
             PIGEON.note.update({
-                'status_code': 300,
-                'message' : 'No infoblox annotations enabled',
-                'data' : {}
+                'status_code': 403,
+                'message' : 'Infoblox host annotations failed for ' + str(len(failed)) + ' of ' + str(len(RUNS)) + ' tenant scopes: ' + ', '.join(failed),
+                'data' : dict(RunSummary(INSTRUMENTS, GOVERNORS), tenants=tenants)
             })
             PIGEON.send()
-            exit(0)
+            exit(1)
+        PIGEON.note.update({
+            'status_code': 200,
+            'message' : 'All tasks completed for infoblox host annotations of ' + str(len(RUNS)) + ' tenant scopes',
+            'data' : dict(RunSummary(INSTRUMENTS, GOVERNORS), tenants=tenants)
+        })
+        PIGEON.send()
+        return
+    data = RunSummary(INSTRUMENTS, GOVERNORS)
+    if 'cmdb' in result:
+        data['cmdb'] = result['cmdb']
     PIGEON.note.update({
         'status_code': 200,
         'message' : 'All tasks completed for infoblox host annotations',
-        'data' : {}
+        'data' : data
     })
     PIGEON.send()
 if __name__ == "__main__":
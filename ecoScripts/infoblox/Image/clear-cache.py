@@ -1,6 +1,19 @@
 import os
+import glob
 from helpers import Pigeon
 KNOWN_SUBNETS_CSV = '/private/known_subnets.csv'
+# optional state files; removing them forces a cold, full run next time
+STATE_FILES = {
+    '/private/infoblox_cache.db': 'Infoblox lookup cache deleted',
+    '/private/infoblox_sync_state.json': 'Infoblox change feed state deleted',
+    '/private/annotation_checkpoint.json': 'Annotation sweep checkpoint deleted',
+    '/private/inventory_filters_checkpoint.json': 'Inventory filters sweep checkpoint deleted'
+}
+# the same state of every tenant of a multi-tenant annotation run
+TENANT_STATE_FILES = {
+    '/private/infoblox_sync_state.*.json': 'Infoblox change feed state of tenant {} deleted',
+    '/private/annotation_checkpoint.*.json': 'Annotation sweep checkpoint of tenant {} deleted'
+}
 
 # Pigeon Messenger
 PIGEON = Pigeon()
@@ -11,6 +24,24 @@ PIGEON.note.update({
     'data': {}
 })
 PIGEON.send()
+for filename in STATE_FILES:
+    if os.path.isfile(filename):
+        os.remove(filename)
+        PIGEON.note.update({
+            'status_code': 100,
+            'message': STATE_FILES[filename],
+            'data': {}
+        })
+        PIGEON.send()
+for pattern in TENANT_STATE_FILES:
+    for filename in glob.glob(pattern):
+        os.remove(filename)
+        PIGEON.note.update({
+            'status_code': 100,
+            'message': TENANT_STATE_FILES[pattern].format(os.path.basename(filename).split('.')[1]),
+            'data': {}
+        })
+        PIGEON.send()
 try:
     os.remove(KNOWN_SUBNETS_CSV)
     PIGEON.note.update({
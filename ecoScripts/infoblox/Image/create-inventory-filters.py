@@ -7,6 +7,7 @@ import os
 import netaddr
 import time
 import csv
+import atexit
 
 # ====================================================================================
 # GLOBALS
@@ -17,6 +18,11 @@ UNKNOWN_SUBNETS = []
 KNOWN_SUBNETS_CSV = '/private/known_subnets.csv'
 UNKNOWN_SUBNETS_CSV = '/public/unknown_subnets.csv'
 FILTER_CSV_FILENAME ='/private/inventory_filters.csv'
+# Prometheus metrics of the last run, for the node exporter textfile collector
+METRICS_FILENAME = '/public/infoblox_inventory_filters.prom'
+# Progress of the inventory sweep, saved after every committed page so a run
+# that dies can be resumed
+CHECKPOINT_FILENAME = '/private/inventory_filters_checkpoint.json'
 # Tetration
 TETRATION_ENDPOINT = os.environ['TETRATION_ENDPOINT']
 TETRATION_API_KEY = os.environ['TETRATION_API_KEY']
@@ -24,6 +30,10 @@ TETRATION_API_SECRET = os.environ['TETRATION_API_SECRET']
 TETRATION_OPTS = {
     'limit': QUERY_LIMIT
 }
+# Inventory paging: the search is split into one partition per subnet plus one
+# for everything else, and up to INVENTORY_WORKERS partitions are paged at once
+INVENTORY_PARTITIONS = [subnet.strip() for subnet in os.getenv('INVENTORY_PARTITIONS', default='10.0.0.0/9,10.128.0.0/9,172.16.0.0/12,192.168.0.0/16').split(',') if subnet.strip()]
+INVENTORY_WORKERS = int(os.getenv('INVENTORY_WORKERS', default=4))
 
 # Infoblox
 INFOBLOX_OPTS = {
@@ -41,14 +51,30 @@ INFOBLOX_OPTS = {
     'log_api_calls_as_info': False,
     'paging': False
 }
+# network view that hosts and networks are looked up in, and that keys the
+# lookup cache; empty searches every view
+INFOBLOX_NETWORK_VIEW = os.getenv('INFOBLOX_NETWORK_VIEW', default='') or None
+
+# Infoblox lookup cache, configured by the INFOBLOX_CACHE_* variables (see
+# LookupCacheFromEnv)
+INFOBLOX_CACHE_FILENAME = '/private/infoblox_cache.db'
 
 # Pigeon Messenger
 PIGEON = Pigeon()
+# Timings and API call counters reported with the final Pigeon
+INSTRUMENTS = Instrumentation()
+# what the run got done, for the metrics written when it exits
+RUN = {'success': False}
 
+# Retries, throttling and circuit breaking of the API calls (see GovernorsFromEnv)
+TETRATION_GOVERNOR, INFOBLOX_GOVERNOR = GovernorsFromEnv(PIGEON)
+GOVERNORS = [TETRATION_GOVERNOR, INFOBLOX_GOVERNOR]
+# Infoblox lookup cache
+INFOBLOX_CACHE = LookupCacheFromEnv(INFOBLOX_CACHE_FILENAME)
 # Connect to infoblox
-infoblox = Infoblox_Helper(opts=INFOBLOX_OPTS,pigeon=PIGEON)
+infoblox = Infoblox_Helper(opts=INFOBLOX_OPTS,pigeon=PIGEON,cache=INFOBLOX_CACHE,network_view=INFOBLOX_NETWORK_VIEW,instrumentation=INSTRUMENTS,governor=INFOBLOX_GOVERNOR)
 # Connect to tetration   
-tetration = Tetration_Helper(TETRATION_ENDPOINT, TETRATION_API_KEY, TETRATION_API_SECRET,PIGEON,TETRATION_OPTS)
+tetration = Tetration_Helper(TETRATION_ENDPOINT, TETRATION_API_KEY, TETRATION_API_SECRET,PIGEON,TETRATION_OPTS,instrumentation=INSTRUMENTS,governor=TETRATION_GOVERNOR)
 
 # Debug function used for printing formatted dictionaries
 def PrettyPrint(target):
@@ -80,13 +106,14 @@ def update_subnets():
         for subnet in list(set(UNKNOWN_SUBNETS)):
             writer.writerow({'subnet': subnet.__str__()})
 
-def create_network_filters():
+def create_network_filters(pagedData):
     filtered_hosts = []
     subnets = []
-    for host in tetration.inventory.pagedData:
+    for host in pagedData:
         if(not tetration.HasSubnetFilterForIp(host["ip"])):
             filtered_hosts.append(host)
-    hosts = infoblox.GetHost(filtered_hosts)
+    # None is a failed lookup, already reported; the next sweep retries it
+    hosts = infoblox.GetHost(filtered_hosts) or []
     for host in hosts:
         subnets.append(host["network"])
     subnets = list(set(subnets))
@@ -94,6 +121,9 @@ def create_network_filters():
     tet_subnets = []
     for subnet in subnets:
         net = infoblox.GetSubnet(subnet)
+        # a network infoblox does not know, or a failed lookup
+        if not net:
+            continue
         if "comment" in net[0]:
             iblox_subnets.append(net[0])
             tet_subnets.append(net[0]["network"])
@@ -119,7 +149,21 @@ def create_network_filters():
         })
         PIGEON.send()
     
+def write_metrics():
+    # runs at exit, so failed runs are recorded too
+    stages = INSTRUMENTS.Summary()['stages']
+    values = {
+        'last_run_success': ('1 if the run finished without errors', 1 if RUN['success'] else 0),
+        'hosts_scanned': ('Hosts read from the Tetration inventory', stages['list']['records'] if 'list' in stages else 0),
+        'known_subnets': ('Subnets with an inventory filter', len(tetration.subnets)),
+        'unknown_subnets': ('Subnets without a comment in Infoblox', len(set(UNKNOWN_SUBNETS)))
+    }
+    values.update(infoblox.CacheMetrics())
+    values.update(TrafficMetrics(GOVERNORS))
+    WriteMetricsFile(METRICS_FILENAME, INSTRUMENTS.Metrics({'integration': 'infoblox', 'action': 'inventory_filters'}, values))
+
 def main():
+    atexit.register(write_metrics)
     PIGEON.note.update({
         'status_code': 100,
         'message' : 'Starting tasks for infoblox inventory filters',
@@ -132,29 +176,57 @@ def main():
         "field": "ip",
         "value": "."
     }]
-    dimensions = ['ip']
-    while True:
+    dimensions = tetration.InventoryDimensions()
+    partitions = tetration.InventoryPartitions(INVENTORY_PARTITIONS)
+    checkpoint = Sweep_Checkpoint(CHECKPOINT_FILENAME)
+    if checkpoint.Start(json.dumps([filters, dimensions, partitions, QUERY_LIMIT], sort_keys=True), len(partitions)):
         PIGEON.note.update({
             'status_code': 100,
-            'message' : 'Retrieving next ' + str(QUERY_LIMIT) + ' hosts from tetration inventory',
+            'message' : 'Resuming the inventory sweep from the last committed page',
             'data' : {}
         })
         PIGEON.send()
-        tetration.GetInventory(filters=filters,dimensions=dimensions)
+    PIGEON.note.update({
+        'status_code': 100,
+        'message' : 'Retrieving hosts from tetration inventory, ' + str(QUERY_LIMIT) + ' per page',
+        'data' : {}
+    })
+    PIGEON.send()
+    pages = tetration.GetInventoryPages(filters=filters,dimensions=dimensions,partitions=partitions,workers=INVENTORY_WORKERS,checkpoint=checkpoint)
+    try:
+        for pagedData in INSTRUMENTS.Iterate('list', pages):
+            PIGEON.note.update({
+                'status_code': 100,
+                'message' : 'Creating inventory filters for observed networks',
+                'data' : {}
+            })
+            PIGEON.send()
+            with INSTRUMENTS.Timer('create_filters', len(pagedData)):
+                create_network_filters(pagedData)
+            # save the subnets the page added before committing it, otherwise a
+            # resumed run would not know the filters it already pushed
+            update_subnets()
+            checkpoint.Commit(pagedData)
+    except Tetration_Error as error:
+        # the checkpoint keeps the committed pages for the next run
         PIGEON.note.update({
-            'status_code': 100,
-            'message' : 'Creating inventory filters for observed networks',
-            'data' : {}
+            'status_code': 403,
+            'message' : str(error),
+            'data' : RunSummary(INSTRUMENTS, GOVERNORS)
         })
         PIGEON.send()
-        create_network_filters()
-        if(tetration.inventory.hasNext is False):
-           break
+        exit(1)
+    finally:
+        infoblox.SendCacheStats()
+        if INFOBLOX_CACHE:
+            INFOBLOX_CACHE.Close()
     update_subnets()
+    checkpoint.Finish()
+    RUN['success'] = True
     PIGEON.note.update({
         'status_code': 200,
         'message' : 'All tasks completed for infoblox inventory filters',
-        'data' : {}
+        'data' : RunSummary(INSTRUMENTS, GOVERNORS)
     })
     PIGEON.send()
 
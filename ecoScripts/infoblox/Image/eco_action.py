@@ -1,44 +1,68 @@
 """
-The purpose of this script is to call other scripts. There are no arguments to 
+The purpose of this script is to call other scripts. There are no arguments to
 this script. An environment variable named ACTION defines which action should
 be taken (which script to run).
+
+The scripts run in this interpreter (see dispatcher.py) unless
+IN_PROCESS_ACTIONS is off. "python eco_action.py --worker" keeps the
+interpreter running as a worker on ECO_WORKER_SOCKET, and later runs with
+ECO_WORKER_SOCKET set hand their action to it.
 """
 
-import subprocess
 import os
+import sys
 import json
-import helpers
+import dispatcher
+
+# imported once by a worker before it takes requests
+PRELOAD = ['requests', 'tetpyclient', 'infoblox_client.connector', 'netaddr', 'sqlite3']
+
+DEFAULT_WORKER_SOCKET = '/tmp/eco_action.sock'
+
+def main():
+    # imported here so that handing the action to a worker does not load the
+    # client libraries that helpers imports
+    import helpers
+
+    # Define pigeon messenger
+    PIGEON = helpers.Pigeon()
 
-# Define pigeon messenger
-PIGEON = helpers.Pigeon()
+    if os.getenv('ACTION'):
+        PIGEON.note.update({
+            'status_code': 100,
+            'message' : 'Starting action ' + os.environ['ACTION'],
+            'data' : {}
+        })
+        PIGEON.send()
+        options = {
+            'TEST_CONNECTIVITY': lambda : dispatcher.call(["python", "test_connectivity.py"]),
+            'RUN_INTEGRATION': lambda : dispatcher.call(["python", "annotate-hosts.py"]),
+            'CREATE_FILTERS': lambda : dispatcher.call(["python", "create-inventory-filters.py"]),
+            'FETCH_ITEMS': lambda: dispatcher.call(["python", "fetch-items.py"]),
+            'CLEAR_CACHE': lambda: dispatcher.call(["python", "clear-cache.py"])
+        }
+        result = options[os.environ['ACTION']]()
+    else:
+        PIGEON.note.update({
+            'status_code': 404,
+            'message' : 'Action: ' + os.getenv('ACTION') + 'not implemented',
+            'data' : {}
+        })
+        PIGEON.send()
 
-if os.getenv('ACTION'):
+    # print a message that the container has completed its work
     PIGEON.note.update({
         'status_code': 100,
-        'message' : 'Starting action ' + os.environ['ACTION'],
-        'data' : {}
-    })
-    PIGEON.send()
-    options = {
-        'TEST_CONNECTIVITY': lambda : subprocess.call(["python", "test_connectivity.py"]),
-        'RUN_INTEGRATION': lambda : subprocess.call(["python", "annotate-hosts.py"]),
-        'CREATE_FILTERS': lambda : subprocess.call(["python", "create-inventory-filters.py"]),
-        'FETCH_ITEMS': lambda: subprocess.call(["python", "fetch-items.py"]),
-        'CLEAR_CACHE': lambda: subprocess.call(["python", "clear-cache.py"])
-    }
-    result = options[os.environ['ACTION']]()
-else:
-    PIGEON.note.update({
-        'status_code': 404,
-        'message' : 'Action: ' + os.getenv('ACTION') + 'not implemented',
+        'message' : 'Action complete',
         'data' : {}
     })
     PIGEON.send()
 
-# print a message that the container has completed its work
-PIGEON.note.update({
-    'status_code': 100,
-    'message' : 'Action complete',
-    'data' : {}
-})
-PIGEON.send()
+if __name__ == "__main__":
+    SOCKET = os.getenv('ECO_WORKER_SOCKET', DEFAULT_WORKER_SOCKET)
+    if '--worker' in sys.argv:
+        # the scripts are found relative to this directory
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        dispatcher.serve(SOCKET, main, PRELOAD)
+    elif not (os.getenv('ECO_WORKER_SOCKET') and dispatcher.forward(SOCKET)):
+        dispatcher.dispatch(main)
@@ -94,7 +94,16 @@ def main():
         'TENANT_SCOPE_NAMES': get_tenant_scope_names,
         'EXT_ATTRS': get_extensible_attributes
     }
-    fetch_result = options[TARGET_ITEM]()
+    try:
+        fetch_result = options[TARGET_ITEM]()
+    except Tetration_Error as error:
+        PIGEON.note.update({
+            'status_code': 403,
+            'message' : str(error),
+            'data' : {}
+        })
+        PIGEON.send()
+        exit(1)
 
     PIGEON.note.update({
         'status_code': 200,
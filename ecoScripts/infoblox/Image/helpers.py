@@ -1,12 +1,26 @@
 from tetpyclient import RestClient
 import tetpyclient
 from infoblox_client import connector
+from infoblox_client import exceptions as ib_ex
 import json
 import os
 import requests.packages.urllib3
 import csv
 from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
 from netaddr import *
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Full
+from collections import OrderedDict
+import threading
+import time
+import sqlite3
+import re
+import random
+import hashlib
+import copy
+from urlparse import urlparse
+import dispatcher
 
 requests.packages.urllib3.disable_warnings()
 
@@ -21,26 +35,1059 @@ class Pigeon(object):
     def send(self):
         print json.dumps(self.note)
 
+class Tenant_Pigeon(Pigeon):
+    '''
+    Pigeon of one tenant scope of a multi-tenant run. Every message names the
+    tenant and carries it in its data, and the tenants of a run print under
+    one lock so their lines never run into each other.
+    '''
+    lock = threading.Lock()
+
+    def __init__(self,tenant):
+        Pigeon.__init__(self)
+        self.tenant = tenant
+
+    def send(self):
+        note = dict(self.note)
+        note['message'] = '[' + self.tenant + '] ' + note['message']
+        note['data'] = dict(note['data'] or {}, tenant=self.tenant)
+        with self.lock:
+            print json.dumps(note)
+
 class Boolean_Helper(object):
     def GetBoolean(self,testVar):
         return testVar.lower() in ['true','on','yes','1']
 
+class Instrumentation(object):
+    '''
+    Timers, status counters and payload byte counts for every API call and
+    every stage of a run, summarized into the data of the final Pigeon.
+    WrapSession hooks a requests session (the RestClient and the infoblox
+    connector each have one), so every call is measured, retries and chunk
+    uploads included, without touching the code that makes it. Stages are
+    measured with Timer or Iterate. Latencies are kept as a uniform sample
+    of at most MAX_SAMPLES per key, so memory stays bounded on long runs.
+    '''
+    MAX_SAMPLES = 10000
+    PERCENTILES = [50, 90, 99]
+
+    def __init__(self):
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.stages = {}
+        self.random = random.Random(0)
+
+    def _Entry(self,table,key,fields):
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = dict([(field, 0) for field in fields])
+            entry['seconds'] = 0.0
+            entry['samples'] = []
+        return entry
+
+    def _Sample(self,entry,count,seconds):
+        # reservoir sampling: every latency has the same chance to be kept
+        if len(entry['samples']) < self.MAX_SAMPLES:
+            entry['samples'].append(seconds)
+        else:
+            slot = self.random.randint(0, count - 1)
+            if slot < self.MAX_SAMPLES:
+                entry['samples'][slot] = seconds
+
+    def RecordCall(self,endpoint,seconds,status,bytes_out,bytes_in):
+        with self.lock:
+            entry = self._Entry(self.calls, endpoint, ['calls', 'errors', 'bytes_out', 'bytes_in'])
+            entry.setdefault('status', {})
+            entry['calls'] += 1
+            entry['status'][status] = entry['status'].get(status, 0) + 1
+            if not status.startswith('2'):
+                entry['errors'] += 1
+            entry['bytes_out'] += bytes_out
+            entry['bytes_in'] += bytes_in
+            entry['seconds'] += seconds
+            self._Sample(entry, entry['calls'], seconds)
+
+    def RecordStage(self,name,seconds,records=1):
+        with self.lock:
+            entry = self._Entry(self.stages, name, ['items', 'records'])
+            entry['items'] += 1
+            entry['records'] += records
+            entry['seconds'] += seconds
+            self._Sample(entry, entry['items'], seconds)
+
+    def WrapSession(self,session,service,endpoint):
+        # endpoint(request) names the call, e.g. "POST /inventory/search";
+        # wrapping a shared session again replaces the hook of the last run
+        send = session.__dict__.setdefault('_unwrapped_send', session.send)
+        def timed_send(request, **kwargs):
+            start = time.time()
+            status = 'exception'
+            bytes_in = 0
+            try:
+                resp = send(request, **kwargs)
+                status = str(resp.status_code)
+                if kwargs.get('stream'):
+                    # reading a streamed body here would consume it
+                    bytes_in = int(resp.headers.get('Content-Length') or 0)
+                else:
+                    bytes_in = len(resp.content or '')
+                return resp
+            finally:
+                body = request.body
+                bytes_out = len(body) if isinstance(body, basestring) else int(request.headers.get('Content-Length') or 0)
+                self.RecordCall(service + ' ' + endpoint(request), time.time() - start, status, bytes_out, bytes_in)
+        session.send = timed_send
+
+    def Timer(self,name,records=1):
+        return _Stage_Timer(self, name, records)
+
+    def Iterate(self,name,source,size=len):
+        # times how long each item of source takes to produce, which for a
+        # generator over API pages is the listing stage of a run
+        iterator = iter(source)
+        try:
+            while True:
+                start = time.time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                self.RecordStage(name, time.time() - start, size(item))
+                yield item
+        finally:
+            # let the source clean up (stop its readers) when the consumer
+            # stops early
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    def _Latency(self,samples):
+        samples = sorted(samples)
+        if not samples:
+            return {}
+        latency = dict([('p' + str(p), round(1000 * samples[min(len(samples) - 1, int(len(samples) * p / 100.0))], 2)) for p in self.PERCENTILES])
+        latency['max'] = round(1000 * samples[-1], 2)
+        return latency
+
+    def Summary(self):
+        '''
+        Returns the measurements as a dictionary for the data of a Pigeon:
+        per stage the items, records, busy seconds, records per busy second
+        and item latency percentiles in ms, and per API endpoint the calls,
+        errors, status codes, bytes and call latency percentiles in ms.
+        '''
+        with self.lock:
+            elapsed = time.time() - self.started
+            stages = {}
+            for name, entry in self.stages.items():
+                stages[name] = {
+                    'items': entry['items'],
+                    'records': entry['records'],
+                    'seconds': round(entry['seconds'], 3),
+                    'records_per_second': round(entry['records'] / entry['seconds'], 1) if entry['seconds'] else None,
+                    'latency_ms': self._Latency(entry['samples'])
+                }
+            api = {}
+            totals = {'calls': 0, 'errors': 0, 'bytes_out': 0, 'bytes_in': 0, 'seconds': 0.0}
+            for endpoint, entry in self.calls.items():
+                api[endpoint] = {
+                    'calls': entry['calls'],
+                    'errors': entry['errors'],
+                    'status': dict(entry['status']),
+                    'bytes_out': entry['bytes_out'],
+                    'bytes_in': entry['bytes_in'],
+                    'seconds': round(entry['seconds'], 3),
+                    'latency_ms': self._Latency(entry['samples'])
+                }
+                for field in totals:
+                    totals[field] += entry[field]
+        totals['seconds'] = round(totals['seconds'], 3)
+        totals['calls_per_second'] = round(totals['calls'] / elapsed, 1) if elapsed else None
+        return {'elapsed_seconds': round(elapsed, 3), 'stages': stages, 'api': api, 'api_totals': totals}
+
+    def Metrics(self,labels,values=None):
+        '''
+        Returns the measurements as Prometheus metrics for WriteMetricsFile:
+        the run duration, calls, errors, seconds and bytes per API endpoint,
+        busy seconds and records per stage, and every name -> (help, value)
+        in values. labels are added to every sample.
+        '''
+        summary = self.Summary()
+        def samples(table, field, key):
+            return [(dict(labels, **key(name)), entry[field]) for name, entry in sorted(table.items())]
+        endpoint = lambda name: {'service': name.split(' ', 1)[0], 'endpoint': name.split(' ', 1)[1]}
+        stage = lambda name: {'stage': name}
+        metrics = [
+            ('last_run_timestamp_seconds', 'Time the run finished', [(labels, round(time.time(), 3))]),
+            ('last_run_duration_seconds', 'Wall time of the run', [(labels, summary['elapsed_seconds'])]),
+            ('api_calls', 'API calls made by the run', samples(summary['api'], 'calls', endpoint)),
+            ('api_errors', 'API calls that failed or did not return 2xx', samples(summary['api'], 'errors', endpoint)),
+            ('api_seconds', 'Time spent waiting for API calls', samples(summary['api'], 'seconds', endpoint)),
+            ('api_bytes_sent', 'Request bytes sent', samples(summary['api'], 'bytes_out', endpoint)),
+            ('api_bytes_received', 'Response bytes received', samples(summary['api'], 'bytes_in', endpoint)),
+            ('stage_seconds', 'Busy time per stage', samples(summary['stages'], 'seconds', stage)),
+            ('stage_records', 'Records handled per stage', samples(summary['stages'], 'records', stage))
+        ]
+        for name, (help_text, value) in sorted((values or {}).items()):
+            if value is not None:
+                metrics.append((name, help_text, [(labels, value)]))
+        return metrics
+
+def WriteMetricsFile(path,metrics,prefix='tetration_integration_'):
+    '''
+    Writes metrics, a list of (name, help, [(labels, value)]), to path in the
+    Prometheus text format for the node exporter textfile collector. The
+    file is renamed into place so a scrape never sees half of it. Nothing is
+    written if the directory does not exist (outside the container).
+    '''
+    if not os.path.isdir(os.path.dirname(path)):
+        return False
+    lines = []
+    for name, help_text, samples in metrics:
+        if not samples:
+            continue
+        lines.append('# HELP ' + prefix + name + ' ' + help_text)
+        lines.append('# TYPE ' + prefix + name + ' gauge')
+        for labels, value in samples:
+            pairs = ','.join([key + '="' + str(val).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"' for key, val in sorted(labels.items())])
+            lines.append(prefix + name + ('{' + pairs + '}' if pairs else '') + ' ' + repr(float(value)))
+    with open(path + '.tmp', 'w') as metrics_file:
+        metrics_file.write('\n'.join(lines) + '\n')
+    os.rename(path + '.tmp', path)
+    return True
+
+def GovernorsFromEnv(pigeon):
+    '''
+    Returns the Rate_Governors of a run, (tetration, infoblox). At most
+    TETRATION_RATE_LIMIT and INFOBLOX_RATE_LIMIT requests per second go to
+    each endpoint and TETRATION_MAX_CONCURRENCY and INFOBLOX_MAX_CONCURRENCY
+    are in flight, with a limit of 0 turning it off. REQUEST_RETRIES is the
+    retries per request and CIRCUIT_MAX_PAUSE the seconds a request waits on
+    an open circuit breaker before it fails.
+    '''
+    retries = int(os.getenv('REQUEST_RETRIES', default=4))
+    max_pause = float(os.getenv('CIRCUIT_MAX_PAUSE', default=600))
+    return (
+        Rate_Governor('tetration', pigeon=pigeon, rate=float(os.getenv('TETRATION_RATE_LIMIT', default=20)), max_concurrency=int(os.getenv('TETRATION_MAX_CONCURRENCY', default=16)) or 1024, retries=retries, max_pause=max_pause),
+        Rate_Governor('infoblox', pigeon=pigeon, rate=float(os.getenv('INFOBLOX_RATE_LIMIT', default=50)), max_concurrency=int(os.getenv('INFOBLOX_MAX_CONCURRENCY', default=10)) or 1024, retries=retries, max_pause=max_pause)
+    )
+
+def LookupCacheFromEnv(dbFile):
+    '''
+    Returns the Lookup_Cache in dbFile configured from INFOBLOX_CACHE_TTL,
+    INFOBLOX_CACHE_NEGATIVE_TTL and INFOBLOX_CACHE_MAX_ENTRIES, or None when
+    the TTL is 0.
+    '''
+    ttl = int(os.getenv('INFOBLOX_CACHE_TTL', default=86400))
+    if ttl <= 0:
+        return None
+    return Lookup_Cache(dbFile, ttl=ttl, negative_ttl=int(os.getenv('INFOBLOX_CACHE_NEGATIVE_TTL', default=3600)), max_entries=int(os.getenv('INFOBLOX_CACHE_MAX_ENTRIES', default=500000)))
+
+def RunSummary(instrumentation,governors):
+    # timings and API calls of the run, with what the governors did to them
+    return dict(instrumentation.Summary(), traffic=dict([(governor.service, governor.State()) for governor in governors]))
+
+def TrafficMetrics(governors):
+    # name -> (help, value) for Instrumentation.Metrics
+    values = {}
+    for governor in governors:
+        state = governor.State()
+        values[governor.service + '_request_retries'] = ('Requests to ' + governor.service + ' retried after a throttled or failed attempt', state['retries'])
+        values[governor.service + '_requests_throttled'] = ('Responses of ' + governor.service + ' asking to slow down (429 or 503)', state['throttled'])
+        values[governor.service + '_circuit_opens'] = ('Times the circuit breaker of ' + governor.service + ' opened', state['circuit_opens'])
+        values[governor.service + '_concurrency_limit'] = ('Requests to ' + governor.service + ' allowed in flight at the end of the run', state['concurrency_limit'])
+    return values
+
+class _Stage_Timer(object):
+    def __init__(self,instrumentation,name,records):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.records = records
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self,*args):
+        self.instrumentation.RecordStage(self.name, time.time() - self.start, self.records)
+
+def TetrationEndpoint(request):
+    # drop the API prefix and the scope name of the CMDB paths so that every
+    # upload counts against one endpoint
+    path = urlparse(request.url).path.split('/openapi/v1', 1)[-1]
+    for prefix in ['/assets/cmdb/upload', '/assets/cmdb/download']:
+        if path.startswith(prefix):
+            path = prefix
+    return request.method + ' ' + path
+
+def InfobloxEndpoint(request):
+    # the object type, without the WAPI version or an object reference
+    path = urlparse(request.url).path
+    if '/wapi/' in path:
+        path = path.split('/wapi/', 1)[1].split('/')[1]
+    return request.method + ' ' + path
+
+class Pipeline(object):
+    '''
+    Runs a chain of stages on their own threads with a bounded queue in front
+    of each stage. A full queue blocks the stage feeding it, so a slow stage
+    throttles the ones before it and the total run time approaches that of
+    the slowest stage rather than the sum of all of them.
+    '''
+    STOP = object()
+
+    def __init__(self,instrumentation=None):
+        self.stages = []
+        self.error = None
+        self.lock = threading.Lock()
+        self.instrumentation = instrumentation
+
+    def AddStage(self,name,func,workers=1,queue_size=2,size=None):
+        # func receives one item and returns the item for the next stage;
+        # returning None drops the item. size(item) is the number of records
+        # in the item, for the throughput reported by the instrumentation
+        self.stages.append({
+            'name': name,
+            'func': func,
+            'size': size,
+            'workers': workers,
+            'queue': Queue(maxsize=queue_size),
+            'running': workers,
+            'items': 0,
+            'busy': 0.0
+        })
+
+    def _Fail(self,error):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+
+    def _Feed(self,source,out):
+        try:
+            for item in source:
+                if self.error is not None:
+                    break
+                out.put(item)
+        except BaseException as error:
+            self._Fail(error)
+        finally:
+            out.put(self.STOP)
+
+    def _Work(self,stage,out):
+        while True:
+            item = stage['queue'].get()
+            if item is self.STOP:
+                # leave the marker in place for the other workers of this stage
+                stage['queue'].put(self.STOP)
+                break
+            if self.error is not None:
+                # keep draining so upstream stages never block on a full queue
+                continue
+            try:
+                start = time.time()
+                result = stage['func'](item)
+                busy = time.time() - start
+                with self.lock:
+                    stage['items'] += 1
+                    stage['busy'] += busy
+                if self.instrumentation:
+                    self.instrumentation.RecordStage(stage['name'], busy, stage['size'](item) if stage['size'] else 1)
+                if result is not None and out is not None:
+                    out.put(result)
+            except BaseException as error:
+                self._Fail(error)
+        with self.lock:
+            stage['running'] -= 1
+            last = stage['running'] == 0
+        if last and out is not None:
+            out.put(self.STOP)
+
+    def Run(self,source):
+        threads = [threading.Thread(target=self._Feed, args=(source, self.stages[0]['queue']))]
+        for i, stage in enumerate(self.stages):
+            out = self.stages[i + 1]['queue'] if i + 1 < len(self.stages) else None
+            for _ in range(stage['workers']):
+                threads.append(threading.Thread(target=self._Work, args=(stage, out)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # an error or exit() in a stage only ends the thread it runs in, so
+        # hand the first failure back to the caller
+        if self.error is not None:
+            raise self.error
+        return dict((stage['name'], {'items': stage['items'], 'busy': round(stage['busy'], 3)}) for stage in self.stages)
+
+class Fair_Share(object):
+    '''
+    Shares a fixed number of slots on a resource, such as the connection
+    pool of a client, between tenants. Whenever a slot frees up it goes to
+    the waiting tenant that holds the fewest slots, the one that has waited
+    longest on a tie, so a tenant with many pages queued cannot starve the
+    others. granted counts the slots each tenant was given.
+    '''
+    def __init__(self,slots):
+        self.slots = slots
+        self.busy = 0
+        self.held = {}
+        self.granted = {}
+        self.waiting = []
+        self.tickets = 0
+        self.condition = threading.Condition()
+
+    def _Next(self):
+        return min(self.waiting, key=lambda waiter: (self.held.get(waiter[0], 0), waiter[1]))
+
+    def Acquire(self,tenant):
+        with self.condition:
+            self.tickets += 1
+            waiter = (tenant, self.tickets)
+            self.waiting.append(waiter)
+            while self.busy >= self.slots or self._Next() is not waiter:
+                self.condition.wait()
+            self.waiting.remove(waiter)
+            self.busy += 1
+            self.held[tenant] = self.held.get(tenant, 0) + 1
+            self.granted[tenant] = self.granted.get(tenant, 0) + 1
+            # a free slot may now belong to the next waiter
+            self.condition.notify_all()
+
+    def Release(self,tenant):
+        with self.condition:
+            self.busy -= 1
+            self.held[tenant] -= 1
+            self.condition.notify_all()
+
+    def Run(self,tenant,func,*args):
+        self.Acquire(tenant)
+        try:
+            return func(*args)
+        finally:
+            self.Release(tenant)
+
+class Token_Bucket(object):
+    '''
+    Allows rate requests per second on average and bursts of up to burst.
+    A caller that finds the bucket empty takes a token in advance and sleeps
+    until it is due, so waiting callers are served in the order they came.
+    '''
+    def __init__(self,rate,burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, self.rate))
+        self.tokens = self.burst
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def Take(self):
+        # returns the seconds waited
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+class Circuit_Breaker(object):
+    '''
+    Opens after failures consecutive failed requests and holds every request
+    back until cooldown seconds have passed. Then one request is let through
+    as a probe while the others keep waiting: if it succeeds the breaker
+    closes, if not it opens again for twice as long, up to max_cooldown.
+    '''
+    def __init__(self,failures=5,cooldown=10.0,max_cooldown=300.0):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.next_cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opens = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.condition = threading.Condition()
+
+    def Wait(self,timeout):
+        # blocks while the breaker is open; False if it is still open after
+        # timeout seconds
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                now = time.time()
+                if self.state == 'closed':
+                    return True
+                if self.state == 'open' and now >= self.open_until:
+                    self.state = 'half-open'
+                    self.probing = False
+                if self.state == 'half-open' and not self.probing:
+                    self.probing = True
+                    return True
+                if now >= deadline:
+                    return False
+                wait = self.open_until - now if self.state == 'open' else 1.0
+                self.condition.wait(max(0.01, min(wait, deadline - now)))
+
+    def Abandon(self):
+        # the probe ended without an answer either way, so let another go
+        with self.condition:
+            if self.state == 'half-open' and self.probing:
+                self.probing = False
+                self.condition.notify_all()
+
+    def Record(self,ok):
+        # returns the new state if this result changed it
+        with self.condition:
+            if ok:
+                self.failures = 0
+                if self.state == 'closed':
+                    return None
+                self.state = 'closed'
+                self.next_cooldown = self.cooldown
+                self.probing = False
+                self.condition.notify_all()
+                return self.state
+            self.failures += 1
+            if self.state == 'half-open' or (self.state == 'closed' and self.failures >= self.threshold):
+                self.state = 'open'
+                self.open_until = time.time() + self.next_cooldown
+                self.next_cooldown = min(self.max_cooldown, self.next_cooldown * 2)
+                self.opens += 1
+                self.probing = False
+                self.condition.notify_all()
+                return self.state
+            return None
+
+class Rate_Governor(object):
+    '''
+    Keeps the requests of a run to one service (the tetration API gateway or
+    the infoblox grid master) within what it can take. WrapSession hooks a
+    requests session like Instrumentation does, so every request of the
+    helpers and of the client libraries goes through it:
+
+    * a token bucket per endpoint allows at most rate requests per second
+    * the number of requests in flight adapts to the responses (AIMD): it
+      grows by one for about every limit successful responses and is halved
+      when the service answers 429 or 503 or gets latency_factor times
+      slower than its average latency for the endpoint
+    * requests answered with 429, 502, 503 or 504, or that fail to connect,
+      are retried up to retries times after a jittered exponential backoff,
+      or after the Retry-After the service asked for
+    * a circuit breaker opens after consecutive failures and pauses every
+      request, and so the stage making it, until a probe request gets an
+      answer again; a request still held back after max_pause seconds
+      fails with a ConnectionError without being sent
+
+    Every request of this integration can be sent twice without harm
+    (lookups, searches and CMDB uploads of whole rows), so POSTs are
+    retried too. A request with a streamed body, such as a CMDB upload, is
+    sent only once, since its body is used up; the caller retries it.
+    Changes of the limit and of the breaker are reported to the Pigeon, and
+    State() returns the counters for the final one.
+    '''
+    RETRY_STATUS = (429, 502, 503, 504)
+    # a halving covers every response in flight when it happened
+    DECREASE_INTERVAL = 1.0
+    REPORT_INTERVAL = 10.0
+    # latencies below this are too short to tell load from noise
+    MIN_SLOW_SECONDS = 0.05
+    BASELINE_SAMPLES = 10
+
+    def __init__(self,service,pigeon=None,rate=None,burst=None,max_concurrency=16,min_concurrency=1,retries=4,backoff=0.5,max_backoff=30.0,latency_factor=4.0,failures=5,cooldown=10.0,max_cooldown=300.0,max_pause=600.0):
+        self.service = service
+        self.pigeon = pigeon
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.latency_factor = latency_factor
+        self.max_pause = max_pause
+        self.breaker = Circuit_Breaker(failures, cooldown, max_cooldown)
+        self.buckets = {}
+        self.baseline = {}
+        self.condition = threading.Condition()
+        self.random = random.Random()
+        self.last_decrease = 0.0
+        self.last_report = 0.0
+        self.counts = {'requests': 0, 'retries': 0, 'throttled': 0, 'slow': 0, 'decreases': 0}
+        self.waited = {'rate_limit': 0.0, 'concurrency': 0.0, 'circuit': 0.0, 'backoff': 0.0}
+
+    def _Bucket(self,key):
+        with self.condition:
+            if key not in self.buckets:
+                self.buckets[key] = Token_Bucket(self.rate, self.burst)
+            return self.buckets[key]
+
+    def _Acquire(self):
+        start = time.time()
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            self.waited['concurrency'] += time.time() - start
+
+    def _Release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def _Observe(self,key,seconds,throttled):
+        # AIMD on the limit of requests in flight; returns the new limit if
+        # it was cut
+        with self.condition:
+            # moving average of the latency of the endpoint, judged only once
+            # it has seen enough responses to mean something
+            mean, samples = self.baseline.get(key, (seconds, 0))
+            slow = samples >= self.BASELINE_SAMPLES and seconds > self.MIN_SLOW_SECONDS and seconds > mean * self.latency_factor
+            if not throttled:
+                self.baseline[key] = (mean + (seconds - mean) * 0.1, samples + 1)
+            if slow:
+                self.counts['slow'] += 1
+            if throttled or slow:
+                now = time.time()
+                if now - self.last_decrease < self.DECREASE_INTERVAL or self.limit <= self.min_concurrency:
+                    return None
+                self.last_decrease = now
+                self.limit = max(float(self.min_concurrency), self.limit / 2)
+                self.counts['decreases'] += 1
+                return int(self.limit)
+            self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+            return None
+
+    def _Delay(self,attempt,resp):
+        # full jitter, or what the service asked for in Retry-After
+        delay = self.random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        try:
+            delay = max(delay, min(self.max_backoff, float(resp.headers.get('Retry-After'))))
+        except (AttributeError, TypeError, ValueError):
+            pass
+        return delay
+
+    def _Report(self,message,force=False):
+        if not self.pigeon:
+            return
+        now = time.time()
+        if not force and now - self.last_report < self.REPORT_INTERVAL:
+            return
+        self.last_report = now
+        self.pigeon.note.update({
+            'status_code': 100,
+            'message' : message,
+            'data' : self.State()
+        })
+        self.pigeon.send()
+
+    def _Record(self,ok):
+        state = self.breaker.Record(ok)
+        if state == 'open':
+            self._Report('Circuit breaker for ' + self.service + ' opened after repeated failures, pausing requests for ' + str(int(self.breaker.open_until - time.time())) + 's', force=True)
+        elif state == 'closed':
+            self._Report('Circuit breaker for ' + self.service + ' closed, ' + self.service + ' is answering again', force=True)
+
+    def WrapSession(self,session,endpoint):
+        # endpoint(request) names the token bucket of a call; wrapping a
+        # session again replaces the governor of the last run
+        send = session.send
+        send = getattr(send, 'ungoverned', send)
+        def governed_send(request, **kwargs):
+            key = endpoint(request)
+            # a streamed body is read as it is sent and cannot be sent again
+            retries = self.retries if request.body is None or isinstance(request.body, basestring) else 0
+            attempt = 0
+            while True:
+                start = time.time()
+                closed = self.breaker.Wait(self.max_pause)
+                with self.condition:
+                    self.waited['circuit'] += time.time() - start
+                if not closed:
+                    self._Report(self.service + ' still failing after pausing ' + str(int(self.max_pause)) + 's, giving up on the request', force=True)
+                    raise requests.exceptions.ConnectionError(self.service + ' circuit breaker open for ' + str(int(self.max_pause)) + 's')
+                if self.rate:
+                    waited = self._Bucket(key).Take()
+                    with self.condition:
+                        self.waited['rate_limit'] += waited
+                self._Acquire()
+                resp = None
+                error = None
+                start = time.time()
+                try:
+                    resp = send(request, **kwargs)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as failure:
+                    error = failure
+                except BaseException:
+                    self.breaker.Abandon()
+                    raise
+                finally:
+                    self._Release()
+                throttled = resp is not None and resp.status_code in (429, 503)
+                failed = error is not None or resp.status_code in self.RETRY_STATUS
+                with self.condition:
+                    self.counts['requests'] += 1
+                    self.counts['throttled'] += 1 if throttled else 0
+                cut = self._Observe(key, time.time() - start, throttled)
+                if cut is not None:
+                    self._Report(self.service + (' is throttling' if throttled else ' is slowing down') + ', limiting to ' + str(cut) + ' requests in flight')
+                if resp is None or resp.status_code != 429:
+                    # a 429 is the service pacing us, which the backoff
+                    # handles, not a sign that it is down
+                    self._Record(not failed)
+                if not failed or attempt >= retries:
+                    if error is not None:
+                        raise error
+                    return resp
+                attempt += 1
+                delay = self._Delay(attempt, resp)
+                with self.condition:
+                    self.counts['retries'] += 1
+                    self.waited['backoff'] += delay
+                if resp is not None:
+                    # hand the connection back before sleeping
+                    resp.close()
+                time.sleep(delay)
+        governed_send.ungoverned = send
+        session.send = governed_send
+
+    def State(self):
+        with self.condition:
+            return {
+                'service': self.service,
+                'circuit': self.breaker.state,
+                'circuit_opens': self.breaker.opens,
+                'concurrency_limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'rate_limit': self.rate,
+                'requests': self.counts['requests'],
+                'retries': self.counts['retries'],
+                'throttled': self.counts['throttled'],
+                'slow': self.counts['slow'],
+                'limit_decreases': self.counts['decreases'],
+                'waited_seconds': dict([(name, round(seconds, 3)) for name, seconds in self.waited.items()])
+            }
+
+class Subnet_Index(object):
+    '''
+    Binary radix trie of IP networks. Inserts are incremental and a lookup
+    walks at most one node per address bit (32 for IPv4) no matter how many
+    networks are stored.
+    '''
+    def __init__(self):
+        # one root per IP version; each node is [zero child, one child, network]
+        self.roots = {4: [None, None, None], 6: [None, None, None]}
+        self.count = 0
+
+    def Add(self,network):
+        network = IPNetwork(network)
+        node = self.roots[network.version]
+        width = 32 if network.version == 4 else 128
+        value = network.value
+        for i in range(network.prefixlen):
+            bit = (value >> (width - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[2] is None:
+            self.count += 1
+        node[2] = network
+
+    def LongestMatch(self,addr):
+        node = self.roots[addr.version]
+        width = 32 if addr.version == 4 else 128
+        value = addr.value
+        match = node[2]
+        for i in range(width):
+            node = node[(value >> (width - 1 - i)) & 1]
+            if node is None:
+                break
+            if node[2] is not None:
+                match = node[2]
+        return match
+
+    def __contains__(self,addr):
+        return self.LongestMatch(addr) is not None
+
+    def __len__(self):
+        return self.count
+
+def CompactText(value,shared=False):
+    # utf-8 str takes a quarter of the memory of the unicode json decodes
+    # to; shared text that repeats across hosts (views, subnets, attribute
+    # names and values) is interned so every host points at one copy
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    if shared and type(value) is str:
+        value = intern(value)
+    return value
+
+class Record(object):
+    '''
+    Base of the compact host records. Fields live in __slots__ rather than
+    in a dict per host, and are read like the decoded json they replace
+    (record["ip"], record.get("vrf_id")), so the code that consumes pages
+    does not change. A field the response did not have is left unset.
+    '''
+    __slots__ = ()
+
+    def __getitem__(self,key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self,key,default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def __contains__(self,key):
+        return key in self.__slots__ and hasattr(self, key)
+
+_RECORD_TYPES = {}
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def RecordType(fields):
+    # one Record class per field list, such as the dimensions of an
+    # inventory search; None when a field cannot be a slot name
+    fields = tuple(fields)
+    if fields not in _RECORD_TYPES:
+        usable = all([_IDENTIFIER.match(field) for field in fields])
+        _RECORD_TYPES[fields] = type('Inventory_Record', (Record,), {'__slots__': fields}) if usable else None
+    return _RECORD_TYPES[fields]
+
+class Host_Record(Record):
+    '''
+    An infoblox ipv4address with only the fields the integration reads.
+    extattrs maps every attribute name to its value, without the
+    {"value": ...} object WAPI wraps it in. Records are decoded straight
+    from a WAPI response by Decode, without a dict per host in between.
+    '''
+    __slots__ = ('ip_address', 'names', 'network', 'network_view', 'extattrs')
+    NO_EXTATTRS = {}
+
+    def __init__(self,pairs=()):
+        self.names = ()
+        self.network = None
+        self.network_view = None
+        self.extattrs = self.NO_EXTATTRS
+        for key, value in pairs:
+            if key == 'ip_address':
+                self.ip_address = CompactText(value)
+            elif key == 'names':
+                self.names = tuple([CompactText(name) for name in value])
+            elif key == 'network' or key == 'network_view':
+                setattr(self, key, CompactText(value, shared=True))
+            elif key == 'extattrs' and value:
+                self.extattrs = self._Extattrs(value)
+
+    @staticmethod
+    def _Extattrs(extattrs):
+        # CompactText written out, since this runs for every attribute of
+        # every host; Decode has already taken most values out of their
+        # {"value": ...} objects
+        compact = {}
+        for name, attr in extattrs.iteritems():
+            if type(attr) is dict:
+                attr = attr.get('value')
+            if type(attr) is unicode:
+                attr = intern(attr.encode('utf-8'))
+            elif type(attr) is str:
+                attr = intern(attr)
+            compact[intern(name.encode('utf-8') if type(name) is unicode else name)] = attr
+        return compact
+
+    @classmethod
+    def FromWapi(cls,obj):
+        return cls(obj.items()) if obj is not None else None
+
+    @classmethod
+    def Decode(cls,content):
+        # json hook: ipv4address objects become records and the
+        # {"value": ...} object of an attribute becomes its value, so neither
+        # is ever built as a dict
+        def hook(pairs):
+            if len(pairs) == 1 and pairs[0][0] == 'value':
+                return pairs[0][1]
+            obj = dict(pairs)
+            return cls(pairs) if 'ip_address' in obj else obj
+        return json.loads(content, object_pairs_hook=hook)
+
+    def Wapi(self):
+        # the WAPI form, for the json of the lookup cache
+        return {
+            'ip_address': self.ip_address,
+            'names': list(self.names),
+            'network': self.network,
+            'network_view': self.network_view,
+            'extattrs': dict([(name, {'value': value}) for name, value in self.extattrs.items()])
+        }
+
+class Inventory_Page(list):
+    '''
+    One page of inventory search results. Besides the hosts it remembers the
+    partition it came from, its position in that partition and the cursor of
+    the page after it, which is what a checkpoint needs to resume there.
+    '''
+    def __init__(self,hosts,partition,seq,offset):
+        list.__init__(self, hosts)
+        self.partition = partition
+        self.seq = seq
+        self.offset = offset
+
+class Sweep_Checkpoint(object):
+    '''
+    Durable progress of an inventory sweep: for every partition the cursor
+    after the last page whose results were committed, plus the upload spool
+    and the chunks that were cut from it but not posted yet. The file is
+    replaced atomically after every committed page, so a run that dies part
+    way can be resumed by the next one instead of starting from offset ''.
+
+    Pages may be committed out of order when several workers enrich them;
+    a partition's cursor only moves past pages whose predecessors are all
+    committed, so a resumed run may redo a page but never skips one.
+    '''
+    def __init__(self,checkpointFile):
+        self.checkpointFile = checkpointFile
+        self.lock = threading.Lock()
+        self.state = None
+        self.waiting = {}
+        self.data = {}
+
+    def Start(self,key,partitions):
+        # returns True when a checkpoint for the same sweep was found; data
+        # is a dictionary the caller can use to carry its own state along
+        saved = None
+        try:
+            with open(self.checkpointFile) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+        except (IOError, ValueError):
+            pass
+        resumed = bool(saved) and saved.get('key') == key and len(saved.get('partitions', [])) == partitions
+        if resumed:
+            self.state = saved
+        else:
+            self.state = {
+                'key': key,
+                'partitions': [{'offset': '', 'seq': 0, 'done': False} for _ in range(partitions)],
+                'spool': None,
+                'pending': [],
+                'data': {}
+            }
+        self.data = self.state['data']
+        self.waiting = dict((i, {}) for i in range(partitions))
+        with self.lock:
+            self._Save()
+        return resumed
+
+    def Partition(self,index):
+        with self.lock:
+            return dict(self.state['partitions'][index])
+
+    def Spool(self):
+        with self.lock:
+            return self.state['spool'], list(self.state['pending'])
+
+    def _Save(self):
+        with open(self.checkpointFile + '.tmp', 'w') as checkpoint_file:
+            json.dump(self.state, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.rename(self.checkpointFile + '.tmp', self.checkpointFile)
+
+    def Commit(self,page,spool=None,chunk=None):
+        # spool and chunk are the upload batcher's state after the page's
+        # rows were written, saved in the same write as the page itself
+        with self.lock:
+            if page is not None:
+                progress = self.state['partitions'][page.partition]
+                waiting = self.waiting[page.partition]
+                waiting[page.seq] = page.offset
+                while progress['seq'] in waiting:
+                    progress['offset'] = waiting.pop(progress['seq'])
+                    progress['seq'] += 1
+                    if not progress['offset']:
+                        progress['done'] = True
+            if spool is not None:
+                self.state['spool'] = spool
+            if chunk is not None:
+                self.state['pending'].append(chunk)
+            self._Save()
+
+    def Uploaded(self,chunk):
+        with self.lock:
+            self.state['pending'] = [c for c in self.state['pending'] if c['file'] != chunk['file']]
+            self._Save()
+
+    def Finish(self):
+        # the sweep is complete and every chunk is posted
+        with self.lock:
+            if os.path.exists(self.checkpointFile):
+                os.remove(self.checkpointFile)
+
+class Tetration_Error(Exception):
+    '''
+    A request to the tetration cluster failed. The helpers raise it instead
+    of ending the run, so the script reports it as a 403 and exits non-zero.
+    '''
+
 class Tetration_Helper(object):
     class Inventory(object):
         offset = ''
         pagedData = None
         hasNext = False
 
-    def __init__(self, endpoint, api_key, api_secret,pigeon, options, tenant_app_scope="Default"):
-        self.rc = RestClient(endpoint, api_key=api_key, api_secret=api_secret, verify=False)
+    # inventory fields read by every consumer of an inventory page: the
+    # address, and the VRF so that pages are deduped per VRF
+    INVENTORY_DIMENSIONS = ['ip', 'vrf_id']
+
+    def __init__(self, endpoint, api_key, api_secret,pigeon, options, tenant_app_scope="Default", instrumentation=None, governor=None):
+        # reused across requests by an eco_action.py worker
+        self.rc = dispatcher.shared(('tetration', endpoint, api_key, api_secret),
+                                    lambda: RestClient(endpoint, api_key=api_key, api_secret=api_secret, verify=False))
+        if instrumentation:
+            instrumentation.WrapSession(self.rc.session, 'tetration', TetrationEndpoint)
+        if governor:
+            # outside the instrumentation, so every attempt is measured
+            governor.WrapSession(self.rc.session, TetrationEndpoint)
         self.scopes = []
         self.pigeon = pigeon
         self.inventory = self.Inventory()
         self.filters = {}
         self.options = options
         self.subnets = []
+        self.subnet_index = Subnet_Index()
         self.boolean = Boolean_Helper()
         self.tenant_app_scope = tenant_app_scope
+        # size of the connection pool mounted on the client, shared with the
+        # helpers of other tenants (see ForTenant)
+        self.pool = {'maxsize': 0, 'lock': threading.Lock()}
+
+    def ForTenant(self,tenant_app_scope,pigeon):
+        # a helper for another scope over the same client and connection
+        # pool, so a multi-tenant run logs in and connects once
+        helper = copy.copy(self)
+        helper.tenant_app_scope = tenant_app_scope
+        helper.pigeon = pigeon
+        helper.scopes = []
+        helper.inventory = self.Inventory()
+        helper.filters = {}
+        helper.subnets = []
+        helper.subnet_index = Subnet_Index()
+        return helper
+
+    def ReservePool(self,connections):
+        # mounts a pool of at least this many connections; a pool that is
+        # large enough is kept, since the readers of other tenants use it
+        with self.pool['lock']:
+            if connections > self.pool['maxsize']:
+                self.rc.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=connections, pool_block=True))
+                self.pool['maxsize'] = connections
 
     def GetSearchDimensions(self):
         resp = self.rc.get('/inventory/search/dimensions')
@@ -49,32 +1096,23 @@ class Tetration_Helper(object):
     def GetApplicationScopes(self):
         resp = self.rc.get('/app_scopes')
         if resp.status_code != 200:
-            self.pigeon.status_code = '403'
-            self.pigeon.note.update({
-                'status_code': 403,
-                'message' : 'Unable to get application scopes from tetration cluster',
-                'data' : {}
-            })
-            self.pigeon.send()
-            exit(0)
+            raise Tetration_Error('Unable to get application scopes from tetration cluster (status ' + str(resp.status_code) + ')')
+        self.scopes = resp.json()
 
-        else:
-            self.scopes = resp.json()
+    def GetScopeVrf(self,vrfs):
+        # the name of the VRF of the tenant scope, given the vrf_id -> name
+        # map of GetTenantNames; the scope name if the scope isn't found
+        self.GetApplicationScopes()
+        for scope in self.scopes:
+            if scope.get('name') == self.tenant_app_scope and scope.get('vrf_id') in vrfs:
+                return vrfs[scope['vrf_id']]
+        return self.tenant_app_scope
 
     def GetTenantNames(self):
         resp = self.rc.get('/vrfs')
         if resp.status_code != 200:
-            self.pigeon.status_code = '403'
-            self.pigeon.note.update({
-                'status_code': 403,
-                'message' : 'Unable to get application scopes from tetration cluster',
-                'data' : {}
-            })
-            self.pigeon.send()
-            exit(0)
-
-        else:
-            return resp.json()
+            raise Tetration_Error('Unable to get tenants from tetration cluster (status ' + str(resp.status_code) + ')')
+        return resp.json()
 
     def GetInventory(self, filters=None, dimensions=None):
         req_payload = {
@@ -89,25 +1127,170 @@ class Tetration_Helper(object):
         }
         resp = self.rc.post('/inventory/search',json_body=json.dumps(req_payload))
         if resp.status_code != 200:
-            self.pigeon.note.update({
-                'status_code': 403,
-                'message' : 'Unable to get inventory from tetration cluster',
-                'data' : {}
-            })
-            self.pigeon.send()
-            exit(0)
-        else:
-            self.pigeon.note.update({
-                'status_code': 100,
-                'message' : 'Successfully retrieved inventory page from Tetration',
-                'data' : {}
-            })
-            self.pigeon.send()
-            resp = resp.json()
-            self.inventory.pagedData = resp['results']
-            self.inventory.offset = resp['offset'] if 'offset' in resp else ''
-            self.inventory.hasNext = True if self.inventory.offset else False
+            raise Tetration_Error('Unable to get inventory from tetration cluster (status ' + str(resp.status_code) + ')')
+        self.pigeon.note.update({
+            'status_code': 100,
+            'message' : 'Successfully retrieved inventory page from Tetration',
+            'data' : {}
+        })
+        self.pigeon.send()
+        resp = self.ParseInventoryPage(resp.content, dimensions)
+        self.inventory.pagedData = resp['results']
+        self.inventory.offset = resp['offset'] if 'offset' in resp else ''
+        self.inventory.hasNext = True if self.inventory.offset else False
+
+    def InventoryDimensions(self):
+        '''
+        Returns the dimensions list of an inventory search. Annotation values
+        come from infoblox, so no annotation column needs an inventory field
+        beyond the ones every page consumer reads.
+        '''
+        return list(self.INVENTORY_DIMENSIONS)
+
+    def ParseInventoryPage(self,content,dimensions=None):
+        '''
+        Parses an inventory search response. tetpyclient hands over the whole
+        body, so the response text is in memory while it is decoded; the
+        parse does not stream. With dimensions, every record is cut down to
+        those fields as soon as the decoder has built it, so the decoded page
+        never holds full records even if the cluster returns more fields
+        than were asked for.
+        '''
+        if not dimensions:
+            return json.loads(content)
+        wanted = set(dimensions)
+        record_type = RecordType(dimensions)
+
+        def project(pairs):
+            # the top level object is the only one with the results list
+            if any(key == 'results' for key, _ in pairs):
+                return dict(pairs)
+            if record_type is None:
+                return dict((key, value) for key, value in pairs if key in wanted)
+            # hosts are kept as compact records rather than dicts
+            record = record_type()
+            for key, value in pairs:
+                if key in wanted:
+                    setattr(record, key, CompactText(value))
+            return record
+        return json.loads(content, object_pairs_hook=project)
+
+    def InventoryPartitions(self,subnets):
+        '''
+        Splits an inventory search into disjoint subfilters: one per subnet and
+        one for every address outside of all of them (including IPv6), so each
+        host matches exactly one partition. No subnets means one partition
+        that matches everything.
+        '''
+        if not subnets:
+            return [None]
+        partitions = [{"type": "subnet", "field": "ip", "value": str(IPNetwork(subnet))} for subnet in subnets]
+        partitions.append({"type": "not", "filter": {"type": "or", "filters": list(partitions)}})
+        return partitions
+
+    def _PutPage(self,out,item,stop):
+        # give up once the reader has gone away instead of blocking forever
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _PagePartition(self,filters,index,partition,dimensions,out,stop,offset='',seq=0):
+        search = {"type": "or", "filters": filters}
+        if partition is not None:
+            search = {"type": "and", "filters": [search, partition]}
+        req_payload = {
+            "filter": search,
+            "scopeName": self.tenant_app_scope,
+            "dimensions": dimensions,
+            "limit": self.options["limit"],
+            "offset": offset
+        }
+        try:
+            while not stop.is_set():
+                resp = self.rc.post('/inventory/search',json_body=json.dumps(req_payload))
+                if resp.status_code != 200 and offset and req_payload["offset"] == offset:
+                    # a cursor saved by an earlier run may have expired, so
+                    # page this partition again from the start
+                    offset = req_payload["offset"] = ''
+                    continue
+                if resp.status_code != 200:
+                    self._PutPage(out, ('error', 'status ' + str(resp.status_code)), stop)
+                    return
+                resp = self.ParseInventoryPage(resp.content, dimensions)
+                page = Inventory_Page(resp['results'], index, seq, resp.get('offset') or '')
+                if not self._PutPage(out, ('page', page), stop):
+                    return
+                if not page.offset:
+                    break
+                seq += 1
+                req_payload["offset"] = page.offset
+        except Exception as error:
+            self._PutPage(out, ('error', str(error)), stop)
             return
+        self._PutPage(out, ('done', None), stop)
+
+    def GetInventoryPages(self,filters=None,dimensions=None,partitions=None,workers=4,checkpoint=None):
+        '''
+        Generator over inventory pages that pages the cursor of every
+        partition at the same time, at most workers at once over a shared
+        connection pool of the same size. Pages are yielded in the order they
+        arrive with hosts already seen in an earlier page removed, and a
+        bounded queue keeps the readers at most a few pages ahead.
+
+        With a checkpoint, partitions start from the cursor after their last
+        committed page and finished partitions are skipped. Every page is an
+        Inventory_Page that the consumer hands to checkpoint.Commit once its
+        results are safe; pages left empty by the dedupe are committed here.
+        '''
+        partitions = partitions or [None]
+        progress = [checkpoint.Partition(i) if checkpoint else {'offset': '', 'seq': 0, 'done': False} for i in range(len(partitions))]
+        todo = [i for i in range(len(partitions)) if not progress[i]['done']]
+        if not todo:
+            return
+        workers = max(1, min(workers, len(todo)))
+        # one connection more than readers so uploads are never starved
+        self.ReservePool(workers + 1)
+        out = Queue(maxsize=workers * 2)
+        stop = threading.Event()
+        pool = ThreadPool(workers)
+        for i in todo:
+            pool.apply_async(self._PagePartition, (filters, i, partitions[i], dimensions, out, stop, progress[i]['offset'], progress[i]['seq']))
+        pool.close()
+        seen = set()
+        remaining = len(todo)
+        pages = 0
+        try:
+            while remaining:
+                kind, value = out.get()
+                if kind == 'done':
+                    remaining -= 1
+                    continue
+                if kind == 'error':
+                    raise Tetration_Error('Unable to get inventory from tetration cluster (' + value + ')')
+                pages += 1
+                hosts = []
+                for host in value:
+                    key = (host.get('ip'), host.get('vrf_id'))
+                    if key not in seen:
+                        seen.add(key)
+                        hosts.append(host)
+                value[:] = hosts
+                self.pigeon.note.update({
+                    'status_code': 100,
+                    'message' : 'Successfully retrieved inventory page ' + str(pages) + ' from Tetration (' + str(len(partitions) - remaining) + ' of ' + str(len(partitions)) + ' partitions done)',
+                    'data' : {}
+                })
+                self.pigeon.send()
+                if value:
+                    yield value
+                elif checkpoint:
+                    checkpoint.Commit(value)
+        finally:
+            stop.set()
 
     def CreateInventoryFilters(self,network_list):
         inventoryDict = {}
@@ -151,50 +1334,42 @@ class Tetration_Helper(object):
         return
 
     def AnnotateHosts(self,hosts,columns,csvFile):
+        self.WriteAnnotations(hosts,columns,csvFile)
+        self.UploadAnnotations(csvFile)
+
+    def AnnotationFieldnames(self,columns):
+        return Annotation_Plan(columns).fieldnames
+
+    def AnnotationRows(self,hosts,columns):
+        # compiles the columns on every call; a run that builds rows for
+        # many pages keeps one Annotation_Plan instead
+        return Annotation_Plan(columns).Rows(hosts)
+
+    def WriteAnnotations(self,hosts,columns,csvFile):
+        plan = Annotation_Plan(columns)
         with open(csvFile, "wb") as csv_file:
-            fieldnames = ['IP']
-            for column in columns:
-                if column["infobloxName"] != 'extattrs':
-                    fieldnames.extend([column["annotationName"]])
-                else:
-                    if column["overload"] == "on":
-                        fieldnames.extend([column["annotationName"]])
-                    else:
-                        for attr in column["attrList"]:
-                            fieldnames.extend([str(column["annotationName"]) + '-' + str(attr)])
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+            writer = csv.DictWriter(csv_file, fieldnames=plan.fieldnames, extrasaction='ignore')
             writer.writeheader()
-            for host in hosts:
-                hostDict = {}
-                hostDict["IP"] = host["ip_address"]
-                # hostDict["VRF"] = [ tetHost["vrf_name"] for tetHost in self.inventory.pagedData if tetHost["ip"] == host["ip_address"] ][0]
-                if len(host["names"]) < 1:
-                    continue
-                for column in columns:
-                    if column["infobloxName"] == 'extattrs':
-                        for attr in column["attrList"]:
-                            if column["overload"] == "on":
-                                if attr["value"] in host["extattrs"]:
-                                    hostDict[column["annotationName"]] = str(attr["value"]) + '=' + str(host["extattrs"][attr["value"]]["value"]) + ';' if column["annotationName"] not in hostDict.keys() else hostDict[column["annotationName"]] + str(attr["value"]) + '=' + str(host["extattrs"][attr["value"]]["value"]) + ';'
-                                else:
-                                    hostDict[column["annotationName"]] = str(attr["value"]) + '=;' if column["annotationName"] not in hostDict.keys() else str(hostDict[column["annotationName"]]) + str(attr["value"]) + '=;'
-                            else:
-                                if attr["value"] in host["extattrs"]:
-                                    hostDict[column["annotationName"] + '-' + attr["value"]] = host["extattrs"][attr["value"]]["value"]
-                                else:
-                                    hostDict[column["annotationName"] + '-' + attr["value"]] = ''
-                    elif column["infobloxName"] == 'zone':
-                        hostDict[column["annotationName"]] = '.'.join(",".join(host["names"]).split('.')[1:])
-                    elif column["infobloxName"] == 'names':
-                        hostDict[column["annotationName"]] = ",".join(host[column["infobloxName"]]).split('.')[0]
-                    else:
-                        hostDict[column["annotationName"]] = host[column["infobloxName"]]
-                writer.writerow(hostDict)
+            writer.writerows(plan.Rows(hosts))
+
+    def PostAnnotations(self,csvFile,oper='add',timeout=10):
         #keys = ['IP', 'VRF']
         #req_payload = [tetpyclient.MultiPartOption(key='X-Tetration-Key', val=keys), tetpyclient.MultiPartOption(key='X-Tetration-Oper', val='add')]
         #resp = self.rc.upload(csvFile, '/assets/cmdb/upload', req_payload)
-        req_payload = [tetpyclient.MultiPartOption(key='X-Tetration-Oper', val='add')]
-        resp = self.rc.upload(csvFile, '/assets/cmdb/upload/' + self.tenant_app_scope, req_payload)
+        req_payload = [tetpyclient.MultiPartOption(key='X-Tetration-Oper', val=oper)]
+        return self.rc.upload(csvFile, '/assets/cmdb/upload/' + self.tenant_app_scope, req_payload, timeout=timeout)
+
+    def DownloadAnnotations(self,csvFile,timeout=300):
+        # tetpyclient streams the body to csvFile a chunk at a time, so the
+        # CMDB of a large scope is never held in memory
+        try:
+            resp = self.rc.download(csvFile, '/assets/cmdb/download/' + self.tenant_app_scope, timeout=timeout)
+        except Exception:
+            return False
+        return resp.status_code == 200
+
+    def UploadAnnotations(self,csvFile):
+        resp = self.PostAnnotations(csvFile)
         if resp.status_code != 200:
             self.pigeon.note.update({
                 'status_code': 403,
@@ -213,28 +1388,627 @@ class Tetration_Helper(object):
 
     def AddSubnets(self,subnets):
         for subnet in subnets:
-            self.subnets.append(IPNetwork(subnet))
+            subnet = IPNetwork(subnet)
+            self.subnets.append(subnet)
+            self.subnet_index.Add(subnet)
 
     def HasSubnetFilterForIp(self,ip):
-        for subnet in self.subnets:
-            addr = IPAddress(ip)
-            if subnet.__contains__(addr) is True or addr.is_private() is not True:
-                return True
+        # public addresses never get a filter, but only once at least one
+        # subnet is known (matches the behaviour of the original linear scan)
+        if len(self.subnet_index) < 1:
+            return False
+        addr = IPAddress(ip)
+        return addr in self.subnet_index or addr.is_private() is not True
+
+class Annotation_Plan(object):
+    '''
+    The annotation columns of a run compiled once into the CSV header and
+    one extractor per column setting, so a row is built in a single pass over
+    fixed callables instead of re-reading the settings for every host. An
+    extractor takes the Host_Record and its names joined with commas
+    (shared by the hostname and zone columns) and returns the values of its
+    header columns: one, or one per attribute for extensible attributes
+    that are not overloaded.
+    '''
+    def __init__(self,columns):
+        self.fieldnames = ['IP']
+        self.extractors = []
+        for column in columns:
+            name = column["annotationName"]
+            attrs = [attr["value"] for attr in column.get("attrList", [])]
+            if column["infobloxName"] != 'extattrs':
+                self.fieldnames.append(name)
+                self.extractors.append(self._Field(column["infobloxName"]))
+            elif column.get("overload") == "on":
+                self.fieldnames.append(name)
+                self.extractors.append(self._Overloaded(attrs))
+            else:
+                self.fieldnames.extend([name + '-' + attr for attr in attrs])
+                self.extractors.append(self._Attributes(attrs))
+
+    def _Field(self,infobloxName):
+        if infobloxName == 'names':
+            return lambda host, names: (names.partition('.')[0],)
+        if infobloxName == 'zone':
+            return lambda host, names: (names.partition('.')[2],)
+        return lambda host, names: (host[infobloxName],)
+
+    def _Overloaded(self,attrs):
+        # "name=value;" for every attribute, "name=;" when the host has none
+        prefixes = [(attr, str(attr) + '=', str(attr) + '=;') for attr in attrs]
+        def extract(host, names):
+            extattrs = host.extattrs
+            return (''.join([prefix + str(extattrs[attr]) + ';' if attr in extattrs else unset for (attr, prefix, unset) in prefixes]),)
+        return extract
+
+    def _Attributes(self,attrs):
+        def extract(host, names):
+            extattrs = host.extattrs
+            return [extattrs[attr] if attr in extattrs else '' for attr in attrs]
+        return extract
+
+    def Row(self,host):
+        # hosts without a name are not annotated
+        if not host.names:
+            return None
+        names = ",".join(host.names)
+        values = [host.ip_address]
+        for extract in self.extractors:
+            values.extend(extract(host, names))
+        return dict(zip(self.fieldnames, values))
+
+    def Rows(self,hosts):
+        for host in hosts:
+            row = self.Row(host)
+            if row is not None:
+                yield row
+
+class Upload_Batcher(object):
+    '''
+    Collects annotation rows from many inventory pages in a spool file and
+    cuts it into upload chunks once a row or byte threshold is reached, so a
+    large run posts a handful of files to /assets/cmdb/upload instead of one
+    per page. Chunks are uploaded and retried independently of each other,
+    up to retries times on the responses a Rate_Governor would retry. The
+    governor cannot send the streamed upload body again, so the retries of
+    an upload are made here with a new request each time.
+    '''
+    def __init__(self,tetration,fieldnames,spoolFile,max_rows=10000,max_bytes=4*1024*1024,retries=3,timeout=60,oper='add',checkpoint=None):
+        self.tetration = tetration
+        self.pigeon = tetration.pigeon
+        self.fieldnames = fieldnames
+        self.spoolFile = spoolFile
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.retries = retries
+        self.timeout = timeout
+        self.oper = oper
+        self.lock = threading.Lock()
+        self.chunks = 0
+        self.failed = []
+        self.spool = None
+        self.writer = None
+        self.rows = 0
+        self.checkpoint = checkpoint
+        # rows and bytes Tetration accepted, for the run metrics
+        self.posted = {'rows': 0, 'bytes': 0}
+
+    def _Open(self):
+        self.spool = open(self.spoolFile, "wb")
+        # rows are built for these fieldnames, so the writer skips the
+        # per-row check for unknown keys
+        self.writer = csv.DictWriter(self.spool, fieldnames=self.fieldnames, extrasaction='ignore')
+        self.writer.writeheader()
+        self.rows = 0
+
+    def _Cut(self):
+        # close the spool and rename it to a chunk file that can be uploaded
+        # while the next spool fills up
+        self.spool.close()
+        self.spool = None
+        chunkFile = self.spoolFile + '.' + str(self.chunks)
+        self.chunks += 1
+        os.rename(self.spoolFile, chunkFile)
+        return {'file': chunkFile, 'rows': self.rows, 'bytes': os.path.getsize(chunkFile)}
+
+    def _Commit(self,page,chunk):
+        # the spool has to be on disk before a checkpoint may point at it
+        if self.spool is not None:
+            self.spool.flush()
+            os.fsync(self.spool.fileno())
+        spool = {
+            'rows': self.rows if self.spool is not None else 0,
+            'bytes': self.spool.tell() if self.spool is not None else 0,
+            'chunks': self.chunks
+        }
+        self.checkpoint.Commit(page, spool=spool, chunk=chunk)
+
+    def Resume(self):
+        # reopens the spool of a checkpointed run where it was committed and
+        # returns the chunks of that run that still have to be uploaded
+        spool, pending = self.checkpoint.Spool()
+        if spool is None:
+            return pending
+        with self.lock:
+            self.chunks = spool['chunks']
+            cut = self.spoolFile + '.' + str(self.chunks)
+            if not os.path.exists(self.spoolFile) and os.path.exists(cut):
+                # the run died after cutting a chunk but before committing it
+                os.rename(cut, self.spoolFile)
+            if spool['rows'] > 0 and os.path.exists(self.spoolFile):
+                # rows written after the last commit belong to pages that
+                # will be fetched again
+                self.spool = open(self.spoolFile, "r+b")
+                self.spool.truncate(spool['bytes'])
+                self.spool.seek(spool['bytes'])
+                self.writer = csv.DictWriter(self.spool, fieldnames=self.fieldnames, extrasaction='ignore')
+                self.rows = spool['rows']
+        return [chunk for chunk in pending if os.path.exists(chunk['file'])]
+
+    def Add(self,rows,page=None):
+        # returns a chunk ready for Upload once a threshold is crossed; with a
+        # checkpoint, page is committed once its rows are in the spool
+        with self.lock:
+            if self.spool is None:
+                self._Open()
+            for row in rows:
+                self.writer.writerow(row)
+                self.rows += 1
+            chunk = None
+            if self.rows >= self.max_rows or self.spool.tell() >= self.max_bytes:
+                chunk = self._Cut()
+            if self.checkpoint:
+                self._Commit(page, chunk)
+            return chunk
+
+    def Close(self):
+        # returns the last partial chunk, if any rows are left in the spool
+        with self.lock:
+            if self.spool is None:
+                return None
+            if self.rows < 1:
+                self.spool.close()
+                self.spool = None
+                os.remove(self.spoolFile)
+                return None
+            chunk = self._Cut()
+            if self.checkpoint:
+                self._Commit(None, chunk)
+            return chunk
+
+    def Upload(self,chunk):
+        for attempt in range(self.retries):
+            try:
+                resp = self.tetration.PostAnnotations(chunk['file'], oper=self.oper, timeout=self.timeout)
+                retry = resp.status_code in Rate_Governor.RETRY_STATUS
+                if resp.status_code == 200:
+                    os.remove(chunk['file'])
+                    with self.lock:
+                        self.posted['rows'] += chunk['rows']
+                        self.posted['bytes'] += chunk['bytes']
+                    if self.checkpoint:
+                        self.checkpoint.Uploaded(chunk)
+                    self.pigeon.note.update({
+                        'status_code': 100,
+                        'message' : 'Posted ' + str(chunk['rows']) + ' annotations (' + str(chunk['bytes']) + ' bytes) to Tetration cluster',
+                        'data' : {}
+                    })
+                    self.pigeon.send()
+                    return True
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                retry = True
+            except Exception:
+                retry = False
+            if not retry or attempt + 1 >= self.retries:
+                break
+            time.sleep(2 ** attempt)
+        with self.lock:
+            self.failed.append(chunk)
         return False
 
+    def RetryFailed(self):
+        # one more round for chunks that ran out of attempts during the run;
+        # returns the chunks that still could not be posted
+        with self.lock:
+            failed, self.failed = self.failed, []
+        for chunk in failed:
+            self.Upload(chunk)
+        if self.failed:
+            self.pigeon.note.update({
+                'status_code': 403,
+                'message' : 'Error posting ' + str(sum([chunk['rows'] for chunk in self.failed])) + ' annotations to Tetration cluster',
+                'data' : {}
+            })
+            self.pigeon.send()
+        return self.failed
+
+class Cmdb_Index(object):
+    '''
+    The annotations tetration already has for the columns of a run, read from
+    a CMDB download into a dictionary of (IP, VRF) -> digest of the row. Rows
+    built during the run are checked against it so that only new and changed
+    ones are uploaded, and addresses that have annotations in tetration but
+    no infoblox record any more are collected to be cleared: their rows are
+    uploaded again with every column of the run empty, which leaves the
+    columns of other integrations on the same CMDB row alone (an
+    X-Tetration-Oper delete would remove the whole row). Rows with none of
+    the columns set were not written by this integration and are never
+    touched.
+
+    vrfs maps the vrf_id of inventory hosts to VRF names; rows of the
+    download without a VRF belong to the VRF of the scope, vrf.
+    '''
+    def __init__(self,fieldnames,vrf,vrfs=None):
+        self.columns = [name for name in fieldnames if name != 'IP']
+        self.fieldnames = ['IP', 'VRF'] + self.columns
+        self.vrf = vrf
+        self.vrfs = vrfs or {}
+        self.index = {}
+        self.deletes = []
+        self.lock = threading.Lock()
+        self.counts = {'added': 0, 'changed': 0, 'unchanged': 0, 'deleted': 0}
+
+    def _Text(self,value):
+        # the text csv.DictWriter writes for value
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return str(value)
+
+    def _Digest(self,row):
+        return hashlib.md5('\x1f'.join([self._Text(row.get(column)) for column in self.columns])).digest()
+
+    def _Keys(self,page):
+        # IP -> the (IP, VRF) keys of the hosts of an inventory page
+        keys = {}
+        for host in page:
+            keys.setdefault(host['ip'], []).append((host['ip'], self.vrfs.get(host.get('vrf_id'), self.vrf)))
+        return keys
+
+    def _Clear(self,key):
+        # call with the lock held
+        row = dict([(column, '') for column in self.columns])
+        row['IP'], row['VRF'] = key
+        self.deletes.append(row)
+        self.counts['deleted'] += 1
+
+    def Load(self,csvFile):
+        # the file is read a row at a time; only the digests are kept
+        with open(csvFile, 'rb') as csv_file:
+            reader = csv.reader(csv_file)
+            header = next(reader, None) or []
+            # the download may carry the user_ prefix of the inventory search
+            names = [name[5:] if name.startswith('user_') and name[5:] in self.columns else name for name in header]
+            for values in reader:
+                row = dict(zip(names, values))
+                if not row.get('IP'):
+                    continue
+                if any([row.get(column) for column in self.columns]):
+                    self.index[(row['IP'], row.get('VRF') or self.vrf)] = self._Digest(row)
+        return len(self.index)
+
+    def Changed(self,page,rows):
+        # returns the rows that differ from tetration; page holds the hosts
+        # whose infoblox lookup succeeded, and those of them without a row
+        # lose their annotations
+        changed = []
+        keys = self._Keys(page)
+        with self.lock:
+            for row in rows:
+                # every (IP, VRF) key of the address is seen, so none of
+                # them is left over to be cleared; the row goes up once
+                digest = self._Digest(row)
+                differs = False
+                for key in keys.pop(row['IP'], [(row['IP'], self.vrf)]):
+                    found = self.index.pop(key, None)
+                    if found is None:
+                        self.counts['added'] += 1
+                    elif found != digest:
+                        self.counts['changed'] += 1
+                    else:
+                        self.counts['unchanged'] += 1
+                        continue
+                    differs = True
+                if differs:
+                    changed.append(row)
+            for ip_keys in keys.values():
+                for key in ip_keys:
+                    if self.index.pop(key, None) is not None:
+                        self._Clear(key)
+        return changed
+
+    def Keep(self,page):
+        # the hosts could not be looked up; leave their annotations alone
+        with self.lock:
+            for ip_keys in self._Keys(page).values():
+                for key in ip_keys:
+                    self.index.pop(key, None)
+
+    def Leftover(self):
+        # after a complete sweep, whatever was never seen is gone from the
+        # inventory and loses its annotations too
+        with self.lock:
+            for key in sorted(self.index):
+                self._Clear(key)
+            self.index.clear()
+
+class Lookup_Cache(object):
+    '''
+    Persistent cache of infoblox lookups. Entries live in an SQLite file under
+    /private with a small in-memory LRU in front of it. Each entry is keyed on
+    kind (host, network), network view and IP or CIDR and expires after its
+    TTL. A value of None records that infoblox does not know the key, so
+    negative answers are not asked for again until they expire either.
+    '''
+    def __init__(self,dbFile,ttl=86400,negative_ttl=3600,max_entries=500000,memory_entries=10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.pending = []
+        # entries answered from the cache, marked as used at Close
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(dbFile, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS lookups (kind TEXT, view TEXT, key TEXT, value TEXT, expires REAL, accessed REAL, PRIMARY KEY (kind, view, key))')
+        self.db.commit()
+
+    def _Remember(self,entry,value,expires):
+        self.memory[entry] = (value, expires)
+        if len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def Get(self,kind,view,key):
+        # returns (True, value) on a hit and (False, None) on a miss; value
+        # is None for a cached negative answer
+        entry = (kind, view, key)
+        now = time.time()
+        with self.lock:
+            if entry in self.memory:
+                value, expires = self.memory.pop(entry)
+                if expires > now:
+                    self.memory[entry] = (value, expires)
+                    self.used.add(entry)
+                    self.hits += 1
+                    return (True, value)
+            row = self.db.execute('SELECT value, expires FROM lookups WHERE kind=? AND view=? AND key=?', entry).fetchone()
+            if row is not None and row[1] > now:
+                value = json.loads(row[0]) if row[0] is not None else None
+                self._Remember(entry, value, row[1])
+                self.used.add(entry)
+                self.hits += 1
+                return (True, value)
+            self.misses += 1
+            return (False, None)
+
+    def Put(self,kind,view,key,value):
+        now = time.time()
+        expires = now + (self.ttl if value is not None else self.negative_ttl)
+        with self.lock:
+            self._Remember((kind, view, key), value, expires)
+            # host records are stored in the json of the WAPI object
+            self.pending.append((kind, view, key, json.dumps(value, default=lambda record: record.Wapi()) if value is not None else None, expires, now))
+
+    def Invalidate(self,kind,view,keys):
+        with self.lock:
+            for key in keys:
+                self.memory.pop((kind, view, key), None)
+            self.pending = [entry for entry in self.pending if not (entry[0] == kind and entry[1] == view and entry[2] in keys)]
+            self.db.executemany('DELETE FROM lookups WHERE kind=? AND view=? AND key=?', [(kind, view, key) for key in keys])
+            self.db.commit()
+
+    def Flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if pending:
+                self.db.executemany('INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?, ?, ?)', pending)
+                self.db.commit()
+
+    def Close(self):
+        # write pending entries, mark the hits of the run as used, drop
+        # expired entries and evict the least recently used beyond max_entries
+        self.Flush()
+        with self.lock:
+            now = time.time()
+            used, self.used = self.used, set()
+            self.db.executemany('UPDATE lookups SET accessed=? WHERE kind=? AND view=? AND key=?', [(now,) + entry for entry in used])
+            self.db.execute('DELETE FROM lookups WHERE expires <= ?', (now,))
+            count = self.db.execute('SELECT COUNT(*) FROM lookups').fetchone()[0]
+            if count > self.max_entries:
+                self.db.execute('DELETE FROM lookups WHERE rowid IN (SELECT rowid FROM lookups ORDER BY accessed LIMIT ?)', (count - self.max_entries,))
+            self.db.commit()
+            self.db.close()
+
 class Infoblox_Helper(object):
-    def __init__ (self,opts=None,pigeon=None):
-        self.client = connector.Connector(opts)
+    # number of ipv4address lookups bundled into one WAPI multi-object request
+    BATCH_SIZE = 50
+    HOST_RETURN_FIELDS = 'network,network_view,names,ip_address,extattrs'
+    # networks larger than this are never pulled in full during prefetch
+    PREFETCH_MAX_ADDRESSES = 65536
+    PREFETCH_PAGE_SIZE = 1000
+    # object types watched by the db_objects change feed; extensible
+    # attribute edits show up as changes to these objects
+    CHANGE_OBJECT_TYPES = 'record:host,ipv4address,fixedaddress'
+    CHANGE_PAGE_SIZE = 1000
+    IPV4_PATTERN = re.compile(r'\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b')
+
+    def __init__ (self,opts=None,pigeon=None,batch_size=None,workers=None,cache=None,network_view=None,instrumentation=None,governor=None):
+        self.client = dispatcher.shared(('infoblox', json.dumps(opts, sort_keys=True)),
+                                        lambda: connector.Connector(opts))
+        if instrumentation:
+            instrumentation.WrapSession(self.client.session, 'infoblox', InfobloxEndpoint)
+        if governor:
+            governor.WrapSession(self.client.session, InfobloxEndpoint)
         self.pigeon = pigeon
+        # optional Lookup_Cache consulted before asking infoblox
+        self.cache = cache
+        self.network_view = network_view
         self.boolean = Boolean_Helper()
+        self.batch_size = batch_size if batch_size else self.BATCH_SIZE
+        # never run more workers than the connector's HTTP pool can serve
+        self.workers = workers if workers else self.client.http_pool_maxsize
+        self.round_trips_saved = 0
+        # networks already looked up vs. networks whose addresses were pulled
+        self.known_networks = Subnet_Index()
+        self.prefetched_networks = Subnet_Index()
+        # (network view, IP) -> Host_Record of the prefetched networks
+        self.host_cache = {}
+
+    def ForTenant(self,pigeon):
+        # a helper that reports to the Pigeon of one tenant but shares the
+        # connector, the lookup cache and the prefetched networks, so every
+        # tenant gets the answers any of them looked up
+        helper = copy.copy(self)
+        helper.pigeon = pigeon
+        helper.round_trips_saved = 0
+        return helper
+
+    def PrefetchNetworks(self,pagedData):
+        # find the network covering each IP that isn't already known and pull
+        # every used ipv4address in it with one paged query; GetHost then
+        # answers lookups for those networks from memory
+        view = self.network_view or ''
+        try:
+            for host in pagedData:
+                if IPAddress(host["ip"]) in self.known_networks:
+                    continue
+                query = {'contains_address': host["ip"],'_return_fields': 'network,network_view'}
+                if self.network_view:
+                    # the same range may be defined in other views as well
+                    query['network_view'] = self.network_view
+                networks = self.client.get_object('network',query)
+                if not networks:
+                    continue
+                for network in networks:
+                    cidr = IPNetwork(network["network"])
+                    self.known_networks.Add(cidr)
+                    if cidr.size > self.PREFETCH_MAX_ADDRESSES:
+                        # too large to pull in full; GetHost keeps asking
+                        # about its addresses one batch at a time
+                        continue
+                    addresses = self.client.get_object('ipv4address',{
+                        'network': network["network"],
+                        'network_view': network["network_view"],
+                        'status': 'USED',
+                        '_return_fields': self.HOST_RETURN_FIELDS
+                    }, max_results=self.PREFETCH_PAGE_SIZE, paging=True)
+                    for address in addresses or []:
+                        if (view, address["ip_address"]) not in self.host_cache:
+                            record = Host_Record.FromWapi(address)
+                            self.host_cache[(view, record.ip_address)] = record
+                            if self.cache:
+                                self.cache.Put('host', view, record.ip_address, record)
+                    self.prefetched_networks.Add(cidr)
+        except:
+            self.pigeon.note.update({
+                'status_code': 303,
+                'message' : 'Error prefetching networks from infoblox',
+                'data' : {}
+            })
+            self.pigeon.send()
+
+    def _Wapi(self,method,path,params=None,data=None):
+        # a WAPI call over the session of the connector, which carries its
+        # credentials, TLS settings and connection pool; the connector only
+        # offers its own object calls publicly
+        resp = self.client.session.request(method, self.client.wapi_url + path, params=params,
+                                           data=json.dumps(data) if data is not None else None,
+                                           headers={'Content-type': 'application/json'},
+                                           timeout=self.client.http_request_timeout)
+        if resp.status_code == 401:
+            raise ib_ex.InfobloxBadWAPICredential(response='')
+        return resp
+
+    def _GetHostBatch(self,ips):
+        # POST /wapi/vX/request bundles several GETs into a single round-trip;
+        # results come back as one list per request, in request order
+        batch = [{
+            'method': 'GET',
+            'object': 'ipv4address',
+            'data': self._HostQuery(ip),
+            'args': {'_return_fields': self.HOST_RETURN_FIELDS}
+        } for ip in ips]
+        resp = self._Wapi('POST', 'request', data=batch)
+        if resp.status_code != 200:
+            # fall back to one lookup per IP if the grid rejects the bundle
+            results = []
+            for ip in ips:
+                query = self._HostQuery(ip)
+                query['_return_fields'] = self.HOST_RETURN_FIELDS
+                # a failed search is not an address infoblox does not know:
+                # only the latter may be cached, or taken as no record
+                single = self._Wapi('GET', 'ipv4address', params=query)
+                try:
+                    hosts = json.loads(single.content) if single.status_code == 200 else None
+                except ValueError:
+                    hosts = None
+                if hosts is None:
+                    raise ib_ex.InfobloxConnectionError(reason='Failed to look up ' + ip)
+                results.append([Host_Record.FromWapi(host) for host in hosts])
+        else:
+            # decoded straight into host records, see _parse_reply
+            try:
+                results = Host_Record.Decode(resp.content)
+            except ValueError:
+                raise ib_ex.InfobloxConnectionError(reason=resp.content)
+        if self.cache:
+            for ip, result in zip(ips, results):
+                self.cache.Put('host', self.network_view or '', ip, result[0] if result else None)
+        return results
+
+    def _HostQuery(self,ip):
+        query = {'ip_address': ip}
+        if self.network_view:
+            query['network_view'] = self.network_view
+        return query
 
     def GetHost(self,pagedData):
         host_list = []
         try:
-            for host in pagedData:
-                host_list.append(self.client.get_object('ipv4address',{'ip_address': host["ip"],'_return_fields': 'network,network_view,names,ip_address,extattrs'}))
-                
-            return [host[0] for host in host_list if host != None]
+            ips = [host["ip"] for host in pagedData]
+            if self.prefetched_networks:
+                # prefetched networks only hold used addresses, so an IP in one
+                # of them without a cache entry is unknown to infoblox
+                view = self.network_view or ''
+                host_list.extend([[self.host_cache[(view, ip)]] for ip in ips if (view, ip) in self.host_cache])
+                ips = [ip for ip in ips if (view, ip) not in self.host_cache and IPAddress(ip) not in self.prefetched_networks]
+            if self.cache:
+                misses = []
+                for ip in ips:
+                    hit, host = self.cache.Get('host', self.network_view or '', ip)
+                    if not hit:
+                        misses.append(ip)
+                    elif host is not None:
+                        # entries read back from the file are WAPI dicts
+                        host_list.append([host if isinstance(host, Host_Record) else Host_Record.FromWapi(host)])
+                ips = misses
+            batches = [ips[i:i + self.batch_size] for i in range(0, len(ips), self.batch_size)]
+            if len(batches) > 1:
+                pool = ThreadPool(min(self.workers, len(batches)))
+                try:
+                    results = pool.map(self._GetHostBatch, batches)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                results = [self._GetHostBatch(batch) for batch in batches]
+            for result in results:
+                host_list.extend(result)
+            if self.cache:
+                self.cache.Flush()
+            self.round_trips_saved += len(ips) - len(batches)
+            if self.pigeon and ips:
+                self.pigeon.note.update({
+                    'status_code': 100,
+                    'message' : 'Retrieved ' + str(len(ips)) + ' hosts from infoblox in ' + str(len(batches)) + ' requests (' + str(self.round_trips_saved) + ' round-trips saved so far)',
+                    'data' : {}
+                })
+                self.pigeon.send()
+            return [host[0] for host in host_list if host]
         except:
             self.pigeon.note.update({
                 'status_code': 303,
@@ -245,7 +2019,18 @@ class Infoblox_Helper(object):
 
     def GetSubnet(self,subnet):
         try:
-            return self.client.get_object('network',{'network': subnet})
+            if self.cache:
+                hit, net = self.cache.Get('network', self.network_view or '', subnet)
+                if hit:
+                    return net
+            query = {'network': subnet}
+            if self.network_view:
+                query['network_view'] = self.network_view
+            net = self.client.get_object('network',query)
+            if self.cache:
+                self.cache.Put('network', self.network_view or '', subnet, net)
+                self.cache.Flush()
+            return net
         except:
             self.pigeon.note.update({
                 'status_code': 303,
@@ -254,6 +2039,84 @@ class Infoblox_Helper(object):
             })
             self.pigeon.send()
 
+    def _ChangedIps(self,change):
+        # pull every IPv4 address out of a changed object; deleted objects
+        # only carry a _ref, which for most types still ends in the address
+        changed = change.get("object") or {}
+        if not isinstance(changed, dict):
+            changed = {'_ref': str(changed)}
+        ips = []
+        for addr in changed.get("ipv4addrs", []):
+            if "ipv4addr" in addr:
+                ips.append(addr["ipv4addr"])
+        for field in ["ip_address", "ipv4addr"]:
+            if field in changed:
+                ips.append(changed[field])
+        if not ips and "_ref" in changed:
+            ips.extend(self.IPV4_PATTERN.findall(changed["_ref"]))
+        return ips
+
+    def _GetChanges(self,sequence_id,max_results):
+        query = {
+            'object_types': self.CHANGE_OBJECT_TYPES,
+            '_return_fields': 'last_sequence_id,object,object_type'
+        }
+        if sequence_id is not None:
+            query['start_sequence_id'] = sequence_id
+        return self.client.get_object('db_objects',query,max_results=max_results,paging=False)
+
+    def GetLatestSequenceId(self):
+        # the sequence ID to resume the change feed from after a full sweep;
+        # without start_sequence_id the grid answers with its current sequence
+        try:
+            changes = self._GetChanges(None, 1)
+            if changes:
+                return changes[-1]["last_sequence_id"]
+        except:
+            pass
+        return None
+
+    def GetChangedIps(self,sequence_id):
+        # returns (set of changed IPs, newest sequence ID) or None when the
+        # grid can't serve changes from sequence_id (it's too old or the feed
+        # isn't available) and the caller has to fall back to a full sweep
+        ips = set()
+        try:
+            while True:
+                changes = self._GetChanges(sequence_id, self.CHANGE_PAGE_SIZE)
+                if changes is None:
+                    return None
+                for change in changes:
+                    ips.update(self._ChangedIps(change))
+                    sequence_id = change.get("last_sequence_id", sequence_id)
+                if len(changes) < self.CHANGE_PAGE_SIZE:
+                    break
+        except:
+            return None
+        if self.cache and ips:
+            self.cache.Invalidate('host', self.network_view or '', list(ips))
+        return (ips, sequence_id)
+
+    def CacheMetrics(self):
+        # name -> (help, value) for Instrumentation.Metrics; empty without a cache
+        if not self.cache:
+            return {}
+        lookups = self.cache.hits + self.cache.misses
+        return {
+            'cache_hits': ('Infoblox lookups answered by the cache', self.cache.hits),
+            'cache_misses': ('Infoblox lookups the cache could not answer', self.cache.misses),
+            'cache_hit_ratio': ('Share of Infoblox lookups answered by the cache', float(self.cache.hits) / lookups if lookups else None)
+        }
+
+    def SendCacheStats(self):
+        if self.cache:
+            self.pigeon.note.update({
+                'status_code': 100,
+                'message' : 'Infoblox lookup cache: ' + str(self.cache.hits) + ' hits, ' + str(self.cache.misses) + ' misses',
+                'data' : {'hits': self.cache.hits, 'misses': self.cache.misses}
+            })
+            self.pigeon.send()
+
     def GetExtensibleAttributes(self):
         try:
             return self.client.get_object('extensibleattributedef',{'_return_fields': 'name'})
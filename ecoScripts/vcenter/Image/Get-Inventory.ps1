@@ -11,6 +11,11 @@ saves the annotations to /private. If there is a previously saved version,
 the script does a diff and passes that off to another script to upload to
 Tetration. If there is not a previously saved version, then the script
 passes the entire list of annotations off.
+
+.NOTES
+Kept for reference only: eco_action.py no longer runs this script.
+collect_inventory.py, diff_inventory.py and upload_annotations.py replace it
+and keep its CSV headings and annotation formats.
 #>
 
 <#
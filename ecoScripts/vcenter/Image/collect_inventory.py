@@ -0,0 +1,511 @@
+"""
+This script collects the VM annotations for the specified Datacenter straight
+from the vCenter API and saves them as the current inventory CSV for
+diff_inventory.py. It replaces Get-VMDetails in Get-Inventory.ps1, which
+loaded PowerCLI and pulled VMs one at a time. Here every VM property we need
+comes back from a single PropertyCollector.RetrievePropertiesEx call over a
+ContainerView, paged by maxObjects, and host, network and custom field names
+are resolved from one lookup table each. VM tags are read in bulk from the
+tagging API (see vm_tags.py) and joined onto the VMs in the same pass.
+
+With VCENTER_DELTA_SYNC on, the run after a full sweep only asks vCenter for
+the VMs that changed since then (see delta_sync.py) and patches them into the
+per-VM rows saved in /private, so diff_inventory.py and upload_annotations.py
+only see the annotations that actually moved.
+
+The CSV headings are the same as the ones built by Get-Inventory.ps1.
+
+Keyword environment variables:
+--VCENTER_HOST: hostname or IP address for vCenter
+--VCENTER_PORT: HTTPS port of vCenter (default 443)
+--VCENTER_USER: username with proper capabilities in vCenter
+--VCENTER_PWD: password for vCenter
+--VCENTER_DATACENTER: name of the Datacenter whose VMs should be examined
+--MULTITENANT: on/off; the VRF column is left out in multitenant mode
+--ENABLE_VM_NAME, VM_NAME_ANNOTATION_NAME
+--ENABLE_VM_LOCATION, VM_LOCATION_ANNOTATION_NAME
+--ENABLE_VM_TAGS, VM_TAGS_ANNOTATION_NAME
+--ENABLE_CUSTOM_ATTRIBUTES, CUSTOM_ATTRIBUTES_ANNOTATION_NAME
+--ENABLE_VM_NETWORK, VM_NETWORKS_ANNOTATION_NAME
+--VCENTER_DELTA_SYNC: on/off; keep a PropertyCollector in the session of the
+    eco_action.py worker between runs and only read the VMs that changed
+--VCENTER_FULL_SWEEP_INTERVAL: seconds after which delta mode reads every VM
+    again anyway (default 86400)
+--DEBUG: determines if Pigeons are displayed minimized or with indentation to
+    make them more readable
+
+Copyright (c) 2018 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Doron Chosnek"
+__copyright__ = "Copyright (c) 2018 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+# pylint: disable=invalid-name
+
+import os
+import re
+import csv
+import ssl
+import json
+import time
+import atexit
+import hashlib
+from pyVim.connect import SmartConnect, Disconnect
+from pyVmomi import vim, vmodl
+import vm_tags
+import delta_sync
+import run_metrics
+import dispatcher
+from ip_set import IpSet
+
+# ============================================================================
+# Globals
+# ----------------------------------------------------------------------------
+
+DISPLAY_ON_TEXT = ['on', 'true', '1', 'yes']
+
+# file has the set of IP addresses from the AppScope (non-persistent file)
+IP_FILENAME = 'ip.bin'
+
+# inventory collected during this run (non-persistent); diff_inventory.py
+# compares it with the inventory saved by the previous run
+CURRENT_FILE = 'current.csv'
+
+# number of VMs returned by each RetrievePropertiesEx page
+PAGE_SIZE = 500
+
+# every VM property needed to build an annotation, fetched in one pass
+VM_PROPERTIES = ['name', 'guest.net', 'runtime.host', 'network', 'customValue', 'guest.toolsStatus']
+
+# delta mode state (persistent): a digest of the vCenter session key, the moIds
+# of the PropertyCollector and ContainerView, and the collector version token;
+# never the session cookie
+if os.path.exists('/private'):
+    SYNC_STATE_FILE = '/private/vcenter_sync_state.json'
+    VM_ROWS_FILE = '/private/vcenter_vm_rows.json'
+else:
+    SYNC_STATE_FILE = 'vcenter_sync_state.json'
+    VM_ROWS_FILE = 'vcenter_vm_rows.json'
+
+FULL_SWEEP_INTERVAL = int(os.getenv('VCENTER_FULL_SWEEP_INTERVAL', 86400))
+
+VCENTER_PORT = int(os.getenv('VCENTER_PORT', 443))
+
+IPV4_PATTERN = re.compile(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}')
+
+# ============================================================================
+# Functions
+# ----------------------------------------------------------------------------
+
+def send_pigeon(status, message):
+    ''' prints a pigeon, indented if the DEBUG environment variable is set '''
+    pigeon = {"status_code": status, "data": {}, "message": message}
+    if status >= 400:
+        run_metrics.add(errors=1)
+    if os.getenv('DEBUG'):
+        print json.dumps(pigeon, indent=4)
+    else:
+        print json.dumps(pigeon)
+
+def enabled(name):
+    ''' True if the given environment variable is set to an "on" value '''
+    return os.getenv(name, '').lower() in DISPLAY_ON_TEXT
+
+def get_headings():
+    '''
+    Returns the CSV headings in the same order Get-Inventory.ps1 uses, or an
+    empty list if the user did not enable any annotations.
+    '''
+    headings = []
+    for (switch, name) in [('ENABLE_VM_NAME', 'VM_NAME_ANNOTATION_NAME'),
+                           ('ENABLE_VM_LOCATION', 'VM_LOCATION_ANNOTATION_NAME'),
+                           ('ENABLE_VM_TAGS', 'VM_TAGS_ANNOTATION_NAME'),
+                           ('ENABLE_CUSTOM_ATTRIBUTES', 'CUSTOM_ATTRIBUTES_ANNOTATION_NAME'),
+                           ('ENABLE_VM_NETWORK', 'VM_NETWORKS_ANNOTATION_NAME')]:
+        if enabled(switch):
+            headings.append(os.environ[name])
+    if not headings:
+        return headings
+    if enabled('MULTITENANT'):
+        return ['IP'] + headings
+    return ['IP', 'VRF'] + headings
+
+def vc_connect(share=True):
+    '''
+    Connects to vCenter using params stored in environment variables. With
+    share, a session kept by eco_action.py is reused; release it with
+    vc_disconnect.
+    '''
+    def connect():
+        # required workaround documented at:
+        # https://github.com/vmware/pyvmomi/commit/92c1de5056be7c5390ac2a28eb08ad939a4b7cdd
+        context = ssl._create_unverified_context()
+        return SmartConnect(host=os.environ['VCENTER_HOST'], port=VCENTER_PORT, user=os.environ['VCENTER_USER'],
+                            pwd=os.environ['VCENTER_PWD'], sslContext=context)
+
+    if share:
+        si = dispatcher.shared(('vcenter', os.environ['VCENTER_HOST'], VCENTER_PORT, os.environ['VCENTER_USER'],
+                                os.environ['VCENTER_PWD']), connect, close=Disconnect,
+                               alive=lambda si: si.content.sessionManager.currentSession is not None)
+    else:
+        si = connect()
+    run_metrics.count_stub(si._stub)
+    return si
+
+def vc_disconnect(si):
+    ''' Ends the session of si unless eco_action.py keeps it for reuse. '''
+    if not dispatcher.is_shared(si):
+        Disconnect(si)
+
+def find_datacenter(content, name):
+    ''' Returns the Datacenter object with the given name or None. '''
+    for entity in content.rootFolder.childEntity:
+        if isinstance(entity, vim.Datacenter) and entity.name == name:
+            return entity
+    return None
+
+def retrieve_properties(content, container, obj_type, path_set, page_size=PAGE_SIZE):
+    '''
+    Generator that yields (managed object, {property: value}) for every object
+    of obj_type below container. All objects come from one ContainerView and
+    one PropertyCollector query that is paged by maxObjects, instead of one
+    round-trip per object.
+    '''
+    view = content.viewManager.CreateContainerView(container, [obj_type], True)
+    try:
+        traversal = vmodl.query.PropertyCollector.TraversalSpec(
+            name='traverseEntities', path='view', skip=False, type=vim.view.ContainerView)
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal])
+        prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=obj_type, pathSet=path_set, all=False)
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[prop_spec])
+        options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=page_size)
+
+        collector = content.propertyCollector
+        result = collector.RetrievePropertiesEx([filter_spec], options)
+        while result:
+            for obj in result.objects:
+                yield obj.obj, dict((p.name, p.val) for p in obj.propSet)
+            if not result.token:
+                break
+            result = collector.ContinueRetrievePropertiesEx(result.token)
+    finally:
+        view.Destroy()
+
+def name_lookup(content, container, obj_type):
+    ''' Returns a dictionary of managed object ID -> name for obj_type. '''
+    return dict((obj._moId, props.get('name')) for obj, props in
+                retrieve_properties(content, container, obj_type, ['name']))
+
+def build_rows(vm_props, headings, lookups, ip_set, tags=None):
+    '''
+    Returns one annotation row per IPv4 address of the VM that is part of the
+    Tetration scope, or an empty list if VMware Tools is not running. If
+    ip_set is None, every IPv4 address of the VM gets a row.
+    '''
+    if vm_props.get('guest.toolsStatus') != 'toolsOk':
+        return []
+    rows = []
+    for nic in vm_props.get('guest.net') or []:
+        for ip in nic.ipAddress or []:
+            if not IPV4_PATTERN.match(ip) or (ip_set is not None and ip not in ip_set):
+                continue
+            row = {'IP': ip}
+            # VRF is dropped by the headings in multitenant mode
+            row['VRF'] = 'Default'
+            if enabled('ENABLE_VM_NAME'):
+                row[os.environ['VM_NAME_ANNOTATION_NAME']] = vm_props.get('name')
+            if enabled('ENABLE_VM_LOCATION'):
+                host = vm_props.get('runtime.host')
+                row[os.environ['VM_LOCATION_ANNOTATION_NAME']] = lookups['hosts'].get(host._moId) if host else ''
+            if enabled('ENABLE_VM_TAGS') and tags is not None:
+                row[os.environ['VM_TAGS_ANNOTATION_NAME']] = tags
+            # Networks is a delimited list of every network that the **VM**
+            # is connected to, not just the one this IP address is on
+            if enabled('ENABLE_VM_NETWORK'):
+                row[os.environ['VM_NETWORKS_ANNOTATION_NAME']] = ';'.join(
+                    [lookups['networks'].get(n._moId) or '' for n in vm_props.get('network') or []])
+            if enabled('ENABLE_CUSTOM_ATTRIBUTES'):
+                row[os.environ['CUSTOM_ATTRIBUTES_ANNOTATION_NAME']] = ';'.join(
+                    [u'{}={}'.format(lookups['fields'].get(v.key, v.key), v.value) for v in vm_props.get('customValue') or []])
+            rows.append(row)
+    return rows
+
+def write_unique(rows, headings, path):
+    '''
+    Only saves entries that have unique IP addresses. If an IP address appears
+    more than once, we don't know how to properly annotate it (so we exclude
+    it). Returns the number of rows written. Nothing is written when there
+    are no rows, since diff_inventory.py would take an empty inventory for
+    every VM having been deleted.
+    '''
+    seen = {}
+    for row in rows:
+        seen[row['IP']] = row if row['IP'] not in seen else None
+    unique = [row for row in seen.values() if row is not None]
+    if not unique:
+        return 0
+    unique.sort(key=lambda row: row['IP'])
+    with open(path, 'wb') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=headings, extrasaction='ignore', quoting=csv.QUOTE_ALL)
+        writer.writeheader()
+        for row in unique:
+            # the csv module only writes byte strings
+            writer.writerow(dict((k, v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in row.items()))
+    return len(unique)
+
+def build_lookups(content, datacenter):
+    ''' Returns the host, network and custom field name tables for build_rows. '''
+    lookups = {'hosts': {}, 'networks': {}, 'fields': {}}
+    if enabled('ENABLE_VM_LOCATION'):
+        lookups['hosts'] = name_lookup(content, datacenter.hostFolder, vim.HostSystem)
+    if enabled('ENABLE_VM_NETWORK'):
+        # port group names only, as Get-VDPortgroup gave Get-Inventory.ps1;
+        # standard networks are left empty in the list
+        lookups['networks'] = name_lookup(content, datacenter.networkFolder, vim.dvs.DistributedVirtualPortgroup)
+    if enabled('ENABLE_CUSTOM_ATTRIBUTES') and content.customFieldsManager:
+        lookups['fields'] = dict((f.key, f.name) for f in content.customFieldsManager.field)
+    return lookups
+
+def lookups_digest(lookups):
+    '''
+    Returns a digest of the lookup tables. Renaming a host, network or custom
+    field does not show up as a VM update, so delta mode does a full sweep
+    whenever this changes.
+    '''
+    return hashlib.md5(json.dumps(lookups, sort_keys=True)).hexdigest()
+
+def collect(content, datacenter, headings, ip_set, vm_tags=None):
+    '''
+    Walks every VM of the datacenter and returns the list of annotation rows.
+    vm_tags is an optional dictionary of VM managed object ID -> tag string.
+    '''
+    lookups = build_lookups(content, datacenter)
+
+    rows = []
+    counter = 0
+    for vm, props in retrieve_properties(content, datacenter.vmFolder, vim.VirtualMachine, VM_PROPERTIES):
+        counter += 1
+        if counter % 1000 == 0:
+            send_pigeon(100, "Collected details for {} VMs from vCenter.".format(counter))
+        tags = vm_tags.get(vm._moId, '') if vm_tags is not None else None
+        rows.extend(build_rows(props, headings, lookups, ip_set, tags))
+    run_metrics.add(vms_scanned=counter)
+    return rows
+
+def full_sweep(content, datacenter, headings, lookups, vm_tags=None):
+    '''
+    Creates the delta mode PropertyCollector and reads every VM through it.
+    Returns the collector, its view, the version token and a dictionary of
+    VM managed object ID -> {'tags': tag string, 'rows': rows}. Rows are kept
+    for every IPv4 address so that a change of the Tetration scope does not
+    require another sweep.
+    '''
+    collector, view = delta_sync.create_collector(content, datacenter.vmFolder, vim.VirtualMachine, VM_PROPERTIES)
+    vm_rows = {}
+
+    def handler(kind, vm, props):
+        ''' every VM shows up as an "enter" update with all of its properties '''
+        if kind == 'leave':
+            vm_rows.pop(vm._moId, None)
+            return
+        tags = vm_tags.get(vm._moId, '') if vm_tags is not None else None
+        vm_rows[vm._moId] = {'tags': tags, 'rows': build_rows(props, headings, lookups, None, tags)}
+        if len(vm_rows) % 1000 == 0:
+            send_pigeon(100, "Collected details for {} VMs from vCenter.".format(len(vm_rows)))
+
+    version = delta_sync.wait_for_updates(collector, '', handler)
+    run_metrics.add(vms_scanned=len(vm_rows))
+    return collector, view, version, vm_rows
+
+def apply_updates(collector, version, headings, lookups, vm_rows, vm_tags=None):
+    '''
+    Patches vm_rows with the VMs that entered, left or changed since version
+    and returns the new version with the number of VMs updated and removed.
+    Raises a vmodl fault if the collector or version is no longer valid.
+    '''
+    updates = {}
+
+    def handler(kind, vm, props):
+        ''' keep only the last update of each VM '''
+        updates[vm._moId] = (kind, vm, props)
+
+    version = delta_sync.wait_for_updates(collector, version, handler)
+
+    # "enter" updates carry every property; "modify" ones only what changed
+    modified = [vm for (kind, vm, props) in updates.values() if kind == 'modify']
+    fetched = delta_sync.fetch_properties(collector, modified, vim.VirtualMachine, VM_PROPERTIES)
+
+    removed = 0
+    for mo_id, (kind, vm, props) in updates.items():
+        if kind == 'modify':
+            props = fetched.get(mo_id)
+        if kind == 'leave' or props is None:
+            removed += 1
+            vm_rows.pop(mo_id, None)
+            continue
+        tags = vm_tags.get(mo_id, '') if vm_tags is not None else None
+        vm_rows[mo_id] = {'tags': tags, 'rows': build_rows(props, headings, lookups, None, tags)}
+
+    # tag assignments are not VM properties, so compare them separately
+    if vm_tags is not None:
+        column = os.environ['VM_TAGS_ANNOTATION_NAME']
+        for mo_id, entry in vm_rows.items():
+            tags = vm_tags.get(mo_id, '')
+            if entry['tags'] != tags:
+                entry['tags'] = tags
+                for row in entry['rows']:
+                    row[column] = tags
+                updates[mo_id] = None
+
+    return version, len(updates) - removed, removed
+
+def delta_collect(headings, ip_set):
+    '''
+    Delta mode of the script. Applies the pending PropertyCollector updates
+    to the saved VM rows when the session that holds the collector of the
+    last run is still the one in use, which is the case when the eco_action.py
+    worker kept it, or does a full sweep if the session, the collector or the
+    saved rows are gone, the settings changed or the last full sweep is older
+    than FULL_SWEEP_INTERVAL. A session the worker does not keep is logged
+    out at the end, and its collector with it. Returns the annotation rows in
+    scope.
+    '''
+    state = delta_sync.load_json(SYNC_STATE_FILE)
+    vm_rows = delta_sync.load_json(VM_ROWS_FILE)
+
+    si = vc_connect()
+    try:
+        return delta_rows(si, state, vm_rows, headings, ip_set)
+    finally:
+        vc_disconnect(si)
+
+def delta_rows(si, state, vm_rows, headings, ip_set):
+    ''' delta_collect over the session of si. '''
+    session = hashlib.sha1(si.content.sessionManager.currentSession.key).hexdigest()
+    resumed = bool(state) and state.get('session') == session
+
+    content = si.RetrieveContent()
+    datacenter = find_datacenter(content, os.environ['VCENTER_DATACENTER'])
+    if datacenter is None:
+        send_pigeon(400, "VCENTER datacenter '{}' not found".format(os.environ['VCENTER_DATACENTER']))
+        raise SystemExit(1)
+
+    tags = None
+    if enabled('ENABLE_VM_TAGS'):
+        tags = vm_tags.get_vm_tags(os.environ['VCENTER_HOST'], os.environ['VCENTER_USER'], os.environ['VCENTER_PWD'], VCENTER_PORT)
+
+    lookups = build_lookups(content, datacenter)
+    digest = lookups_digest(lookups)
+
+    version = None
+    if resumed:
+        collector, view = delta_sync.find_collector(si, state['collector'], state['view'])
+        if vm_rows is not None and state.get('headings') == headings and \
+                state.get('datacenter') == os.environ['VCENTER_DATACENTER'] and \
+                state.get('lookups') == digest and \
+                time.time() - state.get('full_sweep', 0) < FULL_SWEEP_INTERVAL:
+            try:
+                version, updated, removed = apply_updates(collector, state['version'], headings,
+                                                          lookups, vm_rows, tags)
+                send_pigeon(100, "Delta sync: {} VMs changed and {} VMs removed since the last run.".format(
+                    updated, removed))
+                run_metrics.add(vms_scanned=updated + removed)
+            except vmodl.MethodFault:
+                version = None
+        if version is None:
+            delta_sync.destroy_collector(collector, view)
+
+    if version is None:
+        collector, view, version, vm_rows = full_sweep(content, datacenter, headings, lookups, tags)
+        send_pigeon(100, "Full sweep: collected details for {} VMs from vCenter.".format(len(vm_rows)))
+        state = {'session': session, 'collector': collector._moId, 'view': view._moId,
+                 'datacenter': os.environ['VCENTER_DATACENTER'], 'headings': headings,
+                 'lookups': digest, 'full_sweep': time.time()}
+
+    # save the rows first; a version token without the rows it applies to
+    # would make the next run miss changes
+    delta_sync.save_json(VM_ROWS_FILE, vm_rows)
+    state['version'] = version
+    delta_sync.save_json(SYNC_STATE_FILE, state)
+
+    return [row for entry in vm_rows.values() for row in entry['rows'] if row['IP'] in ip_set]
+
+# ============================================================================
+# Main
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    # counters are saved however the script ends
+    atexit.register(run_metrics.record)
+
+    # a worker runs every action in the same directory; the inventory of an
+    # earlier run must not be diffed as this one's if this one fails
+    if os.path.exists(CURRENT_FILE):
+        os.remove(CURRENT_FILE)
+
+    # Set up the headings first so that if the user forgot to select any
+    # annotations columns, we report an error without connecting to vCenter.
+    HEADINGS = get_headings()
+    if not HEADINGS:
+        send_pigeon(400, "User must choose at least one attribute for annotations.")
+        raise SystemExit(1)
+
+    # membership tests are bisects of the packed addresses
+    IP_SET = IpSet(IP_FILENAME)
+
+    if enabled('VCENTER_DELTA_SYNC'):
+        # a worker keeps the session, and the PropertyCollector in it, until
+        # the next run; see delta_collect
+        try:
+            ROWS = delta_collect(HEADINGS, IP_SET)
+        except SystemExit:
+            raise
+        except Exception:
+            send_pigeon(400, "Error collecting the inventory from VCENTER")
+            raise SystemExit(1)
+    else:
+        try:
+            VC = vc_connect()
+        except Exception:
+            send_pigeon(400, "Error connecting to VCENTER")
+            raise SystemExit(1)
+
+        CONTENT = VC.RetrieveContent()
+        DC = find_datacenter(CONTENT, os.environ['VCENTER_DATACENTER'])
+        if DC is None:
+            send_pigeon(400, "VCENTER datacenter '{}' not found".format(os.environ['VCENTER_DATACENTER']))
+            vc_disconnect(VC)
+            raise SystemExit(1)
+
+        VM_TAGS = None
+        if enabled('ENABLE_VM_TAGS'):
+            try:
+                VM_TAGS = vm_tags.get_vm_tags(os.environ['VCENTER_HOST'], os.environ['VCENTER_USER'], os.environ['VCENTER_PWD'], VCENTER_PORT)
+            except Exception:
+                send_pigeon(400, "Error retrieving VM tags from VCENTER")
+                vc_disconnect(VC)
+                raise SystemExit(1)
+
+        ROWS = collect(CONTENT, DC, HEADINGS, IP_SET, VM_TAGS)
+        vc_disconnect(VC)
+
+    COUNT = write_unique(ROWS, HEADINGS, CURRENT_FILE)
+    if not COUNT:
+        send_pigeon(400, "No VMs with an IP address in the Tetration scope were found in VCENTER.")
+        raise SystemExit(1)
+    send_pigeon(100, "Found {} IP addresses for annotation.".format(COUNT))
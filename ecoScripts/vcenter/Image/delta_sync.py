@@ -0,0 +1,143 @@
+"""
+Helpers for the delta mode of collect_inventory.py. Instead of reading every
+VM of the Datacenter on each run, a dedicated PropertyCollector with a filter
+over a ContainerView of the VMs is left behind in the vCenter session at the
+end of a full sweep. Its version token is saved in /private, and a next run
+made in the same session, which the eco_action.py worker keeps between
+requests, calls WaitForUpdatesEx with a zero timeout to get only the VMs that
+were added, removed or had a watched property changed since then. The session
+cookie itself is never written out.
+
+Version tokens only mean something to the collector that issued them, and the
+collector only lives as long as the vCenter session, so every helper here
+returns None (or raises a vmodl fault) when the saved state can no longer be
+used and the caller falls back to a full sweep.
+
+Copyright (c) 2018 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Doron Chosnek"
+__copyright__ = "Copyright (c) 2018 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+# pylint: disable=invalid-name
+
+import os
+import json
+from pyVmomi import vim, vmodl
+
+# maximum number of object updates returned by each WaitForUpdatesEx call
+UPDATE_PAGE_SIZE = 500
+
+# ============================================================================
+# Functions
+# ----------------------------------------------------------------------------
+
+def load_json(path):
+    ''' Returns the JSON document saved at path, or None if there is none. '''
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as infile:
+            return json.load(infile)
+    except ValueError:
+        return None
+
+def save_json(path, data):
+    '''
+    Writes data next to path and renames it into place so that a run that
+    dies half way never leaves a truncated state file behind.
+    '''
+    with open(path + '.tmp', 'w') as outfile:
+        json.dump(data, outfile)
+    os.rename(path + '.tmp', path)
+
+def create_collector(content, container, obj_type, path_set):
+    '''
+    Creates a PropertyCollector owned by the current session with a single
+    filter on path_set for every obj_type below container. Returns the
+    collector and the ContainerView; both must outlive this run for the
+    version token to stay valid, so neither is destroyed here.
+    '''
+    view = content.viewManager.CreateContainerView(container, [obj_type], True)
+    traversal = vmodl.query.PropertyCollector.TraversalSpec(
+        name='traverseEntities', path='view', skip=False, type=vim.view.ContainerView)
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal])
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=obj_type, pathSet=path_set, all=False)
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[prop_spec])
+
+    collector = content.propertyCollector.CreatePropertyCollector()
+    collector.CreateFilter(filter_spec, partialUpdates=False)
+    return collector, view
+
+def find_collector(si, collector_id, view_id):
+    ''' Returns the collector and view saved by a previous run, by moId. '''
+    stub = si._stub
+    return (vmodl.query.PropertyCollector(collector_id, stub),
+            vim.view.ContainerView(view_id, stub))
+
+def destroy_collector(collector, view):
+    ''' Removes a collector and its view, ignoring ones that are already gone. '''
+    for obj in [collector, view]:
+        try:
+            obj.Destroy()
+        except vmodl.MethodFault:
+            pass
+
+def wait_for_updates(collector, version, handler):
+    '''
+    Pulls every pending update from collector without blocking and calls
+    handler(kind, obj, props) for each object, where kind is "enter",
+    "modify" or "leave" and props holds the properties that were reported.
+    An empty version returns the current state of every object as "enter"
+    updates. Returns the version to pass next time.
+    '''
+    options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=0, maxObjectUpdates=UPDATE_PAGE_SIZE)
+    while True:
+        update = collector.WaitForUpdatesEx(version, options)
+        # None means nothing has changed since version
+        if update is None:
+            return version
+        version = update.version
+        for filter_update in update.filterSet or []:
+            for obj_update in filter_update.objectSet or []:
+                props = dict((c.name, c.val) for c in obj_update.changeSet or [] if c.op != 'remove')
+                handler(obj_update.kind, obj_update.obj, props)
+        if not update.truncated:
+            return version
+
+def fetch_properties(collector, objs, obj_type, path_set):
+    '''
+    Returns a dictionary of managed object ID -> {property: value} for the
+    given objects in a single RetrievePropertiesEx call. A "modify" update
+    only carries the properties that changed, so this fills in the rest.
+    '''
+    if not objs:
+        return {}
+    obj_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=obj, skip=False) for obj in objs]
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=obj_type, pathSet=path_set, all=False)
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=obj_specs, propSet=[prop_spec])
+    options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=UPDATE_PAGE_SIZE)
+
+    found = {}
+    result = collector.RetrievePropertiesEx([filter_spec], options)
+    while result:
+        for obj in result.objects:
+            found[obj.obj._moId] = dict((p.name, p.val) for p in obj.propSet)
+        if not result.token:
+            break
+        result = collector.ContinueRetrievePropertiesEx(result.token)
+    return found
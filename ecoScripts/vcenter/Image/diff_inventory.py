@@ -0,0 +1,333 @@
+"""
+This script replaces the Get-CsvDiffs step of Get-Inventory.ps1. It compares
+the inventory collected from vCenter during this run with the inventory saved
+by the previous run and writes the rows that have to be sent to Tetration.
+
+The previous inventory is loaded into a dictionary keyed by IP that holds only
+a hash of each row (and the CMDB key columns needed to delete it), and the new
+inventory is streamed against it. The diff is linear in the number of rows,
+unlike the O(N^2) PowerShell version that searched the old file for every new
+row.
+
+With CMDB_RECONCILE on, the baseline is what Tetration actually has instead
+of the saved inventory: the annotations of the scope are downloaded from
+/assets/cmdb/download and streamed into the same index, so annotations that
+were changed or removed in Tetration, or a /private that was wiped, no longer
+make the upload drift from the truth. Rows in Tetration that have none of the
+annotation columns of this integration belong to someone else and are left
+alone. If the download fails, the saved inventory is used.
+
+Output files (non-persistent, in the working directory of the container):
+--upload.csv: rows that are new or changed since the last run
+--delete.csv: rows that have disappeared since the last run, with their key
+    columns and every annotation column of this integration empty. It is
+    uploaded as an add, which clears those columns and leaves the columns
+    of other integrations on the same CMDB row alone.
+The new inventory then replaces the saved one.
+
+Deletes are only sent when the inventory can be trusted. An inventory with no
+rows is not compared at all. When an earlier script of the run reported an
+error (a Tetration page or a vCenter call that failed leaves the inventory
+short of hosts that still exist), or when more than MAX_DELETE_FRACTION of the
+baseline would be deleted, the deletes are held back and the saved inventory
+is kept, so the next run compares against it again.
+
+Keyword environment variables:
+--DEBUG: determines if Pigeons are displayed minimized or with indentation to
+    make them more readable
+--CMDB_RECONCILE: on/off to compare with the annotations downloaded from
+    Tetration rather than with the saved inventory
+--MAX_DELETE_FRACTION: largest share of the baseline a run may delete
+    (default 0.5); 1 allows every row to be deleted
+--MULTITENANT: on/off to indicate if the annotations are in a tenant VRF
+--TENANT_VRF: name of that VRF; ignored if not in multitenant mode
+--TETRATION_ENDPOINT, TETRATION_API_KEY, TETRATION_API_SECRET: Tetration API
+    access, only used with CMDB_RECONCILE
+
+Copyright (c) 2018 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Doron Chosnek"
+__copyright__ = "Copyright (c) 2018 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+# pylint: disable=invalid-name
+
+import os
+import csv
+import json
+import hashlib
+import requests.packages.urllib3
+import run_metrics
+import dispatcher
+
+# ============================================================================
+# Globals
+# ----------------------------------------------------------------------------
+
+# inventory collected during this run (non-persistent)
+CURRENT_FILE = 'current.csv'
+
+# this file is persistent and contains the full inventory of the Datacenter
+if os.path.exists('/private'):
+    INVENTORY_FILE = '/private/inventory.csv'
+else:
+    INVENTORY_FILE = 'inventory.csv'
+
+# these files are not persistent and contain only diffs from last time the
+# script was run
+ANNOTATIONS_DIFF_FILE = 'upload.csv'
+ANNOTATIONS_DELETE_FILE = 'delete.csv'
+
+# annotations downloaded from Tetration (non-persistent)
+CMDB_FILE = 'cmdb.csv'
+
+# columns that identify a record in the Tetration CMDB
+KEY_COLUMNS = ['IP', 'VRF']
+
+DISPLAY_ON_TEXT = ['on', 'true', 'yes', '1', 'okay']
+
+CMDB_RECONCILE = os.getenv('CMDB_RECONCILE', 'off').lower() in DISPLAY_ON_TEXT
+
+MAX_DELETE_FRACTION = float(os.getenv('MAX_DELETE_FRACTION', 0.5))
+
+# the CSV has no VRF column in multitenant mode; its rows belong to the
+# tenant VRF that upload_annotations.py posts them to
+if os.getenv('MULTITENANT', 'off').lower() in DISPLAY_ON_TEXT:
+    APPSCOPE = '/' + os.environ['TENANT_VRF']
+    DEFAULT_VRF = os.environ['TENANT_VRF']
+else:
+    APPSCOPE = ''
+    DEFAULT_VRF = 'Default'
+
+# ============================================================================
+# Functions
+# ----------------------------------------------------------------------------
+
+def row_hash(row, columns):
+    '''
+    Returns a digest of the given columns of a CSV row. Missing columns hash
+    the same as empty ones, which matches the string comparison done by the
+    PowerShell version.
+    '''
+    return hashlib.md5('\x1f'.join([row.get(c) or '' for c in columns])).digest()
+
+def row_key(row, vrf=DEFAULT_VRF):
+    ''' Returns the (IP, VRF) a row is stored under in the Tetration CMDB. '''
+    return (row['IP'], row.get('VRF') or vrf)
+
+def load_previous(path, columns, key_columns):
+    '''
+    Loads the previous inventory into a dictionary of (IP, VRF) -> (row hash,
+    key column values). Only the hash is kept, so memory per row is constant
+    no matter how many annotation columns there are.
+    '''
+    previous = {}
+    if not os.path.exists(path):
+        return previous
+    with open(path, 'rb') as old_file:
+        for row in csv.DictReader(old_file):
+            previous[row_key(row)] = (row_hash(row, columns), [row.get(k) or '' for k in key_columns])
+    return previous
+
+def load_cmdb(path, columns, key_columns, vrf=DEFAULT_VRF):
+    '''
+    Loads a CMDB download into the same index as load_previous. The file is
+    read one row at a time. Rows of other VRFs and rows without a value in
+    any of the annotation columns are skipped, so they are never deleted.
+    '''
+    previous = {}
+    annotations = [c for c in columns if c not in KEY_COLUMNS]
+    with open(path, 'rb') as cmdb_file:
+        reader = csv.reader(cmdb_file)
+        header = next(reader, None) or []
+        # the download may carry the user_ prefix of the inventory search
+        names = [h[5:] if h.startswith('user_') and h[5:] in annotations else h for h in header]
+        for values in reader:
+            row = dict(zip(names, values))
+            if not row.get('IP') or (row.get('VRF') or vrf) != vrf:
+                continue
+            if not any(row.get(c) for c in annotations):
+                continue
+            row['VRF'] = vrf
+            previous[row_key(row)] = (row_hash(row, columns), [row.get(k) or '' for k in key_columns])
+    return previous
+
+def download_cmdb(path):
+    '''
+    Downloads the annotations Tetration has for the scope to path, streaming
+    the response to disk. Returns False if the download failed.
+    '''
+    # imported here so that the diff itself does not need the client
+    from tetpyclient import RestClient
+    restclient = dispatcher.shared(
+        ('tetration', os.environ['TETRATION_ENDPOINT'], os.environ['TETRATION_API_KEY'],
+         os.environ['TETRATION_API_SECRET']),
+        lambda: RestClient(
+            os.environ['TETRATION_ENDPOINT'],
+            api_key=os.environ['TETRATION_API_KEY'],
+            api_secret=os.environ['TETRATION_API_SECRET'],
+            verify=False
+        ))
+    run_metrics.count_session(restclient.session, 'tetration')
+    requests.packages.urllib3.disable_warnings()
+    try:
+        resp = restclient.download(path, '/assets/cmdb/download' + APPSCOPE, timeout=300)
+    except Exception:
+        resp = None
+    if resp is None or resp.status_code != 200:
+        run_metrics.add(errors=1)
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+    return True
+
+def diff_inventory(old_path, new_path, changes_path, deletes_path, inventory_path, cmdb_path=None,
+                   allow_deletes=True, max_delete_fraction=MAX_DELETE_FRACTION):
+    '''
+    Streams the new inventory against the previous one, or against the CMDB
+    download in cmdb_path if one is given. Writes new and changed
+    rows to changes_path, deleted rows with empty annotation columns to
+    deletes_path and
+    a copy of the new inventory to inventory_path. Returns a dictionary with
+    the number of added, changed, deleted and unchanged rows, or None if the
+    new inventory has no rows. Empty output files are removed so the upload
+    script has nothing to do.
+
+    Deletes are held back (counted, but neither written nor dropped from the
+    saved inventory, which is left as it was) unless allow_deletes is set and
+    they are at most max_delete_fraction of the baseline; "held" in the
+    result tells why.
+    '''
+    counts = {'added': 0, 'changed': 0, 'deleted': 0, 'unchanged': 0, 'held': None}
+
+    with open(new_path, 'rb') as new_file:
+        reader = csv.DictReader(new_file)
+        columns = reader.fieldnames
+        # an empty file or just a header means nothing was collected, not
+        # that every VM was deleted
+        if not columns:
+            return None
+        key_columns = [k for k in KEY_COLUMNS if k in columns]
+        if cmdb_path:
+            previous = load_cmdb(cmdb_path, columns, key_columns)
+        else:
+            previous = load_previous(old_path, columns, key_columns)
+
+        # write the new baseline next to the old one and swap it in at the
+        # end so a failure half way through never leaves a partial inventory
+        with open(changes_path, 'wb') as changes_file, \
+                open(inventory_path + '.tmp', 'wb') as inventory_file:
+            changes = csv.DictWriter(changes_file, fieldnames=columns, quoting=csv.QUOTE_ALL)
+            inventory = csv.DictWriter(inventory_file, fieldnames=columns, quoting=csv.QUOTE_ALL)
+            changes.writeheader()
+            inventory.writeheader()
+            for row in reader:
+                inventory.writerow(row)
+                old = previous.pop(row_key(row), None)
+                if old is None:
+                    counts['added'] += 1
+                    changes.writerow(row)
+                elif old[0] != row_hash(row, columns):
+                    counts['changed'] += 1
+                    changes.writerow(row)
+                else:
+                    counts['unchanged'] += 1
+
+    if counts['added'] + counts['changed'] + counts['unchanged'] == 0:
+        os.remove(changes_path)
+        os.remove(inventory_path + '.tmp')
+        return None
+
+    # whatever is left in the previous inventory no longer exists
+    counts['deleted'] = len(previous)
+    baseline = counts['changed'] + counts['unchanged'] + counts['deleted']
+    if previous and not allow_deletes:
+        counts['held'] = 'an earlier step of the run failed'
+    elif previous and counts['deleted'] > max_delete_fraction * baseline:
+        counts['held'] = 'they are more than {:.0%} of the {} annotations'.format(max_delete_fraction, baseline)
+    if counts['held']:
+        # keep the saved inventory, so the next run finds these rows again
+        # and sends the deletes once the inventory is whole
+        os.remove(inventory_path + '.tmp')
+        if os.path.exists(deletes_path):
+            os.remove(deletes_path)
+    elif previous:
+        with open(deletes_path, 'wb') as deletes_file:
+            deletes = csv.writer(deletes_file, quoting=csv.QUOTE_ALL)
+            annotations = [c for c in columns if c not in key_columns]
+            deletes.writerow(key_columns + annotations)
+            blank = [''] * len(annotations)
+            for key in sorted(previous):
+                deletes.writerow(previous[key][1] + blank)
+    elif os.path.exists(deletes_path):
+        os.remove(deletes_path)
+
+    if counts['added'] + counts['changed'] == 0:
+        os.remove(changes_path)
+
+    if not counts['held']:
+        os.rename(inventory_path + '.tmp', inventory_path)
+    return counts
+
+# ============================================================================
+# Main
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    pigeon = {
+        "status_code": 100,
+        "data": {},
+        "message": ""
+    }
+
+    # collect_inventory.py only writes the current inventory when it was able
+    # to collect one; without it there is nothing to compare
+    result = None
+    baseline = 'the saved inventory'
+    if os.path.exists(CURRENT_FILE):
+        cmdb_path = None
+        if CMDB_RECONCILE:
+            if download_cmdb(CMDB_FILE):
+                cmdb_path = CMDB_FILE
+                baseline = 'Tetration'
+            else:
+                baseline = 'the saved inventory (the Tetration download failed)'
+        # errors recorded by get_scope_ips.py or collect_inventory.py mean
+        # the inventory may be missing hosts that still exist
+        result = diff_inventory(INVENTORY_FILE, CURRENT_FILE, ANNOTATIONS_DIFF_FILE,
+                                ANNOTATIONS_DELETE_FILE, INVENTORY_FILE, cmdb_path,
+                                allow_deletes=not run_metrics.load().get('errors'))
+        if cmdb_path:
+            os.remove(cmdb_path)
+    if result:
+        pigeon['message'] = "Found {} new, {} changed and {} deleted annotations compared with {}.".format(
+            result['added'], result['changed'], result['deleted'], baseline)
+        if result['held']:
+            pigeon['message'] += " The deletes were not sent because {}.".format(result['held'])
+        run_metrics.record(annotations_changed=result['added'] + result['changed'],
+                           annotations_deleted=0 if result['held'] else result['deleted'])
+    else:
+        for path in [ANNOTATIONS_DIFF_FILE, ANNOTATIONS_DELETE_FILE]:
+            if os.path.exists(path):
+                os.remove(path)
+        pigeon['message'] = "No current inventory to compare."
+
+    if os.getenv('DEBUG'):
+        print json.dumps(pigeon, indent=4)
+    else:
+        print json.dumps(pigeon)
@@ -0,0 +1 @@
+../../common/dispatcher.py
\ No newline at end of file
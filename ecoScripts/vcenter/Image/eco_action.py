@@ -8,6 +8,9 @@ Keyword environment variables:
     RUN_INTEGRATION, etc.
 --DEBUG: determines if Pigeons are displayed minimized or with indentation to
     make them more readable
+--IN_PROCESS_ACTIONS: "off" runs every script in a new python process
+--ECO_WORKER_SOCKET: socket of a warm worker to hand the action to (see
+    dispatcher.py); started with "python eco_action.py --worker"
 
 The user must supply either a credentials file *OR* the key and secret as
 arguments, but not both.
@@ -32,10 +35,18 @@ __author__ = "Doron Chosnek"
 __copyright__ = "Copyright (c) 2018 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.0"
 
-import subprocess
 import os
+import sys
 import json
 import glob
+import time
+import dispatcher
+import run_metrics
+
+# imported once by a worker before it takes requests
+PRELOAD = ['requests', 'tetpyclient', 'pyVmomi', 'pyVim.connect', 'vm_tags', 'delta_sync', 'ip_set']
+
+DEFAULT_WORKER_SOCKET = '/tmp/eco_action.sock'
 
 def print_message(message):
     '''
@@ -47,46 +58,73 @@ def print_message(message):
     else:
         print json.dumps(message)
 
-# return a message that the container has started
-pigeon = {
-    "status_code": 100,
-    "data": {},
-    "message": "Container has started."
-}
-print_message(pigeon)
-
-if os.getenv('ACTION'):
-
-    if os.environ['ACTION'] == 'TEST_CONNECTIVITY':
-        subprocess.call(["python", "test_connectivity.py"])
-    elif os.environ['ACTION'] == 'RUN_INTEGRATION':
-        subprocess.call(["python", "get_scope_ips.py"])
-        subprocess.call(["pwsh", "Get-Inventory.ps1"])
-        subprocess.call(["python", "upload_annotations.py"])
-    elif os.environ['ACTION'] == 'CLEAR_CACHE':
-        for file in glob.glob("/private/*.txt"):
-            os.remove(file)
-        for file in glob.glob("/private/*.csv"):
-            os.remove(file)
-        pigeon['message'] = "Local cache of annotations deleted."
-        pigeon['status_code'] = 200
-        print_message(pigeon)
-    elif os.environ['ACTION'] == 'FETCH_ITEMS':
-        subprocess.call(["python", "fetch_items.py"])
-    elif os.environ['ACTION'] == 'CUSTOM':
-        pigeon['message'] = "Requested action CUSTOM not implemented."
-        pigeon['status_code'] = 400
-        print_message(pigeon)
+def main():
+    ''' runs the action named by the ACTION environment variable '''
+    # return a message that the container has started
+    pigeon = {
+        "status_code": 100,
+        "data": {},
+        "message": "Container has started."
+    }
+    print_message(pigeon)
+
+    if os.getenv('ACTION'):
+
+        if os.environ['ACTION'] == 'TEST_CONNECTIVITY':
+            dispatcher.call(["python", "test_connectivity.py"])
+        elif os.environ['ACTION'] == 'RUN_INTEGRATION':
+            # every script adds its counters to the run metrics, which are
+            # written for Prometheus together with the time each script took
+            run_metrics.reset()
+            stages = []
+            exit_codes = []
+            for script in ["get_scope_ips.py", "collect_inventory.py", "diff_inventory.py", "upload_annotations.py"]:
+                started = time.time()
+                exit_codes.append(dispatcher.call(["python", script]))
+                stages.append((script[:-3], time.time() - started))
+                # every step works on the files of the one before it
+                if exit_codes[-1]:
+                    pigeon['message'] = "{} failed, the rest of the run was skipped.".format(script)
+                    pigeon['status_code'] = 403
+                    print_message(pigeon)
+                    break
+            run_metrics.write_prometheus(stages, not any(exit_codes) and not run_metrics.load().get('errors'))
+        elif os.environ['ACTION'] == 'CLEAR_CACHE':
+            for file in glob.glob("/private/*.txt"):
+                os.remove(file)
+            for file in glob.glob("/private/*.csv"):
+                os.remove(file)
+            # delta sync state and the VM rows it applies to
+            for file in glob.glob("/private/*.json"):
+                os.remove(file)
+            pigeon['message'] = "Local cache of annotations deleted."
+            pigeon['status_code'] = 200
+            print_message(pigeon)
+        elif os.environ['ACTION'] == 'FETCH_ITEMS':
+            dispatcher.call(["python", "fetch_items.py"])
+        elif os.environ['ACTION'] == 'CUSTOM':
+            pigeon['message'] = "Requested action CUSTOM not implemented."
+            pigeon['status_code'] = 400
+            print_message(pigeon)
+        else:
+            pigeon['message'] = "Requested action not recognized."
+            pigeon['status_code'] = 404
+            print_message(pigeon)
     else:
-        pigeon['message'] = "Requested action not recognized."
+        pigeon['message'] = "The ACTION environment variable is not defined."
         pigeon['status_code'] = 404
         print_message(pigeon)
-else:
-    pigeon['message'] = "The ACTION environment variable is not defined."
-    pigeon['status_code'] = 404
+
+    # print a message that the container has completed its work
+    pigeon['message'] = "Container is stopping."
+    pigeon['status_code'] = 100
     print_message(pigeon)
 
-# print a message that the container has completed its work
-pigeon['message'] = "Container is stopping."
-pigeon['status_code'] = 100
-print_message(pigeon)
+if __name__ == "__main__":
+    SOCKET = os.getenv('ECO_WORKER_SOCKET', DEFAULT_WORKER_SOCKET)
+    if '--worker' in sys.argv:
+        # the scripts are found relative to this directory
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        dispatcher.serve(SOCKET, main, PRELOAD)
+    elif not (os.getenv('ECO_WORKER_SOCKET') and dispatcher.forward(SOCKET)):
+        dispatcher.dispatch(main)
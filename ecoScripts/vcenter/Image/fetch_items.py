@@ -16,6 +16,7 @@ Keyword environment variables:
 --TETRATION_API_KEY: key for Tetration API access
 --TETRATION_API_SECRET: secret for the above key
 --VCENTER_HOST: hostname or IP address for vCenter
+--VCENTER_PORT: HTTPS port of vCenter (default 443)
 --VCENTER_USER: username with proper capabilities in vCenter
 --VCENTER_PWD: password for vCenter
 --DEBUG: determines if Pigeons are displayed minimized or with indentation to
@@ -49,16 +50,18 @@ __license__ = "Cisco Sample Code License, Version 1.0"
 import os
 import ssl
 import json
-from pyVim.connect import SmartConnect
+from pyVim.connect import SmartConnect, Disconnect
 from pyVmomi import vim
 
 import requests.packages.urllib3
 from tetpyclient import RestClient
+import dispatcher
 
 # Disable warnings
 requests.packages.urllib3.disable_warnings()
 
 VC_HOST = os.environ['VCENTER_HOST']
+VC_PORT = int(os.getenv('VCENTER_PORT', 443))
 VC_USER = os.environ['VCENTER_USER']
 VC_PWD = os.environ['VCENTER_PWD']
 TARGET_ITEM = os.environ['FETCH_TARGET']
@@ -68,13 +71,19 @@ TARGET_ITEM = os.environ['FETCH_TARGET']
 # -----------------------------------------------------------------------------
 
 def tet_connect():
-    ''' Connects to Tetration using params stored in environment variables. '''
-    return RestClient(
+    '''
+    Connects to Tetration using params stored in environment variables. The
+    client is reused while eco_action.py keeps it (see dispatcher.py).
+    '''
+    return dispatcher.shared(
+        ('tetration', os.environ['TETRATION_ENDPOINT'], os.environ['TETRATION_API_KEY'],
+         os.environ['TETRATION_API_SECRET']),
+        lambda: RestClient(
             os.environ['TETRATION_ENDPOINT'],
             api_key=os.environ['TETRATION_API_KEY'],
             api_secret=os.environ['TETRATION_API_SECRET'],
             verify=False
-        )
+        ))
 
 def tet_get_vrfs(exclusions):
     ''' Returns list of all VRFs (except exclusions) '''
@@ -109,7 +118,10 @@ if TARGET_ITEM == 'DATACENTERS':
     # https://github.com/vmware/pyvmomi/commit/92c1de5056be7c5390ac2a28eb08ad939a4b7cdd
     context = ssl._create_unverified_context()
 
-    vc = SmartConnect(host=VC_HOST, user=VC_USER, pwd=VC_PWD, sslContext=context)
+    # the same session as collect_inventory.py when eco_action.py keeps it
+    vc = dispatcher.shared(('vcenter', VC_HOST, VC_PORT, VC_USER, VC_PWD),
+                           lambda: SmartConnect(host=VC_HOST, port=VC_PORT, user=VC_USER, pwd=VC_PWD, sslContext=context),
+                           close=Disconnect, alive=lambda si: si.content.sessionManager.currentSession is not None)
 
     content = vc.RetrieveContent()
     # A list comprehension of all the root folder's first tier children...
@@ -1,6 +1,6 @@
 """
 This script retrieves all of the IP addresses found in the specified scope and
-saves them to a JSON file for the next script. This integration only provides
+saves them to a packed IP set file for the next script (see ip_set.py). This integration only provides
 annotations for IP addresses that exist in the specified scope, so this script
 creates that list of IP addresses.
 
@@ -9,6 +9,10 @@ Keyword environment variables:
 --TETRATION_ENDPOINT: URL of the Tetration UI
 --TETRATION_API_KEY: key for Tetration API access
 --TETRATION_API_SECRET: secret for the above key
+--INVENTORY_PARTITIONS: comma separated subnets; the search is split into one
+    partition per subnet plus one for all other addresses, and the cursor of
+    each partition is paged on its own thread
+--INVENTORY_WORKERS: number of partitions paged at the same time (default 4)
 --DEBUG: determines if Pigeons are displayed minimized or with indentation to
     make them more readable
 
@@ -38,19 +42,33 @@ __license__ = "Cisco Sample Code License, Version 1.0"
 # pylint: disable=invalid-name
 
 import os
+import copy
 import json
+from Queue import Queue
+from multiprocessing.pool import ThreadPool
 import requests.packages.urllib3
+from requests.adapters import HTTPAdapter
 import tetpyclient
 from tetpyclient import RestClient
+from ip_set import write_ip_set
+import run_metrics
+import dispatcher
 
 # number of records retrieved per API call to Tetration
 LIMIT = 100
 
-# This file is used to pass a list of IP addresses from the given scope to the
-# Powershell script that reads from vCenter. The file is not persistent because
-# it is saved to the local filesystem of the container and the container is 
-# deleted when it's done
-IP_FILENAME = 'ip.json'
+PARTITIONS = [subnet.strip() for subnet in os.getenv(
+    'INVENTORY_PARTITIONS', '10.0.0.0/9,10.128.0.0/9,172.16.0.0/12,192.168.0.0/16').split(',') if subnet.strip()]
+WORKERS = int(os.getenv('INVENTORY_WORKERS', 4))
+
+# This file is used to pass the set of IP addresses from the given scope to the
+# script that reads from vCenter. The file is not persistent because it is
+# saved to the local filesystem of the container and the container is deleted
+# when it's done
+IP_FILENAME = 'ip.bin'
+
+# what went wrong in the partitions that could not be read to the end
+FAILURES = []
 
 # Disable warnings
 requests.packages.urllib3.disable_warnings()
@@ -60,12 +78,22 @@ requests.packages.urllib3.disable_warnings()
 # Main
 # ----------------------------------------------------------------------------
 
-restclient = RestClient(
-    os.environ['TETRATION_ENDPOINT'],
-    api_key=os.environ['TETRATION_API_KEY'],
-    api_secret=os.environ['TETRATION_API_SECRET'],
-    verify=False
-)
+def tet_connect():
+    ''' Connects to Tetration using params stored in environment variables. '''
+    client = RestClient(
+        os.environ['TETRATION_ENDPOINT'],
+        api_key=os.environ['TETRATION_API_KEY'],
+        api_secret=os.environ['TETRATION_API_SECRET'],
+        verify=False
+    )
+    # the partition readers share one bounded connection pool
+    client.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=WORKERS, pool_block=True))
+    return client
+
+# upload_annotations.py reuses this client when run by eco_action.py
+restclient = dispatcher.shared(('tetration', os.environ['TETRATION_ENDPOINT'], os.environ['TETRATION_API_KEY'],
+                                os.environ['TETRATION_API_SECRET']), tet_connect)
+run_metrics.count_session(restclient.session, 'tetration')
 
 # Payload specifies every IPV4 address in the given scope.
 req_payload = {
@@ -79,37 +107,105 @@ req_payload = {
     "offset": ""
 }
 
-# this block of code gets LIMIT number of IP addresses at a time from Tetration
-# and repeats as long as there are more addresses to retrieve
-ip_list = []
-while True:
-    resp = restclient.post('/openapi/v1/inventory/search', json_body=json.dumps(req_payload))
-
-    if resp.status_code == 200:
-        parsed_resp = json.loads(resp.content)
-        for item in parsed_resp["results"]:
-            ip_list.append(item["ip"])
-
-        if "offset" in parsed_resp:
-            req_payload["offset"] = parsed_resp["offset"]
-        else:
-            break
-    else:
-        break
-
-# save the results to a file
-with open(IP_FILENAME, 'w') as outfile:
-    json.dump(ip_list, outfile)
-
-pigeon = {
-    "status_code": 100,
-    "data": {},
-    "message": "Found {} IP addresses in the Tetration scope.".format(len(ip_list))
-}
+def partition_filters(subnets):
+    '''
+    Returns disjoint filters that together match every address: one per
+    subnet and one for everything outside of them. Cursor paging cannot be
+    split, but each of these has its own cursor.
+    '''
+    if not subnets:
+        return [None]
+    partitions = [{"type": "subnet", "field": "ip", "value": subnet} for subnet in subnets]
+    partitions.append({"type": "not", "filter": {"type": "or", "filters": list(partitions)}})
+    return partitions
+
+def page_partition(partition, out):
+    '''
+    Gets LIMIT number of IP addresses of one partition at a time from
+    Tetration and repeats as long as there are more addresses to retrieve.
+    Each page goes to the out queue and None marks the end of the partition.
+    A partition that fails part way is recorded in FAILURES.
+    '''
+    payload = copy.deepcopy(req_payload)
+    if partition is not None:
+        payload["filter"]["filters"].append(partition)
+    try:
+        while True:
+            resp = restclient.post('/openapi/v1/inventory/search', json_body=json.dumps(payload))
+
+            if resp.status_code == 200:
+                parsed_resp = json.loads(resp.content)
+                out.put([item["ip"] for item in parsed_resp["results"]])
+
+                if "offset" in parsed_resp:
+                    payload["offset"] = parsed_resp["offset"]
+                else:
+                    break
+            else:
+                FAILURES.append("status {}".format(resp.status_code))
+                break
+    except Exception as error:
+        # the pool would drop the exception without a trace
+        FAILURES.append(str(error) or type(error).__name__)
+    finally:
+        out.put(None)
+
+def scope_ips(subnets):
+    '''
+    Generator over the IP addresses of every partition, paged WORKERS
+    partitions at a time and merged in the order the pages arrive. The
+    bounded queue keeps the readers only a few pages ahead of the writer.
+    Addresses that show up in more than one page are removed by write_ip_set.
+    Raises RuntimeError at the end if a partition could not be read, so no
+    partial set of addresses is saved.
+    '''
+    partitions = partition_filters(subnets)
+    out = Queue(maxsize=WORKERS * 2)
+    pool = ThreadPool(WORKERS)
+    for partition in partitions:
+        pool.apply_async(page_partition, (partition, out))
+    pool.close()
+    remaining = len(partitions)
+    while remaining:
+        page = out.get()
+        if page is None:
+            remaining -= 1
+            continue
+        for ip in page:
+            yield ip
+    if FAILURES:
+        raise RuntimeError(', '.join(FAILURES))
+
+# an address set left by an earlier run must not stand in for this one
+if os.path.exists(IP_FILENAME):
+    os.remove(IP_FILENAME)
+
+# save the results to a file without holding every address as a string
+try:
+    ip_count = write_ip_set(scope_ips(PARTITIONS), IP_FILENAME)
+except RuntimeError as error:
+    ip_count = None
+    run_metrics.add(errors=len(FAILURES))
+    pigeon = {
+        "status_code": 403,
+        "data": {},
+        "message": "Error retrieving the IP addresses of the Tetration scope ({}).".format(error)
+    }
+else:
+    pigeon = {
+        "status_code": 100,
+        "data": {},
+        "message": "Found {} IP addresses in the Tetration scope.".format(ip_count)
+    }
+run_metrics.record(hosts_scanned=ip_count or 0)
 
 # send the pigeon... if DEBUG is enabled, then send it with indentation;
 # otherwise send it as minified JSON
 if os.getenv('DEBUG'):
     print json.dumps(pigeon, indent=4)
 else:
-    print json.dumps(pigeon)
\ No newline at end of file
+    print json.dumps(pigeon)
+
+# the rest of RUN_INTEGRATION must not run on a partial scope
+if ip_count is None:
+    raise SystemExit(1)
\ No newline at end of file
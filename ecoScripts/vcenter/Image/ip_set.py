@@ -0,0 +1,165 @@
+"""
+Compact file format for the set of IP addresses in the Tetration scope, which
+get_scope_ips.py hands to the scripts that read from vCenter.
+
+The file is an 8 byte header (the magic "IPS1" followed by the number of
+addresses) and then every IPv4 address of the scope as a sorted, unique,
+packed 32-bit big-endian integer. Big-endian keeps the byte order the same as
+the numeric order. IpSet reads the file straight into an unsigned int array
+instead of parsing it, so a scope of a million addresses costs 4 MB rather
+than the 30 MB or more of a Python set of strings and opens in a few
+milliseconds. The price is the lookup: each membership test is a bisect of
+that array, several times slower than a set lookup (see
+benchmarks/bench_ip_set.py), which is small next to the vCenter calls made
+for the same VMs.
+
+Copyright (c) 2018 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Doron Chosnek"
+__copyright__ = "Copyright (c) 2018 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+# pylint: disable=invalid-name
+
+import os
+import sys
+import heapq
+import bisect
+import array
+import socket
+import struct
+
+MAGIC = 'IPS1'
+HEADER = struct.Struct('!4sI')
+ADDRESS = struct.Struct('!I')
+
+# addresses sorted at a time by write_ip_set before the sorted runs are merged
+SORT_RUN = 65536
+
+# ============================================================================
+# Functions
+# ----------------------------------------------------------------------------
+
+def ip_to_int(ip):
+    ''' Returns the dotted quad IPv4 address as an integer, or None. '''
+    # inet_aton also accepts shorthand such as "10.1", which is not an address
+    # Tetration or vCenter would report
+    if ip.count('.') != 3:
+        return None
+    try:
+        return ADDRESS.unpack(socket.inet_aton(ip))[0]
+    except socket.error:
+        return None
+
+def int_to_ip(value):
+    ''' Returns the integer as a dotted quad IPv4 address. '''
+    return socket.inet_ntoa(ADDRESS.pack(value))
+
+def write_ip_set(ips, path):
+    '''
+    Saves the IPv4 addresses in the iterable ips to path and returns how many
+    unique addresses were written. Anything that is not an IPv4 address is
+    skipped. The addresses are kept in unsigned int arrays, 4 bytes each:
+    runs of SORT_RUN are sorted one at a time, then merged into the file with
+    the duplicates dropped, so no list or set of every address is built.
+    '''
+    runs = []
+    values = array.array('I')
+    for ip in ips:
+        value = ip_to_int(ip)
+        if value is not None:
+            values.append(value)
+            if len(values) == SORT_RUN:
+                runs.append(array.array('I', sorted(values)))
+                values = array.array('I')
+    if values:
+        runs.append(array.array('I', sorted(values)))
+
+    count = 0
+    with open(path + '.tmp', 'wb') as outfile:
+        # the count is filled in once the merge is done
+        outfile.write(HEADER.pack(MAGIC, 0))
+        unique = array.array('I')
+        last = None
+        for value in heapq.merge(*runs):
+            if value != last:
+                unique.append(value)
+                last = value
+                if len(unique) == SORT_RUN:
+                    count += _write_values(unique, outfile)
+                    unique = array.array('I')
+        count += _write_values(unique, outfile)
+        outfile.seek(0)
+        outfile.write(HEADER.pack(MAGIC, count))
+    os.rename(path + '.tmp', path)
+    return count
+
+def _write_values(values, outfile):
+    ''' Writes the array values to outfile big-endian and returns its length. '''
+    if sys.byteorder == 'little':
+        values.byteswap()
+    values.tofile(outfile)
+    return len(values)
+
+# ============================================================================
+# Classes
+# ----------------------------------------------------------------------------
+
+class IpSet(object):
+    '''
+    Read-only set of the IPv4 addresses saved by write_ip_set. Supports "in",
+    len() and iteration in numeric order.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.data = array.array('I')
+        with open(path, 'rb') as infile:
+            header = infile.read(HEADER.size)
+            if len(header) != HEADER.size or HEADER.unpack(header)[0] != MAGIC:
+                raise ValueError("{} is not an IP set file".format(path))
+            self.count = HEADER.unpack(header)[1]
+            try:
+                self.data.fromfile(infile, self.count)
+            except EOFError:
+                raise ValueError("{} is truncated".format(path))
+        if sys.byteorder == 'little':
+            self.data.byteswap()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, ip):
+        value = ip_to_int(ip)
+        if value is None:
+            return False
+        index = bisect.bisect_left(self.data, value)
+        return index < self.count and self.data[index] == value
+
+    def __iter__(self):
+        for value in self.data:
+            yield int_to_ip(value)
+
+    def close(self):
+        ''' Drops the addresses. '''
+        self.data = array.array('I')
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
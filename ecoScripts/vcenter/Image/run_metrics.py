@@ -0,0 +1,194 @@
+"""
+Metrics of one RUN_INTEGRATION run. Every script of the run adds what it did
+(addresses in scope, VMs read, rows uploaded, API calls) to a small JSON file
+in the container, once at the end of the script, and eco_action.py turns the
+file and the time each script took into a Prometheus text file in /public for
+the node exporter textfile collector to pick up.
+
+API calls are counted by wrapping the send method of a requests session or
+the InvokeMethod of a pyVmomi stub, which costs a couple of dictionary updates
+per call.
+
+Copyright (c) 2018 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Doron Chosnek"
+__copyright__ = "Copyright (c) 2018 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+# pylint: disable=invalid-name
+
+import os
+import json
+import time
+import threading
+
+# counters of the current run (non-persistent)
+METRICS_FILE = 'run_metrics.json'
+
+# the node exporter textfile collector only reads files ending in .prom
+PROMETHEUS_FILE = '/public/vcenter.prom'
+PREFIX = 'tetration_integration_'
+LABELS = {'integration': 'vcenter', 'action': 'run_integration'}
+
+HELP = {
+    'last_run_timestamp_seconds': 'Time the run finished',
+    'last_run_duration_seconds': 'Wall time of the run',
+    'last_run_success': '1 if the run finished without errors',
+    'hosts_scanned': 'IP addresses in the Tetration scope',
+    'vms_scanned': 'VMs read from vCenter',
+    'annotations_changed': 'New or changed annotation rows found by the diff',
+    'annotations_deleted': 'Deleted annotation rows found by the diff',
+    'annotations_written': 'Annotation rows accepted by Tetration',
+    'errors': 'Errors reported by the scripts of the run',
+    'bytes_uploaded': 'Annotation bytes accepted by Tetration',
+    'api_calls': 'API calls made by the run',
+    'api_errors': 'API calls that failed',
+    'api_seconds': 'Time spent waiting for API calls',
+    'stage_seconds': 'Wall time per script of the run'
+}
+
+_lock = threading.Lock()
+_calls = {}
+_values = {}
+
+# ============================================================================
+# Functions
+# ----------------------------------------------------------------------------
+
+def _count(service, seconds, failed):
+    with _lock:
+        entry = _calls.setdefault(service, {'calls': 0, 'errors': 0, 'seconds': 0.0})
+        entry['calls'] += 1
+        entry['errors'] += 1 if failed else 0
+        entry['seconds'] += seconds
+
+def count_session(session, service):
+    '''
+    Counts every call made through a requests session as service. Counting a
+    session again (a client shared by eco_action.py) replaces the old hook.
+    '''
+    send = session.__dict__.setdefault('_uncounted_send', session.send)
+    def counted_send(request, **kwargs):
+        start = time.time()
+        failed = True
+        try:
+            resp = send(request, **kwargs)
+            failed = resp.status_code >= 400
+            return resp
+        finally:
+            _count(service, time.time() - start, failed)
+    session.send = counted_send
+
+def count_stub(stub, service='vcenter'):
+    ''' Counts every SOAP call made through a pyVmomi stub as service. '''
+    invoke = stub.__dict__.setdefault('_uncounted_invoke', stub.InvokeMethod)
+    def counted_invoke(*args, **kwargs):
+        start = time.time()
+        failed = True
+        try:
+            result = invoke(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            _count(service, time.time() - start, failed)
+    stub.InvokeMethod = counted_invoke
+
+def add(**values):
+    ''' Adds values to the counters in memory; record saves them. Thread safe. '''
+    with _lock:
+        for name, value in values.items():
+            _values[name] = _values.get(name, 0) + value
+
+def load():
+    ''' Returns the counters of the current run. '''
+    if not os.path.exists(METRICS_FILE):
+        return {}
+    try:
+        with open(METRICS_FILE) as infile:
+            return json.load(infile)
+    except ValueError:
+        return {}
+
+def record(**values):
+    '''
+    Adds values, and everything counted in memory so far, to the counters
+    of the current run. Called once at the end of each script.
+    '''
+    add(**values)
+    metrics = load()
+    calls = metrics.setdefault('api', {})
+    with _lock:
+        for name, value in _values.items():
+            metrics[name] = metrics.get(name, 0) + value
+        counted = dict(_calls)
+        _values.clear()
+        _calls.clear()
+    for service, entry in counted.items():
+        total = calls.setdefault(service, {'calls': 0, 'errors': 0, 'seconds': 0.0})
+        for field in total:
+            total[field] += entry[field]
+    with open(METRICS_FILE + '.tmp', 'w') as outfile:
+        json.dump(metrics, outfile)
+    os.rename(METRICS_FILE + '.tmp', METRICS_FILE)
+
+def reset():
+    ''' Starts the counters of a new run. '''
+    if os.path.exists(METRICS_FILE):
+        os.remove(METRICS_FILE)
+
+def _line(name, labels, value):
+    pairs = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                     for (k, v) in sorted(labels.items()))
+    return '{}{}{{{}}} {}'.format(PREFIX, name, pairs, repr(float(value)))
+
+def write_prometheus(stages, success, path=PROMETHEUS_FILE):
+    '''
+    Writes the counters of the current run, the seconds each script took
+    (a list of (script, seconds)) and whether the run succeeded to path in
+    the Prometheus text format. The file is renamed into place so a scrape
+    never reads half of it. Returns False when the directory of path does
+    not exist (outside the container).
+    '''
+    if not os.path.isdir(os.path.dirname(path)):
+        return False
+    metrics = load()
+    metrics.setdefault('errors', 0)
+    api = metrics.pop('api', {})
+    stages = [(stage, round(seconds, 3)) for (stage, seconds) in stages]
+    samples = {
+        'last_run_timestamp_seconds': [(LABELS, round(time.time(), 3))],
+        'last_run_duration_seconds': [(LABELS, sum(seconds for (_, seconds) in stages))],
+        'last_run_success': [(LABELS, 1 if success else 0)],
+        'stage_seconds': [(dict(LABELS, stage=stage), seconds) for (stage, seconds) in stages]
+    }
+    for name, value in metrics.items():
+        samples[name] = [(LABELS, value)]
+    for field in ['calls', 'errors', 'seconds']:
+        samples['api_' + field] = [(dict(LABELS, service=service), round(entry[field], 3))
+                                   for (service, entry) in sorted(api.items())]
+
+    lines = []
+    for name in sorted(samples):
+        if not samples[name]:
+            continue
+        lines.append('# HELP {}{} {}'.format(PREFIX, name, HELP.get(name, name.replace('_', ' '))))
+        lines.append('# TYPE {}{} gauge'.format(PREFIX, name))
+        lines.extend(_line(name, labels, value) for (labels, value) in samples[name])
+    with open(path + '.tmp', 'w') as outfile:
+        outfile.write('\n'.join(lines) + '\n')
+    os.rename(path + '.tmp', path)
+    return True
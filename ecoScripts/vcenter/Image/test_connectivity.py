@@ -6,6 +6,7 @@ The bulk of the work is handling all of the errors that might arise.
 
 Keyword environment variables:
 --VCENTER_HOST: hostname or IP address for vCenter
+--VCENTER_PORT: HTTPS port of vCenter (default 443)
 --VCENTER_USER: username with proper capabilities in vCenter
 --VCENTER_PWD: password for vCenter
 --DEBUG: determines if Pigeons are displayed minimized or with indentation to
@@ -62,6 +63,7 @@ def test_vcenter():
     status = 200
     return_msg = "vCenter connectivity verified."
     VC_HOST = os.environ['VCENTER_HOST']
+    VC_PORT = int(os.getenv('VCENTER_PORT', 443))
     VC_USER = os.environ['VCENTER_USER']
     VC_PWD = os.environ['VCENTER_PWD']
 
@@ -70,7 +72,7 @@ def test_vcenter():
     context = ssl._create_unverified_context()
 
     try:
-        vc = SmartConnect(host=VC_HOST, user=VC_USER, pwd=VC_PWD, sslContext=context)
+        vc = SmartConnect(host=VC_HOST, port=VC_PORT, user=VC_USER, pwd=VC_PWD, sslContext=context)
     except vmodl.MethodFault as error:
         return_msg = "VCENTER " + error.msg
         status = 400
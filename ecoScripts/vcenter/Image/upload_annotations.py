@@ -1,6 +1,10 @@
 """
 upload_annotations.py uploads an annotations CSV file to Tetration. The CSV
-should be located in local storage.
+should be located in local storage. If diff_inventory.py found VMs that have
+disappeared, their annotations are cleared in Tetration as well: delete.csv
+holds their rows with the annotation columns empty and is uploaded as an add,
+since an X-Tetration-Oper delete would remove the whole CMDB row, columns of
+other integrations included.
 
 Keyword environment variables:
 --MULTITENANT: on/off to indicate if the file should be uploaded to a VRF
@@ -33,10 +37,13 @@ __license__ = "Cisco Sample Code License, Version 1.0"
 # pylint: disable=invalid-name
 
 import os
+import csv
 import json
 import requests.packages.urllib3
 import tetpyclient
 from tetpyclient import RestClient
+import run_metrics
+import dispatcher
 
 # ============================================================================
 # Globals
@@ -46,6 +53,7 @@ from tetpyclient import RestClient
 # script was run; it is non-persistent because it is saved to the local
 # filesystem of the container and the container is deleted when it's done
 ANNOTATIONS_DIFF_FILE = 'upload.csv'
+ANNOTATIONS_DELETE_FILE = 'delete.csv'
 DISPLAY_ON_TEXT = ['on', 'true', 'yes', '1', 'okay']
 
 if os.environ['MULTITENANT'].lower() in DISPLAY_ON_TEXT:
@@ -64,14 +72,21 @@ pigeon = {
     "message": "Annotations posted successfully."
 }
 
-# upload the annotations file if it exists
-if os.path.exists(ANNOTATIONS_DIFF_FILE):
-    restclient = RestClient(
-        os.environ['TETRATION_ENDPOINT'],
-        api_key=os.environ['TETRATION_API_KEY'],
-        api_secret=os.environ['TETRATION_API_SECRET'],
-        verify=False
-    )
+# upload the annotations files if they exist; each file is paired with the
+# operation Tetration should apply to the rows in it
+uploads = [(f, oper) for (f, oper) in [(ANNOTATIONS_DIFF_FILE, 'add'), (ANNOTATIONS_DELETE_FILE, 'add')] if os.path.exists(f)]
+if uploads:
+    # the client of get_scope_ips.py when run by eco_action.py
+    restclient = dispatcher.shared(
+        ('tetration', os.environ['TETRATION_ENDPOINT'], os.environ['TETRATION_API_KEY'],
+         os.environ['TETRATION_API_SECRET']),
+        lambda: RestClient(
+            os.environ['TETRATION_ENDPOINT'],
+            api_key=os.environ['TETRATION_API_KEY'],
+            api_secret=os.environ['TETRATION_API_SECRET'],
+            verify=False
+        ))
+    run_metrics.count_session(restclient.session, 'tetration')
 
     requests.packages.urllib3.disable_warnings()
 
@@ -80,18 +95,36 @@ if os.path.exists(ANNOTATIONS_DIFF_FILE):
     # That is why we add the slash to to the beginning of the APPSCOPE global.
     # When not in multitenant mode, APPSCOPE is just an empty string and the
     # URL will still end without a slash.
-    file_path = '/<path_to_file>/user_annotations.csv'
-    req_payload = [tetpyclient.MultiPartOption(key='X-Tetration-Oper', val='add')]
-    resp = restclient.upload(ANNOTATIONS_DIFF_FILE, '/assets/cmdb/upload' + APPSCOPE, req_payload)
-
-    # if we get an error from Tetration, pass that through to ecohub
-    if resp.status_code != 200:
-        pigeon['status_code'] = resp.status_code
-        pigeon['message'] = resp.text
-
-# if the annotations file doesn't exist, there is nothing to do
+    for (upload_file, oper) in uploads:
+        req_payload = [tetpyclient.MultiPartOption(key='X-Tetration-Oper', val=oper)]
+        try:
+            resp = restclient.upload(upload_file, '/assets/cmdb/upload' + APPSCOPE, req_payload)
+        except requests.exceptions.RequestException:
+            pigeon['status_code'] = 400
+            pigeon['message'] = "Error uploading {} to Tetration.".format(upload_file)
+            run_metrics.add(errors=1)
+            break
+
+        # if we get an error from Tetration, pass that through to ecohub
+        if resp.status_code != 200:
+            pigeon['status_code'] = resp.status_code
+            pigeon['message'] = resp.text
+            run_metrics.add(errors=1)
+            break
+
+        # rows after the header line
+        with open(upload_file, 'rb') as csv_file:
+            rows = sum(1 for _ in csv.reader(csv_file)) - 1
+        run_metrics.add(annotations_written=rows, bytes_uploaded=os.path.getsize(upload_file))
+    run_metrics.record()
+
+# if the annotations files don't exist, there is nothing to do
 else:
     pigeon['message'] = "Nothing to upload."
 
 # send results to ecohub
 print json.dumps(pigeon)
+
+# a failed upload fails the script, so eco_action.py reports the run as failed
+if pigeon['status_code'] != 200:
+    raise SystemExit(1)
@@ -0,0 +1,102 @@
+"""
+Bulk vSphere tag retrieval for the vCenter integration. Get-Inventory.ps1
+resolved tags with one Get-TagAssignment call per VM. This module reads every
+tag and every tag-to-object association from the vSphere Automation tagging
+REST API up front and builds an in-memory index of VM managed object ID ->
+tag names, so enabling VM tags costs a number of calls that depends on the
+number of tags, not on the number of VMs.
+
+Copyright (c) 2018 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.0 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Doron Chosnek"
+__copyright__ = "Copyright (c) 2018 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.0"
+
+# pylint: disable=invalid-name
+
+from multiprocessing.pool import ThreadPool
+import requests
+import requests.packages.urllib3
+import run_metrics
+
+requests.packages.urllib3.disable_warnings()
+
+# tag details are fetched in parallel over one session
+WORKERS = 8
+TIMEOUT = 30
+
+class TaggingClient(object):
+    ''' Minimal client for the /rest/com/vmware/cis tagging endpoints. '''
+
+    def __init__(self, host, user, pwd, port=443):
+        self.base = 'https://{}:{}/rest/com/vmware/cis'.format(host, port)
+        self.session = requests.Session()
+        self.session.verify = False
+        adapter = requests.adapters.HTTPAdapter(pool_connections=WORKERS, pool_maxsize=WORKERS)
+        self.session.mount('https://', adapter)
+        run_metrics.count_session(self.session, 'vcenter_tagging')
+        resp = self.session.post(self.base + '/session', auth=(user, pwd), timeout=TIMEOUT)
+        resp.raise_for_status()
+        self.session.headers['vmware-api-session-id'] = resp.json()['value']
+
+    def get(self, path):
+        resp = self.session.get(self.base + path, timeout=TIMEOUT)
+        resp.raise_for_status()
+        return resp.json()['value']
+
+    def post(self, path, body):
+        resp = self.session.post(self.base + path, json=body, timeout=TIMEOUT)
+        resp.raise_for_status()
+        return resp.json()['value']
+
+    def close(self):
+        try:
+            self.session.delete(self.base + '/session', timeout=TIMEOUT)
+        except requests.exceptions.RequestException:
+            pass
+
+def get_vm_tags(host, user, pwd, port=443):
+    '''
+    Returns a dictionary of VM managed object ID (e.g. vm-123) -> tag names
+    joined with ";", the same format Get-Inventory.ps1 used. Calls made: one
+    to list tags, one per tag for its name (in parallel) and a single bulk
+    association lookup for all tags.
+    '''
+    client = TaggingClient(host, user, pwd, port)
+    try:
+        tag_ids = client.get('/tagging/tag')
+        if not tag_ids:
+            return {}
+
+        pool = ThreadPool(min(WORKERS, len(tag_ids)))
+        try:
+            names = dict(pool.map(lambda t: (t, client.get('/tagging/tag/id:' + t)['name']), tag_ids))
+        finally:
+            pool.close()
+            pool.join()
+
+        associations = client.post('/tagging/tag-association?~action=list-attached-objects-on-tags',
+                                   {'tag_ids': tag_ids})
+    finally:
+        client.close()
+
+    vm_tags = {}
+    for association in associations:
+        for obj in association['object_ids']:
+            if obj['type'] == 'VirtualMachine':
+                vm_tags.setdefault(obj['id'], []).append(names[association['tag_id']])
+    return dict((vm, ';'.join(sorted(tags))) for vm, tags in vm_tags.items())